@@ -1,11 +1,20 @@
+import asyncio
+import contextlib
 import os
 import json
 import re
-from datetime import datetime
-from uuid import uuid4
+from datetime import datetime, timedelta
 import mimetypes
-from flask import Flask, jsonify, request
+import multiprocessing
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from flask_jwt_extended import (
     JWTManager,
     create_access_token,
@@ -14,11 +23,40 @@ from flask_jwt_extended import (
 )
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from services.interfaces import TextExtractor, TextGenerator
-from services.impl import DefaultTextExtractor, GeminiTextGenerator
+import blob_store
+import click
+from job_workers import PollingWorkers
+from services.interfaces import (
+    AsyncTextGenerator,
+    PageExtractor,
+    StreamingTextGenerator,
+    TextExtractor,
+    TextGenerator,
+)
+from gemini_service import generation_context, model_candidates, render_prometheus_metrics, use_fake_backend
+from metrics import PROMETHEUS_CONTENT_TYPE, PrometheusText
+from resilience import DeadlineExceeded, remaining_seconds
+from similarity_cache import MinHashLSHCache
+from extraction_cache import ExtractionCache, file_sha256
+from text_extractor import extractor_version
+from token_budget import DEFAULT_CONTEXT_TOKENS, ShapedText, parse_token_limits, shape_text
+from fake_generator import FakeGenerator
+from services.impl import (
+    AsyncGeminiTextGenerator,
+    DefaultPageExtractor,
+    DefaultTextExtractor,
+    GeminiStreamingTextGenerator,
+    GeminiTextGenerator,
+)
 
 app = Flask(__name__)
 
+# Spawned helper processes (the PDF extraction pool) re-import the script that launched the
+# server, as __mp_main__, when started with `python app.py`. They only need extraction code,
+# so the startup side effects below (schema changes, caches, prewarming, ingest workers) are
+# skipped there. parent_process() is not set yet while that import runs, hence the name check.
+_IS_HELPER_PROCESS = __name__ == '__mp_main__' or multiprocessing.parent_process() is not None
+
 
 
 # Basic configuration
@@ -27,11 +65,113 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'dev-secret-change-me')
 app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16 MB
+# Upper bound on the text kept from one upload (PDFs can expand well past their file size);
+# uploads are extracted page by page and stop here. The kept text is stored as one column, so
+# this is also what bounds extraction memory. Responses report the cap and whether it cut the
+# text. 0 keeps everything.
+app.config['MAX_EXTRACTED_TEXT_CHARS'] = int(
+    os.environ.get('MAX_EXTRACTED_TEXT_CHARS', app.config['MAX_CONTENT_LENGTH'])
+)
+# Ingest mode: "sync" extracts text inside the upload request; "async" stores the file, answers
+# 202 with a job id and leaves extraction to INGEST_WORKERS background threads fed by a durable
+# queue table (0 workers: this process only enqueues, another one drains). Failed jobs are retried
+# with backoff up to INGEST_MAX_ATTEMPTS; a job running longer than INGEST_LEASE_SECONDS is
+# presumed lost with its process and taken over.
+app.config['INGEST_MODE'] = os.environ.get('INGEST_MODE', 'sync')
+app.config['INGEST_WORKERS'] = int(os.environ.get('INGEST_WORKERS', 2))
+app.config['INGEST_POLL_SECONDS'] = float(os.environ.get('INGEST_POLL_SECONDS', 1.0))
+app.config['INGEST_MAX_ATTEMPTS'] = int(os.environ.get('INGEST_MAX_ATTEMPTS', 3))
+app.config['INGEST_LEASE_SECONDS'] = float(os.environ.get('INGEST_LEASE_SECONDS', 600))
+# How long a status subscription stays open waiting for a document to finish
+app.config['INGEST_SUBSCRIBE_TIMEOUT_SECONDS'] = float(os.environ.get('INGEST_SUBSCRIBE_TIMEOUT_SECONDS', 300))
+if app.config['INGEST_MODE'] not in ('sync', 'async'):
+    raise RuntimeError(f"Unknown INGEST_MODE {app.config['INGEST_MODE']!r}; expected 'sync' or 'async'")
+
+# Optional on-disk cache of extracted text keyed by file hash and extractor version, used when
+# documents are re-extracted (`flask reextract-documents`). Empty path disables it.
+app.config['EXTRACTION_CACHE_PATH'] = os.environ.get('EXTRACTION_CACHE_PATH', '')
+app.config['EXTRACTION_CACHE_MAX_BYTES'] = int(os.environ.get('EXTRACTION_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Batch generation limits: prompts per batch, parallel calls per batch, and parallel
+# batch calls across the whole process so one batch cannot starve the others.
+app.config['AI_BATCH_MAX_PROMPTS'] = int(os.environ.get('AI_BATCH_MAX_PROMPTS', 100))
+app.config['AI_BATCH_REQUEST_CONCURRENCY'] = int(os.environ.get('AI_BATCH_REQUEST_CONCURRENCY', 4))
+app.config['AI_BATCH_PROCESS_CONCURRENCY'] = int(os.environ.get('AI_BATCH_PROCESS_CONCURRENCY', 16))
+
+# Overall time budget for AI generation within one request (queueing, attempts and retries)
+app.config['AI_REQUEST_DEADLINE_SECONDS'] = float(os.environ.get('AI_REQUEST_DEADLINE_SECONDS', 60))
+
+# Input shaping for summarize/flashcards: each model call gets at most AI_INPUT_TOKEN_BUDGET
+# (estimated) tokens of the submitted text, further capped by the model's context window less
+# AI_CONTEXT_RESERVE_TOKENS for the prompt template and the reply. Larger texts are split across
+# up to AI_INPUT_MAX_CHUNKS calls (streamed routes make one call), then cut in the middle.
+# AI_MODEL_CONTEXT_TOKENS ("model=tokens,...") adds or overrides context windows. With a budget
+# of 0 (the default) texts are only shaped to fit the context window; 30000 suits the default
+# Gemini models. Texts for models with no known window are then sent as-is.
+app.config['AI_INPUT_TOKEN_BUDGET'] = int(os.environ.get('AI_INPUT_TOKEN_BUDGET', 0))
+app.config['AI_INPUT_MAX_CHUNKS'] = int(os.environ.get('AI_INPUT_MAX_CHUNKS', 4))
+app.config['AI_CONTEXT_RESERVE_TOKENS'] = int(os.environ.get('AI_CONTEXT_RESERVE_TOKENS', 4096))
+app.config['AI_MODEL_CONTEXT_TOKENS'] = {
+    **DEFAULT_CONTEXT_TOKENS,
+    **parse_token_limits(os.environ.get('AI_MODEL_CONTEXT_TOKENS', '')),
+}
+
+# Near-duplicate summaries: serve a cached summary when the submitted text is at least this
+# similar (estimated Jaccard over word shingles) to an earlier one. 0 disables the tier.
+app.config['AI_SUMMARY_SIMILARITY_THRESHOLD'] = float(os.environ.get('AI_SUMMARY_SIMILARITY_THRESHOLD', 0))
+app.config['AI_SUMMARY_SIMILARITY_MAX_ITEMS'] = int(os.environ.get('AI_SUMMARY_SIMILARITY_MAX_ITEMS', 1024))
+app.config['AI_SUMMARY_SIMILARITY_TTL_SECONDS'] = float(os.environ.get('AI_SUMMARY_SIMILARITY_TTL_SECONDS', 3600))
+
+# Which generator backs the AI routes: "gemini", or "fake" for offline load testing
+# (latency and error rate are tuned with the AI_FAKE_* variables, see fake_generator.py)
+app.config['AI_TEXT_GENERATOR'] = os.environ.get('AI_TEXT_GENERATOR', 'gemini')
 
 ALLOWED_EXTENSIONS = {'.pdf', '.txt'}
+# Extracted pages are buffered in memory up to this many characters, then spill to a temp file.
+_EXTRACTION_SPOOL_CHARS = 1024 * 1024
+
+
+def _build_text_generators(kind: str):
+    """
+    Return the (sync, streaming, async) generators for the configured backend.
+
+    "fake" swaps only gemini_service's remote call, so caching, coalescing, the circuit
+    breaker, rate limiting, retries and metrics behave as they do against Gemini.
+    """
+    if kind not in ('gemini', 'fake'):
+        raise RuntimeError(f"Unknown AI_TEXT_GENERATOR {kind!r}; expected 'gemini' or 'fake'")
+    use_fake_backend(FakeGenerator.from_env() if kind == 'fake' else None)
+    return GeminiTextGenerator(), GeminiStreamingTextGenerator(), AsyncGeminiTextGenerator()
+
+
+def _open_extraction_cache() -> ExtractionCache | None:
+    """The configured extraction cache, with entries from older extractor versions purged."""
+    if not app.config['EXTRACTION_CACHE_PATH'] or _IS_HELPER_PROCESS:
+        return None
+    cache = ExtractionCache(app.config['EXTRACTION_CACHE_PATH'], max_bytes=app.config['EXTRACTION_CACHE_MAX_BYTES'])
+    for extension in ALLOWED_EXTENSIONS:
+        cache.purge_other_versions(extension, extractor_version(extension))
+    return cache
+
 
+_extraction_cache = _open_extraction_cache()
 _text_extractor: TextExtractor = DefaultTextExtractor()
-_text_generator: TextGenerator = GeminiTextGenerator()
+_page_extractor: PageExtractor = DefaultPageExtractor()
+_text_generator: TextGenerator
+_streaming_text_generator: StreamingTextGenerator
+_async_text_generator: AsyncTextGenerator
+_text_generator, _streaming_text_generator, _async_text_generator = _build_text_generators(
+    app.config['AI_TEXT_GENERATOR']
+)
+_batch_slots = threading.BoundedSemaphore(app.config['AI_BATCH_PROCESS_CONCURRENCY'])
+_summary_similarity_cache: MinHashLSHCache | None = (
+    MinHashLSHCache(
+        app.config['AI_SUMMARY_SIMILARITY_THRESHOLD'],
+        max_items=app.config['AI_SUMMARY_SIMILARITY_MAX_ITEMS'],
+        ttl_seconds=app.config['AI_SUMMARY_SIMILARITY_TTL_SECONDS'],
+    )
+    if app.config['AI_SUMMARY_SIMILARITY_THRESHOLD'] > 0 else None
+)
 
 db = SQLAlchemy(app)
 jwt = JWTManager(app)
@@ -62,12 +202,80 @@ class Document(db.Model):
     size_bytes = db.Column(db.Integer)
     extracted_text = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Content-addressed file shared with identical uploads; None for documents stored per user
+    blob_id = db.Column(db.Integer, db.ForeignKey('blobs.id'), index=True)
+    # pending -> processing -> ready | failed; None (documents from before async ingest) means ready
+    status = db.Column(db.String(16))
+    status_detail = db.Column(db.Text)
 
     user = db.relationship('User', backref=db.backref('documents', lazy=True))
 
+
+class Blob(db.Model):
+    """One stored copy of an uploaded file, shared by every document with the same bytes."""
+    __tablename__ = 'blobs'
+    __table_args__ = (db.UniqueConstraint('sha256', 'extension'),)
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    # Part of the key: the same bytes uploaded as .txt and .pdf extract differently
+    extension = db.Column(db.String(16), nullable=False)
+    relative_path = db.Column(db.String(1024), nullable=False)
+    size_bytes = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    page_count = db.Column(db.Integer)
+    text_truncated = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ExtractionJob(db.Model):
+    """Durable queue entry: extract one pending document's text in the background."""
+    __tablename__ = 'extraction_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False, index=True)
+    # queued -> running -> done | failed; running jobs go back to queued to be retried
+    status = db.Column(db.String(16), nullable=False, default='queued', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime)
+
+
+def _add_missing_columns() -> None:
+    """
+    Add columns introduced after a table was first created (create_all only creates
+    missing tables). New columns are nullable, so existing rows stay valid.
+    """
+    inspector = sa.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        added = [column for column in table.columns if column.name not in existing]
+        if not added:
+            continue
+        with db.engine.begin() as connection:
+            for column in added:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                connection.execute(sa.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        for index in table.indexes:
+            if any(column in added for column in index.columns):
+                index.create(bind=db.engine, checkfirst=True)
+
+
 # Ensure database tables exist on startup
-with app.app_context():
-    db.create_all()
+if not _IS_HELPER_PROCESS:
+    with app.app_context():
+        db.create_all()
+        _add_missing_columns()
+
+# Build Gemini model clients up front so the first AI request doesn't pay for it
+if os.environ.get('GEMINI_PREWARM_MODELS') and not _IS_HELPER_PROCESS:
+    try:
+        _text_generator.prewarm()
+    except Exception as exc:
+        app.logger.warning('Gemini prewarm skipped: %s', exc)
 
 
 @app.route('/api/hello', methods=['GET'])
@@ -75,6 +283,44 @@ def hello():
     return jsonify({'message': 'Hello from EduBot!', 'status': 'success'})
 
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape target: generation and extraction caches, latency and resilience metrics."""
+    body = render_prometheus_metrics()
+    if _summary_similarity_cache is not None:
+        out = PrometheusText()
+        stats = _summary_similarity_cache.stats()
+        out.sample('summary_similarity_threshold', 'gauge', 'Minimum similarity for a near-duplicate hit.',
+                   stats['threshold'])
+        for name in ('hits', 'near_duplicate_hits', 'misses', 'evictions', 'expirations'):
+            out.sample(f'summary_similarity_{name}_total', 'counter', f'Summary similarity cache {name}.',
+                       stats[name])
+        out.sample('summary_similarity_items', 'gauge', 'Summaries held by the similarity cache.', stats['items'])
+        body += out.render()
+    if _extraction_cache is not None:
+        out = PrometheusText()
+        stats = _extraction_cache.stats()
+        for name in ('hits', 'misses', 'evictions', 'purged', 'errors'):
+            out.sample(f'extraction_cache_{name}_total', 'counter', f'Extraction cache {name}.', stats[name])
+        out.sample('extraction_cache_items', 'gauge', 'Extractions held on disk.', stats['items'])
+        out.sample('extraction_cache_bytes', 'gauge', 'Compressed size of stored extractions.', stats['bytes'])
+        out.sample('extraction_cache_max_bytes', 'gauge', 'Extraction cache size cap.', stats['max_bytes'])
+        body += out.render()
+    if app.config['INGEST_MODE'] == 'async':
+        out = PrometheusText()
+        counts = dict(db.session.query(ExtractionJob.status, sa.func.count()).group_by(ExtractionJob.status).all())
+        for status in ('queued', 'running', 'done', 'failed'):
+            out.sample('ingest_jobs', 'gauge', 'Extraction jobs by status.', counts.get(status, 0),
+                       status=status)
+        stats = _ingest_workers.stats()
+        out.sample('ingest_workers', 'gauge', 'Extraction worker threads in this process.',
+                   stats['workers'] if stats['running'] else 0)
+        out.sample('ingest_worker_errors_total', 'counter', 'Unexpected errors in extraction workers.',
+                   stats['errors'])
+        body += out.render()
+    return Response(body, content_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.route('/api/auth/register', methods=['POST'])
 def register():
     payload = request.get_json(silent=True) or {}
@@ -137,6 +383,64 @@ def _allowed_file(filename: str) -> bool:
 
 
 
+def _collect_pages(pages, max_chars: int = 0):
+    """
+    Join streamed (page_number, text) pairs with newlines into the document text.
+
+    Pages are spooled to a temporary file as they arrive, so page strings are not held
+    alongside the result; peak memory is about one copy of the final text, which is
+    why `max_chars` (0: no limit) must stay set for untrusted uploads. Text past it is
+    dropped and the remaining pages are not extracted. Returns (text, pages read, truncated),
+    where a page cut short counts as read if any of its text was kept.
+    """
+    page_count = 0
+    written = 0
+    truncated = False
+    with tempfile.SpooledTemporaryFile(max_size=_EXTRACTION_SPOOL_CHARS, mode='w+', encoding='utf-8') as spool:
+        for _, page_text in pages:
+            separator = '\n' if page_count else ''
+            room = max_chars - written - len(separator)
+            if max_chars and len(page_text) > room:
+                if room > 0:
+                    spool.write(separator + page_text[:room])
+                    page_count += 1
+                truncated = True
+                break
+            spool.write(separator + page_text)
+            written += len(separator) + len(page_text)
+            page_count += 1
+        if truncated:
+            close = getattr(pages, 'close', None)
+            if close is not None:
+                close()
+        spool.seek(0)
+        return spool.read(), page_count, truncated
+
+
+def _extract_pages(file_path: str, digest: str | None = None, ext: str | None = None):
+    """
+    `_collect_pages` for a stored file, capped at MAX_EXTRACTED_TEXT_CHARS, served from the
+    extraction cache when one is configured. `digest` is the file's sha256, hashed here if
+    not given. Only complete extractions are cached, so a hit is capped like a fresh read.
+    """
+    max_chars = app.config['MAX_EXTRACTED_TEXT_CHARS']
+    cache = _extraction_cache
+    ext = ext or os.path.splitext(file_path)[1].lower()
+    if cache is None or ext not in ALLOWED_EXTENSIONS or not os.path.isfile(file_path):
+        return _collect_pages(_page_extractor(file_path), max_chars)  # let the extractor report problems
+    digest = digest or file_sha256(file_path)
+    version = extractor_version(ext)
+    entry = cache.get_entry(digest, ext, version)
+    if entry is not None:
+        text, page_count = entry
+        truncated = bool(max_chars) and len(text) > max_chars
+        return (text[:max_chars] if truncated else text), page_count, truncated
+    text, page_count, truncated = _collect_pages(_page_extractor(file_path), max_chars)
+    if not truncated:
+        cache.put(digest, ext, version, text, pages=page_count)
+    return text, page_count, truncated
+
+
 @app.route('/api/upload', methods=['POST'])
 @jwt_required()
 def upload_file():
@@ -162,60 +466,518 @@ def upload_file():
 
     original_name = secure_filename(uploaded_file.filename)
     _, ext = os.path.splitext(original_name)
-    unique_name = f"{uuid4().hex}{ext.lower()}"
+    ext = ext.lower()
+    guessed_mime, _ = mimetypes.guess_type(original_name)
+
+    # Hash while streaming to disk so identical uploads share one stored file and one extraction
+    blob_root = os.path.join(app.config['UPLOAD_FOLDER'], 'blobs')
+    temp_path, digest, size_bytes = blob_store.save_stream(uploaded_file.stream, blob_root, suffix=ext)
+
+    reused = _reusable_extraction(digest, ext)
+    # Blobs are shared between users, so only the caller's own earlier upload may change the
+    # response; anything else would tell them that someone else has these bytes.
+    own_copy = reused is not None and _has_own_copy(user_id, digest, ext)
+    ingest_async = app.config['INGEST_MODE'] == 'async' and not own_copy
+    if ingest_async:
+        extracted_text, page_count, truncated = None, None, False
+    elif reused is not None:
+        extracted_text, page_count, truncated = reused
+    else:
+        # Extract text content page by page (SRP: delegated to extractor; DIP: via interface)
+        try:
+            extracted_text, page_count, truncated = _extract_pages(temp_path, digest, ext)
+        except Exception as exc:
+            # Cleanup the saved file if extraction fails
+            blob_store.discard(temp_path)
+            return jsonify({'error': 'failed to extract text from file', 'details': str(exc)}), 400
+
+    # Persist document record, taking a reference on the shared blob
+    try:
+        blob = _acquire_blob(blob_root, digest, ext, temp_path, size_bytes, page_count, truncated)
+        stored_name = os.path.basename(blob.relative_path)
+        document = Document(
+            user_id=user_id,
+            original_name=original_name,
+            stored_name=stored_name,
+            relative_path=blob.relative_path,
+            mime_type=guessed_mime,
+            size_bytes=size_bytes,
+            extracted_text=extracted_text,
+            blob_id=blob.id,
+            status='pending' if ingest_async else 'ready',
+        )
+        db.session.add(document)
+        if ingest_async:
+            db.session.flush()
+            job = ExtractionJob(document_id=document.id)
+            db.session.add(job)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        blob_store.discard(temp_path)
+        raise
+
+    file_info = {
+        'id': document.id,
+        'original_name': original_name,
+        'stored_name': stored_name,
+        'user_id': user_id,
+        'relative_path': document.relative_path,
+        'mime_type': guessed_mime,
+        'size_bytes': size_bytes,
+    }
+    if ingest_async:
+        _ingest_workers.start()
+        _ingest_workers.notify()
+        status_url = f'/api/documents/{document.id}/status'
+        return jsonify({
+            'message': 'file uploaded; text extraction queued',
+            'file': file_info,
+            'job_id': job.id,
+            'status': 'pending',
+            'status_url': status_url,
+        }), 202, {'Location': status_url}
+
+    preview = (extracted_text or '')[:200]
+    return jsonify({
+        'message': 'file uploaded and text extracted successfully',
+        'file': file_info,
+        'extracted_text_chars': len(extracted_text or ''),
+        'extracted_text_preview': preview,
+        'extracted_pages': page_count,
+        'extracted_text_truncated': truncated,
+        'extracted_text_max_chars': app.config['MAX_EXTRACTED_TEXT_CHARS'],
+        'deduplicated': own_copy,
+    }), 201
 
-    user_dir = os.path.join(app.config['UPLOAD_FOLDER'], str(user_id))
-    os.makedirs(user_dir, exist_ok=True)
 
-    save_path = os.path.join(user_dir, unique_name)
-    uploaded_file.save(save_path)
+def _reusable_extraction(digest: str, ext: str):
+    """(text, pages, truncated) already extracted from identical bytes, or None."""
+    blob = Blob.query.filter_by(sha256=digest, extension=ext).first()
+    if blob is None:
+        return None
+    source = (
+        Document.query.filter(Document.blob_id == blob.id, Document.extracted_text.isnot(None))
+        .order_by(Document.id)
+        .first()
+    )
+    if source is None:
+        return None
+    return source.extracted_text, blob.page_count, bool(blob.text_truncated)
+
+
+def _has_own_copy(user_id: int, digest: str, ext: str) -> bool:
+    """Whether the user already has a document with these bytes."""
+    return (
+        db.session.query(Document.id)
+        .join(Blob, Document.blob_id == Blob.id)
+        .filter(Document.user_id == user_id, Blob.sha256 == digest, Blob.extension == ext)
+        .first()
+        is not None
+    )
+
 
-    # Determine metadata
-    guessed_mime, _ = mimetypes.guess_type(save_path)
+def _acquire_blob(blob_root: str, digest: str, ext: str, temp_path: str, size_bytes: int,
+                  page_count: int, truncated: bool) -> Blob:
+    """
+    Count one more reference to the blob for these bytes, creating it if needed, and make
+    sure its file is in place. Runs in the caller's transaction; the reference only
+    counts once the caller commits.
+
+    The increment is a single UPDATE, which takes the database's write lock (SQLite) or
+    row lock before the file is touched, so it cannot interleave with `_release_blob`
+    deleting the same blob.
+    """
+    for _ in range(2):
+        updated = Blob.query.filter_by(sha256=digest, extension=ext).update(
+            {Blob.ref_count: Blob.ref_count + 1}, synchronize_session=False
+        )
+        if updated:
+            blob = Blob.query.filter_by(sha256=digest, extension=ext).one()
+        else:
+            blob = Blob(
+                sha256=digest,
+                extension=ext,
+                relative_path=blob_store.blob_path(blob_root, digest, ext),
+                size_bytes=size_bytes,
+                ref_count=1,
+                page_count=page_count,
+                text_truncated=truncated,
+            )
+            db.session.add(blob)
+            try:
+                db.session.flush()
+            except IntegrityError:
+                # A concurrent upload created it first; count our reference on theirs.
+                db.session.rollback()
+                continue
+        blob_store.place(temp_path, blob.relative_path)
+        return blob
+    raise RuntimeError(f'could not store blob {digest}')
+
+
+def _release_blob(blob_id: int):
+    """
+    Drop one reference; the last one deletes the row and retires the file. Runs in the
+    caller's transaction.
+
+    The file is moved aside while the write lock is held, so a concurrent upload of the
+    same bytes places a fresh copy instead of reusing one about to go. Returns
+    (retired path, blob path) for `_finish_blob_release` once the caller has committed
+    or rolled back, or None when nothing was retired.
+    """
+    Blob.query.filter_by(id=blob_id).update({Blob.ref_count: Blob.ref_count - 1}, synchronize_session=False)
+    blob = db.session.get(Blob, blob_id, populate_existing=True)
+    if blob is None or blob.ref_count > 0:
+        return None
+    db.session.delete(blob)
+    db.session.flush()
     try:
-        size_bytes = os.path.getsize(save_path)
+        tombstone = blob_store.retire(blob.relative_path)
     except OSError:
-        size_bytes = None
+        return None  # Left in place; a stray file is harmless
+    return (tombstone, blob.relative_path) if tombstone else None
+
 
-    # Extract text content (SRP: delegated to extractor; DIP: via interface)
+def _finish_blob_release(retired, committed: bool) -> None:
+    """Delete a retired blob file after its row's deletion committed, or put it back."""
+    if retired is None:
+        return
+    tombstone, path = retired
     try:
-        extracted_text = _text_extractor(save_path)
-    except Exception as exc:
-        # Cleanup the saved file if extraction fails
-        try:
-            os.remove(save_path)
-        except Exception:
-            pass
-        return jsonify({'error': 'failed to extract text from file', 'details': str(exc)}), 400
-
-    # Persist document record
-    document = Document(
-        user_id=user_id,
-        original_name=original_name,
-        stored_name=unique_name,
-        relative_path=f"{user_dir}/{unique_name}",
-        mime_type=guessed_mime,
-        size_bytes=size_bytes,
-        extracted_text=extracted_text,
+        if committed:
+            blob_store.discard(tombstone)
+        else:
+            blob_store.restore(tombstone, path)
+    except OSError:
+        app.logger.warning('Could not %s blob file %s', 'delete' if committed else 'restore', tombstone)
+
+
+# Async ingest: upload_file enqueues an ExtractionJob per new document; worker threads claim
+# jobs with a conditional UPDATE (safe across processes sharing the database) and extract.
+_ingest_changed = threading.Condition()
+
+
+def _notify_ingest_change() -> None:
+    """Wake status subscribers in this process; others notice on their next poll."""
+    with _ingest_changed:
+        _ingest_changed.notify_all()
+
+
+def _claim_extraction_job():
+    now = datetime.utcnow()
+    claimable = sa.or_(
+        sa.and_(ExtractionJob.status == 'queued', ExtractionJob.available_at <= now),
+        sa.and_(
+            ExtractionJob.status == 'running',
+            ExtractionJob.locked_at < now - timedelta(seconds=app.config['INGEST_LEASE_SECONDS']),
+        ),
     )
-    db.session.add(document)
+    for _ in range(5):
+        candidate = (
+            db.session.query(ExtractionJob.id)
+            .filter(claimable)
+            .order_by(ExtractionJob.available_at, ExtractionJob.id)
+            .first()
+        )
+        if candidate is None:
+            return None
+        # Only one worker's UPDATE matches; the others see 0 rows and look again.
+        claimed = ExtractionJob.query.filter(ExtractionJob.id == candidate.id, claimable).update(
+            {
+                ExtractionJob.status: 'running',
+                ExtractionJob.locked_at: now,
+                ExtractionJob.attempts: ExtractionJob.attempts + 1,
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if claimed:
+            return db.session.get(ExtractionJob, candidate.id)
+    return None
+
+
+def _run_next_extraction_job() -> bool:
+    """Claim and run one queued extraction; returns whether there was one."""
+    with app.app_context():
+        job = _claim_extraction_job()
+        if job is None:
+            return False
+        try:
+            _process_extraction_job(job)
+        finally:
+            _notify_ingest_change()
+        return True
+
+
+def _process_extraction_job(job) -> None:
+    document = db.session.get(Document, job.document_id)
+    if document is None:
+        # Deleted while queued
+        job.status, job.finished_at = 'done', datetime.utcnow()
+        db.session.commit()
+        return
+    document.status = 'processing'
     db.session.commit()
 
-    preview = (extracted_text or '')[:200]
-    return jsonify({
-        'message': 'file uploaded and text extracted successfully',
-        'file': {
-            'id': document.id,
-            'original_name': original_name,
-            'stored_name': unique_name,
-            'user_id': user_id,
-            'relative_path': f"{user_dir}/{unique_name}",
-            'mime_type': guessed_mime,
-            'size_bytes': size_bytes,
-        },
-        'extracted_text_chars': len(extracted_text or ''),
-        'extracted_text_preview': preview,
-    }), 201
+    try:
+        blob = db.session.get(Blob, document.blob_id) if document.blob_id is not None else None
+        # An identical upload may have finished first
+        reused = _reusable_extraction(blob.sha256, blob.extension) if blob is not None else None
+        if reused is None:
+            if blob is not None:
+                reused = _extract_pages(document.relative_path, blob.sha256, blob.extension)
+            else:
+                reused = _extract_pages(document.relative_path)
+        extracted_text, page_count, truncated = reused
+    except Exception as exc:
+        db.session.rollback()
+        _fail_extraction_job(job, document, exc)
+        return
+
+    document.extracted_text = extracted_text
+    document.status, document.status_detail = 'ready', None
+    if blob is not None and blob.page_count is None:
+        blob.page_count, blob.text_truncated = page_count, truncated
+    job.status, job.finished_at, job.last_error = 'done', datetime.utcnow(), None
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()  # The document was deleted while it was being extracted
+
+
+def _fail_extraction_job(job, document, exc: Exception) -> None:
+    """Requeue with exponential backoff, or give up after INGEST_MAX_ATTEMPTS."""
+    job.last_error = str(exc)
+    if job.attempts >= app.config['INGEST_MAX_ATTEMPTS']:
+        job.status, job.finished_at = 'failed', datetime.utcnow()
+        document.status, document.status_detail = 'failed', str(exc)
+    else:
+        job.status = 'queued'
+        job.available_at = datetime.utcnow() + timedelta(seconds=2 ** job.attempts)
+        document.status, document.status_detail = 'pending', f'retrying after: {exc}'
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+
+
+_ingest_workers = PollingWorkers(
+    _run_next_extraction_job,
+    workers=app.config['INGEST_WORKERS'] if app.config['INGEST_MODE'] == 'async' and not _IS_HELPER_PROCESS else 0,
+    poll_seconds=app.config['INGEST_POLL_SECONDS'],
+    name='ingest',
+)
+
+
+@app.before_request
+def _start_ingest_workers():
+    # Starts (or, after a fork, restarts) the pool in whichever process serves requests.
+    _ingest_workers.start()
+
+
+# Resume jobs left queued or running by a previous process
+_ingest_workers.start()
+
+
+def _document_status(document) -> dict:
+    job = (
+        ExtractionJob.query.filter_by(document_id=document.id).order_by(ExtractionJob.id.desc()).first()
+    )
+    payload = {
+        'document_id': document.id,
+        'status': document.status or 'ready',
+        'detail': document.status_detail,
+        'job': {'id': job.id, 'status': job.status, 'attempts': job.attempts} if job else None,
+    }
+    if payload['status'] == 'ready':
+        blob = db.session.get(Blob, document.blob_id) if document.blob_id is not None else None
+        payload['extracted_text_chars'] = len(document.extracted_text or '')
+        payload['extracted_text_truncated'] = bool(blob.text_truncated) if blob is not None else False
+        payload['extracted_text_max_chars'] = app.config['MAX_EXTRACTED_TEXT_CHARS']
+    return payload
+
+
+def _generation_scope(identity, deadline: float | None = None):
+    """Attribute generation to the caller and bound it by the request deadline."""
+    if deadline is None:
+        deadline = time.monotonic() + app.config['AI_REQUEST_DEADLINE_SECONDS']
+    return generation_context(user_id=identity, deadline=deadline)
+
+
+def _input_token_budget(model: str | None = None) -> int:
+    """Tokens of source text one call to `model` (or any model it routes to) should carry."""
+    budget = max(0, app.config['AI_INPUT_TOKEN_BUDGET'])
+    contexts = app.config['AI_MODEL_CONTEXT_TOKENS']
+    for name in model_candidates(model):
+        if name in contexts:
+            window = max(1, contexts[name] - app.config['AI_CONTEXT_RESERVE_TOKENS'])
+            budget = min(budget, window) if budget else window
+    return budget
+
+
+def _shape_input(text: str, splittable: bool = True) -> ShapedText:
+    """Size `text` for the configured model: as-is, truncated, or split into several calls."""
+    max_chunks = app.config['AI_INPUT_MAX_CHUNKS'] if splittable else 1
+    return shape_text(text, _input_token_budget(), max_chunks)
+
+
+@contextlib.contextmanager
+def _batch_slot(deadline: float | None):
+    """Hold one of the process-wide batch slots, waiting no longer than the request deadline."""
+    timeout = remaining_seconds(deadline)
+    if not _batch_slots.acquire(timeout=None if timeout is None else max(0.0, timeout)):
+        raise DeadlineExceeded('Gemini generation failed: request deadline exceeded waiting for a batch slot')
+    try:
+        yield
+    finally:
+        _batch_slots.release()
+
+
+def _generate_each(prompts: list, identity, deadline: float | None = None) -> list:
+    """Generate every prompt (in parallel when there are several) under one request deadline."""
+    if deadline is None:
+        deadline = time.monotonic() + app.config['AI_REQUEST_DEADLINE_SECONDS']
+    if len(prompts) == 1:
+        with _generation_scope(identity, deadline):
+            return [_text_generator(prompts[0])]
+
+    def generate(prompt):
+        with _batch_slot(deadline), _generation_scope(identity, deadline):
+            return _text_generator(prompt)
+
+    workers = max(1, min(len(prompts), app.config['AI_BATCH_REQUEST_CONCURRENCY']))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(generate, prompts))
+
+
+async def _agenerate_each(prompts: list, identity, deadline: float | None = None) -> list:
+    with _generation_scope(identity, deadline):
+        return list(await asyncio.gather(*(_async_text_generator(prompt) for prompt in prompts)))
+
+
+def _build_summarize_prompt(text: str) -> str:
+    # Create a prompt for summarization
+    return f"""Please provide a concise summary of the following text. 
+Format the summary as a bulleted list with key points. Each point should be on a new line starting with a bullet (•).
+
+Text to summarize:
+{text}
+
+Summary:"""
+
+
+def _lookup_similar_summary(text: str):
+    """
+    Return (signature, cached summary or None) from the near-duplicate tier.
+
+    Both are None when the tier is disabled; pass the signature to
+    `_remember_summary` once a fresh summary has been generated.
+    """
+    cache = _summary_similarity_cache
+    if cache is None:
+        return None, None
+    signature = cache.signature(text)
+    return signature, cache.get('summarize', signature)
+
+
+def _remember_summary(signature, summary: str) -> None:
+    cache = _summary_similarity_cache
+    if cache is not None and signature is not None:
+        cache.put('summarize', signature, summary)
+
+
+def _build_merge_summaries_prompt(summaries: list) -> str:
+    partials = '\n\n'.join(summaries)
+    return f"""The following are summaries of consecutive parts of one long text.
+Merge them into a single concise summary of the whole text, removing repetition.
+Format the summary as a bulleted list with key points. Each point should be on a new line starting with a bullet (•).
+
+Text to summarize:
+{partials}
+
+Summary:"""
+
+
+def _summarize_shaped(shaped: ShapedText, identity) -> str:
+    """Summarize each chunk, then merge the partial summaries with one more call."""
+    deadline = time.monotonic() + app.config['AI_REQUEST_DEADLINE_SECONDS']
+    summaries = _generate_each([_build_summarize_prompt(chunk) for chunk in shaped.chunks], identity, deadline)
+    if len(summaries) == 1:
+        return summaries[0]
+    return _generate_each([_build_merge_summaries_prompt(summaries)], identity, deadline)[0]
+
+
+async def _asummarize_shaped(shaped: ShapedText, identity) -> str:
+    deadline = time.monotonic() + app.config['AI_REQUEST_DEADLINE_SECONDS']
+    prompts = [_build_summarize_prompt(chunk) for chunk in shaped.chunks]
+    summaries = await _agenerate_each(prompts, identity, deadline)
+    if len(summaries) == 1:
+        return summaries[0]
+    return (await _agenerate_each([_build_merge_summaries_prompt(summaries)], identity, deadline))[0]
+
+
+def _build_flashcards_prompt(text: str) -> str:
+    # Create a prompt for flashcard generation
+    return f"""Based on the following text, generate 5-6 educational flashcards in JSON format.
+Each flashcard should have a "question" and "answer" field. The questions should test understanding of key concepts.
+Return ONLY a valid JSON array, no other text.
+
+Text:
+{text}
+
+Format:
+[
+  {{"question": "Question 1", "answer": "Answer 1"}},
+  {{"question": "Question 2", "answer": "Answer 2"}}
+]
+
+JSON:"""
+
+
+def _parse_flashcards(response: str) -> list:
+    """
+    Extract question/answer pairs from a generated flashcard response.
+
+    Raises:
+        json.JSONDecodeError: if no JSON can be parsed from the response
+        ValueError: if the JSON is not a list or contains no valid flashcards
+    """
+    # Try to extract JSON from the response (Gemini might add extra text)
+    
+    # Try to find JSON array in the response
+    json_match = re.search(r'\[.*\]', response, re.DOTALL)
+    if json_match:
+        flashcards_data = json.loads(json_match.group(0))
+    else:
+        # Fallback: try parsing the whole response
+        flashcards_data = json.loads(response.strip())
+    
+    # Validate structure
+    if not isinstance(flashcards_data, list):
+        raise ValueError("Response is not a list")
+    
+    # Ensure each item has question and answer
+    flashcards = []
+    for item in flashcards_data:
+        if isinstance(item, dict) and 'question' in item and 'answer' in item:
+            flashcards.append({
+                'question': str(item['question']),
+                'answer': str(item['answer'])
+            })
+    
+    if not flashcards:
+        raise ValueError("No valid flashcards generated")
+    return flashcards
+
+
+def _merge_flashcards(card_sets: list) -> list:
+    """Concatenate per-chunk flashcards, dropping questions an earlier chunk already asked."""
+    merged, seen = [], set()
+    for cards in card_sets:
+        merged.extend(card for card in cards if card['question'].strip().lower() not in seen)
+        seen.update(card['question'].strip().lower() for card in cards)
+    return merged
 
 
 @app.route('/api/ai/generate', methods=['POST'])
@@ -235,13 +997,69 @@ def ai_generate():
 
 
     try:
-        text = _text_generator(prompt, model_name=model)
+        with _generation_scope(identity):
+            text = _text_generator(prompt, model_name=model)
     except Exception as exc:
         return jsonify({'error': 'generation failed', 'details': str(exc)}), 400
 
     return jsonify({'output': text})
 
 
+def _generate_batch_item(prompt: str, model: str | None, identity, deadline: float) -> dict:
+    try:
+        with _batch_slot(deadline), _generation_scope(identity, deadline):
+            return {'output': _text_generator(prompt, model_name=model)}
+    except Exception as exc:
+        return {'error': 'generation failed', 'details': str(exc)}
+
+
+@app.route('/api/ai/generate/batch', methods=['POST'])
+@jwt_required()
+def ai_generate_batch():
+    """
+    Generate outputs for a list of prompts in parallel.
+
+    Identical prompts are generated once. Results come back in input order, each
+    either {'output': ...} or {'error': ..., 'details': ...}.
+    """
+    identity = get_jwt_identity()
+    try:
+        int(identity)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid token identity'}), 401
+
+    payload = request.get_json(silent=True) or {}
+    prompts = payload.get('prompts')
+    model = (payload.get('model') or '').strip() or None
+    if not isinstance(prompts, list) or not prompts:
+        return jsonify({'error': 'prompts must be a non-empty list'}), 400
+    if len(prompts) > app.config['AI_BATCH_MAX_PROMPTS']:
+        return jsonify({'error': f"at most {app.config['AI_BATCH_MAX_PROMPTS']} prompts per batch"}), 400
+    if not all(isinstance(prompt, str) and prompt.strip() for prompt in prompts):
+        return jsonify({'error': 'every prompt must be a non-empty string'}), 400
+
+    prompts = [prompt.strip() for prompt in prompts]
+    unique_prompts = list(dict.fromkeys(prompts))
+    try:
+        requested = int(payload.get('concurrency') or app.config['AI_BATCH_REQUEST_CONCURRENCY'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'concurrency must be an integer'}), 400
+    workers = max(1, min(requested, app.config['AI_BATCH_REQUEST_CONCURRENCY'], len(unique_prompts)))
+
+    # One deadline for the whole batch, shared by every item
+    deadline = time.monotonic() + app.config['AI_REQUEST_DEADLINE_SECONDS']
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = dict(zip(
+            unique_prompts,
+            pool.map(lambda prompt: _generate_batch_item(prompt, model, identity, deadline), unique_prompts),
+        ))
+
+    return jsonify({
+        'results': [outcomes[prompt] for prompt in prompts],
+        'unique_prompts': len(unique_prompts),
+    })
+
+
 @app.route('/api/ai/summarize', methods=['POST'])
 @jwt_required()
 def ai_summarize():
@@ -257,18 +1075,15 @@ def ai_summarize():
     if not text:
         return jsonify({'error': 'text is required'}), 400
 
-    # Create a prompt for summarization
-    summarize_prompt = f"""Please provide a concise summary of the following text. 
-Format the summary as a bulleted list with key points. Each point should be on a new line starting with a bullet (•).
-
-Text to summarize:
-{text}
-
-Summary:"""
+    shaped = _shape_input(text)
+    signature, similar = _lookup_similar_summary(text)
+    if similar is not None:
+        return jsonify({'summary': similar, 'meta': shaped.metadata()})
 
     try:
-        summary = _text_generator(summarize_prompt)
-        return jsonify({'summary': summary})
+        summary = _summarize_shaped(shaped, identity)
+        _remember_summary(signature, summary)
+        return jsonify({'summary': summary, 'meta': shaped.metadata()})
     except Exception as exc:
         return jsonify({'error': 'summarization failed', 'details': str(exc)}), 400
 
@@ -288,57 +1103,211 @@ def ai_flashcards():
     if not text:
         return jsonify({'error': 'text is required'}), 400
 
-    # Create a prompt for flashcard generation
-    flashcard_prompt = f"""Based on the following text, generate 5-6 educational flashcards in JSON format.
-Each flashcard should have a "question" and "answer" field. The questions should test understanding of key concepts.
-Return ONLY a valid JSON array, no other text.
+    shaped = _shape_input(text)
+    response = ''
+    try:
+        card_sets = []
+        for response in _generate_each([_build_flashcards_prompt(chunk) for chunk in shaped.chunks], identity):
+            card_sets.append(_parse_flashcards(response))
+        return jsonify({'cards': _merge_flashcards(card_sets), 'meta': shaped.metadata()})
+    except json.JSONDecodeError as exc:
+        return jsonify({'error': 'failed to parse flashcard response', 'details': str(exc), 'raw_response': response[:200]}), 400
+    except Exception as exc:
+        return jsonify({'error': 'flashcard generation failed', 'details': str(exc)}), 400
 
-Text:
-{text}
 
-Format:
-[
-  {{"question": "Question 1", "answer": "Answer 1"}},
-  {{"question": "Question 2", "answer": "Answer 2"}}
-]
+# Async variants of the AI routes (require `Flask[async]`). Remote calls run on the
+# shared asyncio loop in gemini_service rather than blocking in the SDK. Under plain
+# WSGI each request still holds its thread while it awaits; the concurrency win comes
+# from callers that fan out many awaits on one loop.
+@app.route('/api/ai/async/generate', methods=['POST'])
+@jwt_required()
+async def ai_generate_async():
+    """Async variant of /api/ai/generate."""
+    identity = get_jwt_identity()
+    try:
+        int(identity)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid token identity'}), 401
 
-JSON:"""
+    payload = request.get_json(silent=True) or {}
+    prompt = (payload.get('prompt') or '').strip()
+    model = (payload.get('model') or '').strip() or None
+    if not prompt:
+        return jsonify({'error': 'prompt is required'}), 400
 
     try:
-        response = _text_generator(flashcard_prompt)
-        # Try to extract JSON from the response (Gemini might add extra text)
-        
-        # Try to find JSON array in the response
-        json_match = re.search(r'\[.*\]', response, re.DOTALL)
-        if json_match:
-            flashcards_data = json.loads(json_match.group(0))
-        else:
-            # Fallback: try parsing the whole response
-            flashcards_data = json.loads(response.strip())
-        
-        # Validate structure
-        if not isinstance(flashcards_data, list):
-            raise ValueError("Response is not a list")
-        
-        # Ensure each item has question and answer
-        flashcards = []
-        for item in flashcards_data:
-            if isinstance(item, dict) and 'question' in item and 'answer' in item:
-                flashcards.append({
-                    'question': str(item['question']),
-                    'answer': str(item['answer'])
-                })
-        
-        if not flashcards:
-            raise ValueError("No valid flashcards generated")
-        
-        return jsonify({'cards': flashcards})
+        with _generation_scope(identity):
+            text = await _async_text_generator(prompt, model_name=model)
+    except Exception as exc:
+        return jsonify({'error': 'generation failed', 'details': str(exc)}), 400
+
+    return jsonify({'output': text})
+
+
+@app.route('/api/ai/async/summarize', methods=['POST'])
+@jwt_required()
+async def ai_summarize_async():
+    """Async variant of /api/ai/summarize."""
+    identity = get_jwt_identity()
+    try:
+        int(identity)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid token identity'}), 401
+
+    payload = request.get_json(silent=True) or {}
+    text = (payload.get('text') or '').strip()
+    if not text:
+        return jsonify({'error': 'text is required'}), 400
+
+    shaped = _shape_input(text)
+    signature, similar = _lookup_similar_summary(text)
+    if similar is not None:
+        return jsonify({'summary': similar, 'meta': shaped.metadata()})
+
+    try:
+        summary = await _asummarize_shaped(shaped, identity)
+        _remember_summary(signature, summary)
+        return jsonify({'summary': summary, 'meta': shaped.metadata()})
+    except Exception as exc:
+        return jsonify({'error': 'summarization failed', 'details': str(exc)}), 400
+
+
+@app.route('/api/ai/async/flashcards', methods=['POST'])
+@jwt_required()
+async def ai_flashcards_async():
+    """Async variant of /api/ai/flashcards."""
+    identity = get_jwt_identity()
+    try:
+        int(identity)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid token identity'}), 401
+
+    payload = request.get_json(silent=True) or {}
+    text = (payload.get('text') or '').strip()
+    if not text:
+        return jsonify({'error': 'text is required'}), 400
+
+    shaped = _shape_input(text)
+    response = ''
+    try:
+        card_sets = []
+        for response in await _agenerate_each([_build_flashcards_prompt(chunk) for chunk in shaped.chunks], identity):
+            card_sets.append(_parse_flashcards(response))
+        return jsonify({'cards': _merge_flashcards(card_sets), 'meta': shaped.metadata()})
     except json.JSONDecodeError as exc:
         return jsonify({'error': 'failed to parse flashcard response', 'details': str(exc), 'raw_response': response[:200]}), 400
     except Exception as exc:
         return jsonify({'error': 'flashcard generation failed', 'details': str(exc)}), 400
 
 
+def _sse_event(data: dict, event: str | None = None) -> str:
+    prefix = f"event: {event}\n" if event else ''
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+def _sse_response(events) -> Response:
+    return Response(
+        events,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def _stream_generation(prompt: str, model: str | None, error_label: str, user_id, finish=None):
+    """
+    Yield SSE events for a streamed generation: one `data` event per text delta,
+    then a `done` event with the full output (or an `error` event).
+
+    `finish` optionally turns the full output into the `done` payload.
+    """
+    parts = []
+    try:
+        # The body runs after the view returns, so the user is attributed here.
+        with _generation_scope(user_id):
+            for delta in _streaming_text_generator(prompt, model_name=model):
+                parts.append(delta)
+                yield _sse_event({'delta': delta})
+        output = ''.join(parts)
+        yield _sse_event(finish(output) if finish else {'output': output}, event='done')
+    except Exception as exc:
+        yield _sse_event({'error': error_label, 'details': str(exc)}, event='error')
+
+
+@app.route('/api/ai/generate/stream', methods=['POST'])
+@jwt_required()
+def ai_generate_stream():
+    """Stream a Gemini generation as server-sent events."""
+    identity = get_jwt_identity()
+    try:
+        int(identity)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid token identity'}), 401
+
+    payload = request.get_json(silent=True) or {}
+    prompt = (payload.get('prompt') or '').strip()
+    model = (payload.get('model') or '').strip() or None
+    if not prompt:
+        return jsonify({'error': 'prompt is required'}), 400
+
+    return _sse_response(_stream_generation(prompt, model, 'generation failed', identity))
+
+
+@app.route('/api/ai/summarize/stream', methods=['POST'])
+@jwt_required()
+def ai_summarize_stream():
+    """Stream a summary of the provided text as server-sent events."""
+    identity = get_jwt_identity()
+    try:
+        int(identity)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid token identity'}), 401
+
+    payload = request.get_json(silent=True) or {}
+    text = (payload.get('text') or '').strip()
+    if not text:
+        return jsonify({'error': 'text is required'}), 400
+
+    # One streamed call, so oversized texts are truncated rather than split.
+    shaped = _shape_input(text, splittable=False)
+    signature, similar = _lookup_similar_summary(text)
+    if similar is not None:
+        return _sse_response(iter([
+            _sse_event({'delta': similar}),
+            _sse_event({'summary': similar, 'meta': shaped.metadata()}, event='done'),
+        ]))
+
+    def finish(output):
+        _remember_summary(signature, output)
+        return {'summary': output, 'meta': shaped.metadata()}
+
+    return _sse_response(_stream_generation(
+        _build_summarize_prompt(shaped.text), None, 'summarization failed', identity, finish=finish,
+    ))
+
+
+@app.route('/api/ai/flashcards/stream', methods=['POST'])
+@jwt_required()
+def ai_flashcards_stream():
+    """Stream flashcard generation as server-sent events; the `done` event carries the parsed cards."""
+    identity = get_jwt_identity()
+    try:
+        int(identity)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid token identity'}), 401
+
+    payload = request.get_json(silent=True) or {}
+    text = (payload.get('text') or '').strip()
+    if not text:
+        return jsonify({'error': 'text is required'}), 400
+
+    shaped = _shape_input(text, splittable=False)
+    return _sse_response(_stream_generation(
+        _build_flashcards_prompt(shaped.text), None, 'flashcard generation failed', identity,
+        finish=lambda output: {'cards': _parse_flashcards(output), 'meta': shaped.metadata()},
+    ))
+
+
 @app.route('/api/documents', methods=['GET'])
 @jwt_required()
 def list_documents():
@@ -363,6 +1332,7 @@ def list_documents():
             'size_bytes': doc.size_bytes,
             'created_at': doc.created_at.isoformat(),
             'extracted_text_length': len(doc.extracted_text or ''),
+            'status': doc.status or 'ready',
         } for doc in documents]
     })
 
@@ -393,10 +1363,72 @@ def get_document(doc_id):
             'created_at': document.created_at.isoformat(),
             'extracted_text': document.extracted_text,
             'extracted_text_length': len(document.extracted_text or ''),
+            'status': document.status or 'ready',
         }
     })
 
 
+def _owned_document(doc_id):
+    """(document, None) for the caller's document, or (None, error response)."""
+    identity = get_jwt_identity()
+    try:
+        user_id = int(identity)
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'invalid token identity'}), 401)
+
+    document = db.session.get(Document, doc_id)
+    if not document:
+        return None, (jsonify({'error': 'document not found'}), 404)
+    if document.user_id != user_id:
+        return None, (jsonify({'error': 'unauthorized'}), 403)
+    return document, None
+
+
+@app.route('/api/documents/<int:doc_id>/status', methods=['GET'])
+@jwt_required()
+def document_status(doc_id):
+    """Poll a document's text extraction: pending, processing, ready or failed."""
+    document, error = _owned_document(doc_id)
+    if error:
+        return error
+    return jsonify(_document_status(document))
+
+
+@app.route('/api/documents/<int:doc_id>/status/stream', methods=['GET'])
+@jwt_required()
+def document_status_stream(doc_id):
+    """Subscribe to a document's extraction status over Server-Sent Events until it settles."""
+    document, error = _owned_document(doc_id)
+    if error:
+        return error
+    deadline = time.monotonic() + app.config['INGEST_SUBSCRIBE_TIMEOUT_SECONDS']
+
+    def events():
+        last = None
+        while True:
+            db.session.expire_all()
+            current = db.session.get(Document, doc_id)
+            if current is None:
+                yield _sse_event({'document_id': doc_id, 'status': 'deleted'}, event='done')
+                return
+            payload = _document_status(current)
+            if payload != last:
+                settled = payload['status'] in ('ready', 'failed')
+                yield _sse_event(payload, event='done' if settled else 'status')
+                if settled:
+                    return
+                last = payload
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield _sse_event({'document_id': doc_id, 'status': payload['status']}, event='timeout')
+                return
+            # Woken by this process's workers; jobs run elsewhere are seen on the next poll.
+            with _ingest_changed:
+                _ingest_changed.wait(min(remaining, app.config['INGEST_POLL_SECONDS']))
+
+    return _sse_response(stream_with_context(events()))
+
+
 @app.route('/api/documents/<int:doc_id>', methods=['DELETE'])
 @jwt_required()
 def delete_document(doc_id):
@@ -414,6 +1446,21 @@ def delete_document(doc_id):
     if document.user_id != user_id:
         return jsonify({'error': 'unauthorized'}), 403
 
+    ExtractionJob.query.filter_by(document_id=document.id).delete(synchronize_session=False)
+    if document.blob_id is not None:
+        # Shared file: removed only with its last document
+        blob_id = document.blob_id
+        db.session.delete(document)
+        retired = _release_blob(blob_id)
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            _finish_blob_release(retired, committed=False)
+            raise
+        _finish_blob_release(retired, committed=True)
+        return jsonify({'message': 'document deleted successfully'}), 200
+
     # Delete the physical file
     try:
         if os.path.exists(document.relative_path):
@@ -428,6 +1475,40 @@ def delete_document(doc_id):
     return jsonify({'message': 'document deleted successfully'}), 200
 
 
+@app.cli.command('reextract-documents')
+def reextract_documents():
+    """
+    Re-extract every document's text from its stored file, e.g. after an extractor upgrade.
+
+    Documents still queued for async ingest are left to their extraction job.
+    """
+    updated = missing = failed = skipped = 0
+    for document in Document.query.order_by(Document.id).yield_per(100):
+        if document.status in ('pending', 'processing'):
+            skipped += 1
+            continue
+        if not os.path.isfile(document.relative_path):
+            missing += 1
+            continue
+        blob = db.session.get(Blob, document.blob_id) if document.blob_id is not None else None
+        try:
+            if blob is not None:
+                text, page_count, truncated = _extract_pages(document.relative_path, blob.sha256, blob.extension)
+            else:
+                text, page_count, truncated = _extract_pages(document.relative_path)
+        except Exception as exc:
+            app.logger.warning('Re-extraction failed for document %s: %s', document.id, exc)
+            failed += 1
+            continue
+        document.extracted_text = text
+        document.status, document.status_detail = 'ready', None
+        if blob is not None:
+            blob.page_count, blob.text_truncated = page_count, truncated
+        updated += 1
+    db.session.commit()
+    click.echo(f'updated {updated}, missing files {missing}, failed {failed}, queued {skipped}')
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     app.run(debug=True, host='0.0.0.0', port=port)
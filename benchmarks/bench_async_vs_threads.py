@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark: thread-per-request vs asyncio concurrency for slow text generation.
+
+Both modes call a local fake generator that sleeps for a configurable latency
+(no network, no Gemini quota). The threaded mode mimics a WSGI worker with a
+fixed thread pool; the async mode keeps every request in flight on one event
+loop, the way AsyncTextGenerator callers do.
+
+Usage:
+    python benchmarks/bench_async_vs_threads.py [--requests 500] [--latency-ms 800] [--threads 8]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FakeTextGenerator:
+    def __init__(self, latency_seconds):
+        self.latency_seconds = latency_seconds
+
+    def __call__(self, prompt, model_name=None):
+        time.sleep(self.latency_seconds)
+        return f"generated: {prompt[:20]}"
+
+
+class FakeAsyncTextGenerator:
+    def __init__(self, latency_seconds):
+        self.latency_seconds = latency_seconds
+
+    async def __call__(self, prompt, model_name=None):
+        await asyncio.sleep(self.latency_seconds)
+        return f"generated: {prompt[:20]}"
+
+
+def _timed_sync(generator, prompt, submitted_at):
+    generator(prompt)
+    return time.perf_counter() - submitted_at
+
+
+def run_threaded(requests, latency, threads):
+    generator = FakeTextGenerator(latency)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [
+            pool.submit(_timed_sync, generator, f"prompt {i}", time.perf_counter())
+            for i in range(requests)
+        ]
+        latencies = [future.result() for future in futures]
+    return time.perf_counter() - started, latencies
+
+
+async def _run_async(requests, latency):
+    generator = FakeAsyncTextGenerator(latency)
+
+    async def one(i):
+        submitted_at = time.perf_counter()
+        await generator(f"prompt {i}")
+        return time.perf_counter() - submitted_at
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(one(i) for i in range(requests)))
+    return time.perf_counter() - started, list(latencies)
+
+
+def _report(label, elapsed, latencies):
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(
+        f"{label:<24} total {elapsed:7.2f}s  "
+        f"throughput {len(latencies) / elapsed:8.1f} req/s  "
+        f"p50 {statistics.median(ordered) * 1000:8.0f} ms  p99 {p99 * 1000:8.0f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--threads", type=int, default=8, help="thread pool size for the threaded mode")
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000
+
+    print(f"{args.requests} requests, fake latency {args.latency_ms:.0f} ms")
+    _report(f"threads ({args.threads})", *run_threaded(args.requests, latency, args.threads))
+    _report("asyncio (1 thread)", *asyncio.run(_run_async(args.requests, latency)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark: generations held inside a fixed RAM budget, with and without compression.
+
+Fills an LRUTTLCache bounded by --max-bytes with deterministic summary,
+flashcard and free-form replies from the offline fake generator, then reports
+how many entries fit, the compression ratio and the per-hit decompression cost.
+
+Usage:
+    python benchmarks/bench_cache_compression.py [--max-bytes 4000000] [--values 20000]
+        [--compress-min-bytes 512] [--output-words 400]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_generator import FakeGenerator  # noqa: E402
+from generation_cache import LRUTTLCache  # noqa: E402
+
+PROMPTS = (
+    "Please summarize.\n\nText to summarize:\n{topic}\n\nSummary:",
+    "Generate flashcards in JSON format.\n\nText:\n{topic}\n\nJSON:",
+    "Explain {topic} to a first-year student.",
+)
+TOPICS = (
+    "Photosynthesis converts light energy into chemical energy stored in glucose",
+    "The French Revolution reshaped European politics and the idea of citizenship",
+    "Newton's laws describe how forces change the motion of objects",
+    "Supply and demand set prices in competitive markets",
+)
+
+
+def _run(label, cache, values):
+    started = time.perf_counter()
+    for index, value in enumerate(values):
+        cache.put("m", str(index), value)
+    put_seconds = time.perf_counter() - started
+
+    keys = [str(index) for index in range(len(values) - len(cache), len(values))]
+    started = time.perf_counter()
+    for key in keys:
+        cache.get("m", key)
+    get_seconds = time.perf_counter() - started
+
+    stats = cache.stats()
+    print(
+        f"{label:<14} entries {stats['items']:6d}  stored {stats['bytes'] / 1e6:6.2f} MB  "
+        f"raw {stats['raw_bytes'] / 1e6:6.2f} MB  ratio {stats['compression_ratio']:5.2f}x  "
+        f"put {put_seconds / len(values) * 1e6:6.1f} us  hit {get_seconds / max(1, len(keys)) * 1e6:6.1f} us"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-bytes", type=int, default=4_000_000)
+    parser.add_argument("--values", type=int, default=20_000)
+    parser.add_argument("--compress-min-bytes", type=int, default=512)
+    parser.add_argument("--output-words", type=int, default=400)
+    args = parser.parse_args()
+
+    generator = FakeGenerator(0, 0, output_words=args.output_words)
+    values = [
+        generator.render(PROMPTS[i % len(PROMPTS)].format(topic=f"{TOPICS[i % len(TOPICS)]} ({i})"))
+        for i in range(args.values)
+    ]
+    print(f"{args.values} values, mean {sum(map(len, values)) / len(values):.0f} chars, "
+          f"budget {args.max_bytes / 1e6:.1f} MB")
+    _run("plain", LRUTTLCache(args.values, 3600, max_bytes=args.max_bytes), values)
+    _run(
+        "zlib",
+        LRUTTLCache(args.values, 3600, max_bytes=args.max_bytes, compress_min_bytes=args.compress_min_bytes),
+        values,
+    )
+
+
+if __name__ == "__main__":
+    main()
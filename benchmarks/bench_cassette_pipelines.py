@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark: the summarize and flashcards pipelines against a recorded Gemini cassette.
+
+Record once with a real key, then replay on any commit to compare the app's own
+overhead with identical response shapes and recorded Gemini timings:
+
+    GEMINI_API_KEY=... python benchmarks/bench_cassette_pipelines.py --record calls.jsonl
+    python benchmarks/bench_cassette_pipelines.py --replay calls.jsonl [--speed 1.0]
+
+Inputs are the paragraphs of sample.txt (or --input). The generation cache is
+disabled so every request reaches the cassette. Uses an in-memory database.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PIPELINES = {
+    "summarize": "/api/ai/summarize",
+    "flashcards": "/api/ai/flashcards",
+}
+
+
+def _paragraphs(path):
+    with open(path, "r", encoding="utf-8") as handle:
+        return [block.strip() for block in handle.read().split("\n\n") if block.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--record", metavar="CASSETTE")
+    mode.add_argument("--replay", metavar="CASSETTE")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay latency multiplier")
+    parser.add_argument("--input", default=os.path.join(ROOT, "sample.txt"))
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the inputs")
+    args = parser.parse_args()
+
+    os.environ["GEMINI_CASSETTE_MODE"] = "record" if args.record else "replay"
+    os.environ["GEMINI_CASSETTE_PATH"] = args.record or args.replay
+    os.environ["GEMINI_CASSETTE_SPEED"] = str(args.speed)
+    os.environ["GEMINI_CACHE_TTL_SECONDS"] = "0"
+    os.environ["AI_TEXT_GENERATOR"] = "gemini"
+    os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+    import app as edubot
+
+    client = edubot.app.test_client()
+    credentials = {"email": "bench@example.com", "password": "password123"}
+    client.post("/api/auth/register", json=credentials)
+    token = client.post("/api/auth/login", json=credentials).json["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    texts = _paragraphs(args.input)
+    passes = 1 if args.record else args.repeat
+
+    print(f"{os.environ['GEMINI_CASSETTE_MODE']} {os.environ['GEMINI_CASSETTE_PATH']}: "
+          f"{len(texts)} inputs x {passes} passes")
+    for name, path in PIPELINES.items():
+        latencies, failures = [], 0
+        for _ in range(passes):
+            for text in texts:
+                started = time.perf_counter()
+                response = client.post(path, headers=headers, json={"text": text})
+                latencies.append(time.perf_counter() - started)
+                failures += response.status_code != 200
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(
+            f"{name:<11} mean {statistics.mean(latencies) * 1000:7.1f} ms  "
+            f"p50 {statistics.median(latencies) * 1000:7.1f} ms  p95 {p95 * 1000:7.1f} ms  "
+            f"non-200 {failures}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Load test: drive the Flask AI routes end to end against the offline fake generator.
+
+Sets AI_TEXT_GENERATOR=fake before importing the app. Only gemini_service's
+remote call is faked, so requests go through routing, JWT auth, prompt building,
+the generation cache, single-flight, circuit breaker, rate limiter, retries and
+response parsing, but never reach Gemini.
+Latency and errors come from the AI_FAKE_* settings (see fake_generator.py),
+which the flags below override. Uses an in-memory database.
+
+Usage:
+    python benchmarks/bench_flask_fake_load.py [--route summarize] [--requests 400]
+        [--concurrency 32] [--p50-ms 400] [--p99-ms 2500] [--error-rate 0.02]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROUTES = {
+    "generate": ("/api/ai/generate", "prompt"),
+    "summarize": ("/api/ai/summarize", "text"),
+    "flashcards": ("/api/ai/flashcards", "text"),
+}
+
+SOURCE_TEXT = (
+    "Photosynthesis converts light energy into chemical energy stored in glucose. "
+    "Chlorophyll in the chloroplasts absorbs light, water is split and oxygen released, "
+    "and the Calvin cycle fixes carbon dioxide into sugars."
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--route", choices=sorted(ROUTES), default="summarize")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--p50-ms", type=float, default=400)
+    parser.add_argument("--p99-ms", type=float, default=2500)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ["AI_TEXT_GENERATOR"] = "fake"
+    os.environ["AI_FAKE_P50_MS"] = str(args.p50_ms)
+    os.environ["AI_FAKE_P99_MS"] = str(args.p99_ms)
+    os.environ["AI_FAKE_ERROR_RATE"] = str(args.error_rate)
+    os.environ["AI_FAKE_SEED"] = str(args.seed)
+    os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+    import app as edubot
+
+    client = edubot.app.test_client()
+    credentials = {"email": "load@example.com", "password": "password123"}
+    client.post("/api/auth/register", json=credentials)
+    token = client.post("/api/auth/login", json=credentials).json["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    path, field = ROUTES[args.route]
+
+    def one(i):
+        started = time.perf_counter()
+        # Vary the input so every request is a distinct prompt.
+        response = client.post(path, headers=headers, json={field: f"{SOURCE_TEXT} (request {i})"})
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    failures = sum(1 for _, status in results if status != 200)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{args.route}: {args.requests} requests, concurrency {args.concurrency}, "
+        f"fake p50 {args.p50_ms:.0f} ms / p99 {args.p99_ms:.0f} ms, error rate {args.error_rate:g}"
+    )
+    print(
+        f"total {elapsed:6.2f}s  throughput {args.requests / elapsed:7.1f} req/s  "
+        f"p50 {statistics.median(latencies) * 1000:6.0f} ms  p99 {p99 * 1000:6.0f} ms  "
+        f"non-200 {failures}"
+    )
+
+
+if __name__ == "__main__":
+    main()
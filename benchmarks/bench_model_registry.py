@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: per-call cost of building a GenerativeModel vs reusing one
+from gemini_service's model registry.
+
+No network calls are made; only client-side object construction is timed.
+
+Usage:
+    python benchmarks/bench_model_registry.py [--iterations 20000] [--model models/gemini-2.0-flash]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gemini_service  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--model", default="models/gemini-2.0-flash")
+    args = parser.parse_args()
+
+    if gemini_service.genai is None:
+        print("google-generativeai is not installed; pip install -r requirements.txt first.")
+        sys.exit(1)
+
+    construct = timeit.timeit(
+        lambda: gemini_service.genai.GenerativeModel(args.model), number=args.iterations
+    )
+    gemini_service._get_model(args.model)  # warm the registry
+    reuse = timeit.timeit(lambda: gemini_service._get_model(args.model), number=args.iterations)
+
+    per_construct_us = construct / args.iterations * 1e6
+    per_reuse_us = reuse / args.iterations * 1e6
+    print(f"iterations:              {args.iterations}")
+    print(f"GenerativeModel(...):    {per_construct_us:8.2f} us/call")
+    print(f"registry lookup:         {per_reuse_us:8.2f} us/call")
+    print(f"saved per cache miss:    {per_construct_us - per_reuse_us:8.2f} us")
+    print("(excludes the first-request client/channel setup, which reuse also avoids)")
+
+
+if __name__ == "__main__":
+    main()
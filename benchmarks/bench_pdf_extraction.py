@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark: serial vs process-pool PDF text extraction across page counts.
+
+Generates text-dense PDFs (--lines lines of text per page) of each page count,
+then times `iter_pages` with a single worker and with the process pool
+(--workers, default: every usable CPU). The pool is started before timing, so
+the figures compare steady-state extraction. The speedup needs as many free
+cores as workers; on a single-core host both modes take the same time.
+
+Usage:
+    python benchmarks/bench_pdf_extraction.py [--pages 16 64 256 1024] [--workers 4] [--lines 45]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import text_extractor  # noqa: E402
+
+SENTENCE = "Enzymes lower the activation energy of reactions in living cells, page {page} line {line}."
+
+
+def _write_pdf(path, pages, lines):
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(1, pages + 1):
+        content = "BT /F1 9 Tf 40 760 Td 11 TL " + " ".join(
+            f"({SENTENCE.format(page=page, line=line)}) '" for line in range(lines)
+        ) + " ET"
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    body = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    body += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    body += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as handle:
+        handle.write(body)
+
+
+def _time(path, workers, min_pages):
+    text_extractor.PDF_EXTRACT_WORKERS = workers
+    text_extractor.PDF_PARALLEL_MIN_PAGES = min_pages
+    started = time.perf_counter()
+    chars = sum(len(text) for _, text in text_extractor.iter_pages(path))
+    return time.perf_counter() - started, chars
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[16, 64, 256, 1024])
+    parser.add_argument("--workers", type=int, default=text_extractor._pdf_workers())
+    parser.add_argument("--lines", type=int, default=45, help="text lines per page")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        warmup = os.path.join(directory, "warmup.pdf")
+        _write_pdf(warmup, args.workers * 4, 1)
+        _time(warmup, args.workers, 1)
+
+        print(f"{args.workers} workers, {args.lines} lines per page, {os.cpu_count()} CPUs")
+        for pages in args.pages:
+            path = os.path.join(directory, f"{pages}.pdf")
+            _write_pdf(path, pages, args.lines)
+            serial, serial_chars = _time(path, 1, 1)
+            pooled, pooled_chars = _time(path, args.workers, 1)
+            assert serial_chars == pooled_chars
+            print(
+                f"{pages:5d} pages  serial {serial:7.2f}s  pool {pooled:7.2f}s  "
+                f"speedup {serial / pooled:5.2f}x  ({serial / pages * 1000:5.1f} ms/page serial)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Content-addressed storage for uploaded files.
+
+Uploads are streamed to a temporary file while their sha256 is computed, then
+moved to a path derived from that digest, so identical uploads share one file:
+
+    <root>/<digest[:2]>/<digest><ext>
+
+The database decides how many documents reference a blob; this module only
+handles bytes on disk.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+import uuid
+from typing import BinaryIO, Tuple
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def save_stream(stream: BinaryIO, directory: str, suffix: str = "") -> Tuple[str, str, int]:
+    """
+    Copy `stream` to a new temporary file in `directory`, hashing as it goes.
+
+    The file keeps `suffix` so extractors that dispatch on the extension can read it
+    before it is placed. Returns (temp path, sha256 hex digest, size in bytes).
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    handle, temp_path = tempfile.mkstemp(suffix=suffix, prefix=".upload-", dir=directory)
+    try:
+        with os.fdopen(handle, "wb") as output:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                output.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        discard(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+
+def blob_path(root: str, digest: str, extension: str) -> str:
+    return os.path.join(root, digest[:2], f"{digest}{extension}")
+
+
+def place(temp_path: str, path: str) -> bool:
+    """
+    Move a temporary upload to its blob path, or drop it if the blob is already there.
+
+    Returns True if the file was moved into place.
+    """
+    if os.path.exists(path):
+        discard(temp_path)
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(temp_path, path)
+    return True
+
+
+def discard(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def retire(path: str) -> str | None:
+    """
+    Move a blob aside ahead of deleting it, so the delete can still be undone.
+
+    The blob path is free for a new upload at once. Returns the temporary path to
+    `discard` once the delete is committed (or `restore` if it is not), or None if
+    the file was already missing.
+    """
+    tombstone = f"{path}.deleted-{uuid.uuid4().hex}"
+    try:
+        os.replace(path, tombstone)
+    except FileNotFoundError:
+        return None
+    return tombstone
+
+
+def restore(tombstone: str, path: str) -> None:
+    os.replace(tombstone, path)
@@ -0,0 +1,131 @@
+"""
+Record/replay cassettes for remote Gemini responses.
+
+A cassette is a JSON Lines file with one entry per recorded call:
+
+    {"model": ..., "prompt_hash": ..., "response": ..., "latency_seconds": ..., "recorded_at": ...}
+
+`prompt_hash` is the sha256 of the exact prompt, so replay only answers the very
+prompts that were recorded, and the prompts themselves are not written to disk.
+In record mode every successful remote call is appended; in replay mode answers
+come from the file after sleeping for the recorded latency (scaled by `speed`),
+and the network is never used.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+CASSETTE_MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(RuntimeError):
+    """Replay was asked for a call that is not on the cassette."""
+
+
+class Cassette:
+    """
+    One cassette file opened in `record` or `replay` mode. Thread-safe.
+
+    Args:
+        path: JSON Lines file; created on first record, required for replay.
+        mode: "record" or "replay".
+        speed: replay latency multiplier; 1.0 reproduces the recorded timings, 0 skips them.
+    """
+
+    def __init__(self, path: str, mode: str, speed: float = 1.0) -> None:
+        if mode not in ("record", "replay"):
+            raise RuntimeError(f"Unknown cassette mode {mode!r}; expected 'record' or 'replay'")
+        if not path:
+            raise RuntimeError("A cassette needs a file path (GEMINI_CASSETTE_PATH)")
+        if mode == "replay" and not os.path.exists(path):
+            raise RuntimeError(f"Cassette {path} does not exist; record it first")
+        self.path = path
+        self.mode = mode
+        self.speed = max(0.0, speed)
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        if os.path.exists(path):
+            self._load()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                # Later recordings of the same call win.
+                self._entries[(entry["model"], entry["prompt_hash"])] = (
+                    entry["response"],
+                    float(entry["latency_seconds"]),
+                )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def record(self, model_name: str, prompt_hash: str, response: str, latency_seconds: float) -> None:
+        if self.mode != "record":
+            return
+        line = json.dumps(
+            {
+                "model": model_name,
+                "prompt_hash": prompt_hash,
+                "response": response,
+                "latency_seconds": round(latency_seconds, 6),
+                "recorded_at": time.time(),
+            },
+            ensure_ascii=False,
+        )
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as handle:
+                handle.write(line + "\n")
+            self._entries[(model_name, prompt_hash)] = (response, latency_seconds)
+            self.recorded += 1
+
+    def _lookup(self, model_name: str, prompt_hash: str) -> Tuple[str, float]:
+        with self._lock:
+            entry = self._entries.get((model_name, prompt_hash))
+            if entry is None:
+                self.misses += 1
+            else:
+                self.replayed += 1
+        if entry is None:
+            raise CassetteMiss(
+                f"Gemini generation failed: no cassette entry for {model_name} prompt {prompt_hash[:12]}"
+            )
+        return entry
+
+    def replay(self, model_name: str, prompt_hash: str) -> str:
+        """Return the recorded response after the recorded (scaled) latency."""
+        response, latency = self._lookup(model_name, prompt_hash)
+        time.sleep(latency * self.speed)
+        return response
+
+    async def areplay(self, model_name: str, prompt_hash: str) -> str:
+        response, latency = self._lookup(model_name, prompt_hash)
+        await asyncio.sleep(latency * self.speed)
+        return response
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "path": self.path,
+                "entries": len(self._entries),
+                "recorded": self.recorded,
+                "replayed": self.replayed,
+                "misses": self.misses,
+            }
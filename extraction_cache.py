@@ -0,0 +1,209 @@
+"""
+On-disk cache of extracted document text.
+
+Entries are keyed by the file's sha256, its extension and the extractor version
+for that extension (`text_extractor.extractor_version`), so re-extracting the
+same bytes, under any name, is a lookup until PyPDF2 or the extraction code
+changes. Rows written under an older version are never matched again; they are
+purged when the cache is opened for the current version and otherwise age out.
+
+Values are zlib-compressed in a SQLite database (WAL mode, one connection per
+thread and process, as `generation_cache.SQLiteCache`). The total compressed
+size stays under `max_bytes` by deleting the least recently used rows. Like the
+generation cache it is best effort: a locked or damaged database counts as a miss.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Tuple
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Compressed, size-capped LRU store of extracted text on disk. Thread- and process-safe.
+
+    Args:
+        path: SQLite database file; created if missing.
+        max_bytes: cap on the total compressed size of stored text.
+        compress_level: zlib level; extraction is slow enough that a dense level pays off.
+        timeout_seconds: how long to wait for another writer's lock.
+    """
+
+    # Avoid a write on every hit: only refresh `accessed_at` when it is this stale.
+    _TOUCH_INTERVAL_SECONDS = 30.0
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 512 * 1024 * 1024,
+        compress_level: int = 6,
+        timeout_seconds: float = 5.0,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max(0, int(max_bytes))
+        self.compress_level = compress_level
+        self.timeout_seconds = timeout_seconds
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._purged = 0
+        self._errors = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection()  # create the schema eagerly so misconfiguration fails fast
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork, so remember which process opened them.
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=self.timeout_seconds, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            " digest TEXT NOT NULL,"
+            " extension TEXT NOT NULL,"
+            " version TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " size_bytes INTEGER NOT NULL,"
+            " raw_bytes INTEGER NOT NULL,"
+            " pages INTEGER,"
+            " accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (digest, extension, version))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_extractions_accessed_at ON extractions (accessed_at)"
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _count_error(self) -> None:
+        with self._counter_lock:
+            self._errors += 1
+
+    def get(self, digest: str, extension: str, version: str) -> str | None:
+        entry = self.get_entry(digest, extension, version)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, digest: str, extension: str, version: str) -> Tuple[str, int | None] | None:
+        """(text, page count) for these bytes, or None. The page count is None if it was not stored."""
+        try:
+            return self._get_entry(digest, extension, version)
+        except sqlite3.Error:
+            with self._counter_lock:
+                self._errors += 1
+                self._misses += 1
+            return None
+
+    def _get_entry(self, digest: str, extension: str, version: str) -> Tuple[str, int | None] | None:
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, pages, accessed_at FROM extractions"
+            " WHERE digest = ? AND extension = ? AND version = ?",
+            (digest, extension, version),
+        ).fetchone()
+        with self._counter_lock:
+            if row is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        if row is None:
+            return None
+        value, pages, accessed_at = row
+        if now - accessed_at > self._TOUCH_INTERVAL_SECONDS:
+            conn.execute(
+                "UPDATE extractions SET accessed_at = ? WHERE digest = ? AND extension = ? AND version = ?",
+                (now, digest, extension, version),
+            )
+        return zlib.decompress(value).decode("utf-8"), pages
+
+    def put(self, digest: str, extension: str, version: str, text: str, pages: int | None = None) -> None:
+        raw = text.encode("utf-8")
+        packed = zlib.compress(raw, self.compress_level)
+        if len(packed) > self.max_bytes:
+            return
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO extractions"
+                " (digest, extension, version, value, size_bytes, raw_bytes, pages, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, extension, version, packed, len(packed), len(raw), pages, time.time()),
+            )
+            self._prune()
+        except sqlite3.Error:
+            self._count_error()
+
+    def _prune(self) -> None:
+        conn = self._connection()
+        (total,) = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM extractions").fetchone()
+        if total <= self.max_bytes:
+            return
+        # Walk the oldest rows until enough bytes are freed, then delete them in one statement.
+        excess = total - self.max_bytes
+        cutoff = None
+        freed = 0
+        removed = 0
+        for accessed_at, size_bytes in conn.execute(
+            "SELECT accessed_at, size_bytes FROM extractions ORDER BY accessed_at"
+        ):
+            freed += size_bytes
+            removed += 1
+            cutoff = accessed_at
+            if freed >= excess:
+                break
+        if cutoff is None:
+            return
+        cursor = conn.execute("DELETE FROM extractions WHERE accessed_at <= ?", (cutoff,))
+        with self._counter_lock:
+            self._evictions += cursor.rowcount if cursor.rowcount >= 0 else removed
+
+    def purge_other_versions(self, extension: str, version: str) -> int:
+        """Delete entries for `extension` written by any other extractor version."""
+        cursor = self._connection().execute(
+            "DELETE FROM extractions WHERE extension = ? AND version != ?", (extension, version)
+        )
+        with self._counter_lock:
+            self._purged += cursor.rowcount
+        return cursor.rowcount
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM extractions")
+
+    def stats(self) -> Dict[str, int]:
+        with self._counter_lock:
+            totals = {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "purged": self._purged,
+                "errors": self._errors,
+                "max_bytes": self.max_bytes,
+            }
+        try:
+            totals["items"], totals["bytes"], totals["raw_bytes"] = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(SUM(raw_bytes), 0) FROM extractions"
+            ).fetchone()
+        except sqlite3.Error:
+            self._count_error()
+            totals["items"] = totals["bytes"] = totals["raw_bytes"] = 0
+        return totals
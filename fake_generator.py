@@ -0,0 +1,200 @@
+"""
+Offline stand-in for Gemini, for load testing the Flask stack without spending quota.
+
+Outputs are deterministic per (model_name, prompt) and shaped like real replies:
+flashcard prompts get a valid JSON array, summary prompts get a bulleted list and
+anything else gets a few paragraphs. Each call first sleeps for a latency sampled
+from a log-normal distribution fitted to the configured p50/p99, and fails with
+the configured probability, so callers see realistic tail latency and errors.
+
+Selected in the app with `AI_TEXT_GENERATOR=fake`, which installs it as gemini_service's
+remote backend (`use_fake_backend`): only the network call is replaced, so the
+cache, single-flight, circuit breaker, rate limiter, retries, router and metrics all
+run. Injected errors look like transient 503s and calls that outlast their
+timeout fail like a timed-out request, so both are retried. Tuned with:
+    AI_FAKE_P50_MS (default 400), AI_FAKE_P99_MS (default 2500),
+    AI_FAKE_ERROR_RATE (default 0), AI_FAKE_OUTPUT_WORDS (default 180),
+    AI_FAKE_SEED (optional; makes the latency/error sequence reproducible).
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import Iterator, List, Tuple
+
+# z-score of the 99th percentile of a standard normal distribution
+_Z_99 = 2.3263478740408408
+
+_FILLER_WORDS = (
+    "concept", "process", "energy", "system", "structure", "function", "example",
+    "theory", "evidence", "model", "analysis", "result", "pattern", "principle",
+    "method", "variable", "relationship", "definition", "property", "context",
+)
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z'-]{3,}")
+# The app's prompt templates put the user's material under a "Text...:" heading.
+_SOURCE_TEXT_RE = re.compile(r"^Text[^:\n]*:\n(.*?)(?:\n\n|\Z)", re.MULTILINE | re.DOTALL)
+
+
+class FakeGenerator:
+    """
+    Deterministic text generator with sampled latency and error injection. Thread-safe.
+
+    Args:
+        p50_seconds: median latency of a call.
+        p99_seconds: 99th percentile latency; must be >= `p50_seconds`.
+        error_rate: probability in [0, 1] that a call raises `RuntimeError`.
+        output_words: approximate length of free-form replies.
+        seed: seeds the latency/error sampler; outputs are deterministic regardless.
+    """
+
+    def __init__(
+        self,
+        p50_seconds: float = 0.4,
+        p99_seconds: float = 2.5,
+        error_rate: float = 0.0,
+        output_words: int = 180,
+        seed: int | None = None,
+    ) -> None:
+        if p50_seconds < 0 or p99_seconds < p50_seconds:
+            raise RuntimeError("Fake generator latency needs 0 <= p50 <= p99")
+        if not 0.0 <= error_rate <= 1.0:
+            raise RuntimeError("Fake generator error rate must be between 0 and 1")
+        self.p50_seconds = p50_seconds
+        self.p99_seconds = p99_seconds
+        self.error_rate = error_rate
+        self.output_words = max(1, int(output_words))
+        self._mu = math.log(p50_seconds) if p50_seconds > 0 else None
+        self._sigma = math.log(p99_seconds / p50_seconds) / _Z_99 if p50_seconds > 0 else 0.0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls) -> "FakeGenerator":
+        seed = os.environ.get("AI_FAKE_SEED")
+        return cls(
+            p50_seconds=float(os.environ.get("AI_FAKE_P50_MS", "400")) / 1000,
+            p99_seconds=float(os.environ.get("AI_FAKE_P99_MS", "2500")) / 1000,
+            error_rate=float(os.environ.get("AI_FAKE_ERROR_RATE", "0")),
+            output_words=int(os.environ.get("AI_FAKE_OUTPUT_WORDS", "180")),
+            seed=int(seed) if seed else None,
+        )
+
+    def sample_latency(self) -> float:
+        """Draw one call latency in seconds."""
+        if self._mu is None:
+            return 0.0
+        with self._lock:
+            return self._random.lognormvariate(self._mu, self._sigma)
+
+    def _admit(self, prompt: str) -> Tuple[float, bool]:
+        """Validate the prompt, then draw this call's latency and whether it fails."""
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise RuntimeError("Prompt must be a non-empty string")
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return self.sample_latency(), failed
+
+    @staticmethod
+    def _fail() -> None:
+        # Chained like the SDK's ServiceUnavailable, so callers treat it as transient.
+        raise RuntimeError("Gemini generation failed: 503 fake generator injected error") from ConnectionError(
+            "503 fake generator injected error"
+        )
+
+    @staticmethod
+    def _timed_out(timeout: float) -> None:
+        raise RuntimeError(f"Gemini generation failed: fake generator timed out after {timeout:g}s") from TimeoutError()
+
+    def generate(self, prompt: str, model_name: str | None = None, timeout: float | None = None) -> str:
+        latency, failed = self._admit(prompt)
+        if timeout is not None and latency > timeout:
+            time.sleep(max(0.0, timeout))
+            self._timed_out(timeout)
+        time.sleep(latency)
+        if failed:
+            self._fail()
+        return self.render(prompt, model_name)
+
+    async def agenerate(self, prompt: str, model_name: str | None = None, timeout: float | None = None) -> str:
+        latency, failed = self._admit(prompt)
+        if timeout is not None and latency > timeout:
+            await asyncio.sleep(max(0.0, timeout))
+            self._timed_out(timeout)
+        await asyncio.sleep(latency)
+        if failed:
+            self._fail()
+        return self.render(prompt, model_name)
+
+    def stream(self, prompt: str, model_name: str | None = None, chunks: int = 8,
+               timeout: float | None = None) -> Iterator[str]:
+        """Yield the reply in `chunks` deltas; a third of the latency goes to the first one."""
+        latency, failed = self._admit(prompt)
+        if timeout is not None and latency / 3 > timeout:
+            time.sleep(max(0.0, timeout))
+            self._timed_out(timeout)
+        time.sleep(latency / 3)
+        if failed:
+            self._fail()
+        text = self.render(prompt, model_name)
+        step = max(1, math.ceil(len(text) / chunks))
+        pieces = [text[i:i + step] for i in range(0, len(text), step)]
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(latency * 2 / 3 / max(1, len(pieces) - 1))
+            yield piece
+
+    def render(self, prompt: str, model_name: str | None = None) -> str:
+        """Return the deterministic reply for `prompt`, without latency or errors."""
+        digest = hashlib.sha256(f"{model_name or ''}\0{prompt}".encode("utf-8")).digest()
+        rng = random.Random(int.from_bytes(digest[:8], "big"))
+        source = _SOURCE_TEXT_RE.search(prompt)
+        words = _WORD_RE.findall(source.group(1) if source else prompt)
+        vocabulary = sorted(set(word.lower() for word in words)) or list(_FILLER_WORDS)
+        lowered = prompt.lower()
+        if "flashcard" in lowered and "json" in lowered:
+            return self._flashcards(rng, vocabulary)
+        if "summar" in lowered:
+            return self._summary(rng, vocabulary)
+        return self._paragraphs(rng, vocabulary)
+
+    def _sentence(self, rng: random.Random, vocabulary: List[str], words: int) -> str:
+        picked = [rng.choice(vocabulary) for _ in range(words)]
+        return " ".join(picked).capitalize() + "."
+
+    def _flashcards(self, rng: random.Random, vocabulary: List[str]) -> str:
+        cards = [
+            {
+                "question": f"What is the role of {rng.choice(vocabulary)} in {rng.choice(vocabulary)}?",
+                "answer": self._sentence(rng, vocabulary, rng.randint(8, 16)),
+            }
+            for _ in range(rng.randint(5, 6))
+        ]
+        return json.dumps(cards, indent=2)
+
+    def _summary(self, rng: random.Random, vocabulary: List[str]) -> str:
+        points = max(3, min(8, self.output_words // 20))
+        return "\n".join(
+            "• " + self._sentence(rng, vocabulary, rng.randint(8, 16)) for _ in range(points)
+        )
+
+    def _paragraphs(self, rng: random.Random, vocabulary: List[str]) -> str:
+        sentences: List[str] = []
+        written = 0
+        while written < self.output_words:
+            length = rng.randint(8, 20)
+            sentences.append(self._sentence(rng, vocabulary, length))
+            written += length
+        paragraphs = [" ".join(sentences[i:i + 5]) for i in range(0, len(sentences), 5)]
+        return "\n\n".join(paragraphs)
@@ -1,16 +1,46 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import contextvars
 import hashlib
 import os
+import re
 import threading
 import time
-from typing import Dict, Tuple
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures import as_completed, wait
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Tuple
 
 try:
     import google.generativeai as genai  # type: ignore
 except Exception:  # pragma: no cover
     genai = None  # type: ignore
 
+try:
+    from google.api_core import exceptions as google_exceptions  # type: ignore
+except Exception:  # pragma: no cover
+    google_exceptions = None  # type: ignore
+
+from cassette import CASSETTE_MODES, Cassette
+from fake_generator import FakeGenerator
+from generation_cache import LRUTTLCache, RedisCache, SQLiteCache, TieredCache
+from metrics import LatencyRecorder, PrometheusText
+from resilience import (
+    CircuitBreaker,
+    CircuitBreakerRegistry,
+    CircuitOpenError,
+    DeadlineExceeded,
+    FairRateLimiter,
+    ModelRouter,
+    RateLimitExceeded,
+    RetryPolicy,
+    remaining_seconds,
+)
+from services.interfaces import GenerationCache
+from token_budget import estimate_tokens
+
 
 _CONFIG_LOCK = threading.Lock()
 _IS_CONFIGURED = False
@@ -20,11 +50,14 @@ def _configure_once() -> None:
     """
     Configure the Gemini SDK exactly once per process using the `GEMINI_API_KEY` env var.
 
+    A no-op when replaying a cassette or using the fake backend, which need neither the
+    SDK nor a key.
+
     Raises:
         RuntimeError: if the SDK is unavailable or the API key is missing.
     """
     global _IS_CONFIGURED
-    if _IS_CONFIGURED:
+    if _IS_CONFIGURED or _fake_backend is not None or (_cassette is not None and _cassette.replaying):
         return
     with _CONFIG_LOCK:
         if _IS_CONFIGURED:
@@ -42,11 +75,65 @@ def _configure_once() -> None:
         _IS_CONFIGURED = True
 
 
-# Simple in-process cache for generations (ephemeral; clears on restart)
+# In-process LRU cache for generations (ephemeral; clears on restart)
 _CACHE_TTL_SECONDS = int(os.environ.get("GEMINI_CACHE_TTL_SECONDS", "300"))  # 5 minutes default
 _CACHE_MAX_ITEMS = int(os.environ.get("GEMINI_CACHE_MAX_ITEMS", "256"))
-_cache_store: Dict[Tuple[str, str], Tuple[float, str]] = {}
-_cache_lock = threading.Lock()
+_CACHE_STRIPES = int(os.environ.get("GEMINI_CACHE_STRIPES", "8"))
+# Byte budget for the in-memory tier (0 = bounded by item count only), and the size at which
+# values are stored zlib-compressed (0 = never).
+_CACHE_MAX_BYTES = int(os.environ.get("GEMINI_CACHE_MAX_BYTES", "0"))
+_CACHE_COMPRESS_MIN_BYTES = int(os.environ.get("GEMINI_CACHE_COMPRESS_MIN_BYTES", "0"))
+# Stale-while-revalidate: for this long after an entry's TTL, callers get the stale value at
+# once while one background refresh per key regenerates it. Past the window the entry is gone
+# and callers block on a fresh generation. 0 disables it; only the memory tier serves stale.
+_CACHE_STALE_SECONDS = float(os.environ.get("GEMINI_CACHE_STALE_SECONDS", "0"))
+_REFRESH_WORKERS = int(os.environ.get("GEMINI_REFRESH_WORKERS", "4"))
+# On-disk SQLite tier shared by all workers on a host and surviving restarts.
+_CACHE_DB_PATH = os.environ.get("GEMINI_CACHE_DB_PATH", "")
+_CACHE_DB_TTL_SECONDS = int(os.environ.get("GEMINI_CACHE_DB_TTL_SECONDS", str(_CACHE_TTL_SECONDS)))
+_CACHE_DB_MAX_BYTES = int(os.environ.get("GEMINI_CACHE_DB_MAX_BYTES", str(256 * 1024 * 1024)))
+# Redis-protocol tier shared across hosts.
+_CACHE_REDIS_URL = os.environ.get("GEMINI_CACHE_REDIS_URL", "redis://localhost:6379/0")
+_CACHE_REDIS_TTL_SECONDS = int(os.environ.get("GEMINI_CACHE_REDIS_TTL_SECONDS", str(_CACHE_TTL_SECONDS)))
+_CACHE_REDIS_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_CACHE_REDIS_TIMEOUT_SECONDS", "0.5"))
+# Cache topology: memory, disk, redis, memory+disk or memory+redis. Setting only
+# GEMINI_CACHE_DB_PATH keeps its original meaning of memory+disk.
+_CACHE_BACKEND = os.environ.get("GEMINI_CACHE_BACKEND", "memory+disk" if _CACHE_DB_PATH else "memory")
+_CACHE_BACKENDS = ("memory", "disk", "redis", "memory+disk", "memory+redis")
+
+
+def _build_generation_cache(backend: str = _CACHE_BACKEND) -> GenerationCache:
+    backend = backend.strip().lower()
+    if backend not in _CACHE_BACKENDS:
+        raise RuntimeError(
+            f"Unknown GEMINI_CACHE_BACKEND {backend!r}. Choose from: {', '.join(_CACHE_BACKENDS)}."
+        )
+    memory_cache = LRUTTLCache(
+        _CACHE_MAX_ITEMS,
+        _CACHE_TTL_SECONDS,
+        stripes=_CACHE_STRIPES,
+        max_bytes=_CACHE_MAX_BYTES,
+        compress_min_bytes=_CACHE_COMPRESS_MIN_BYTES,
+        stale_seconds=_CACHE_STALE_SECONDS,
+    )
+    if backend == "memory":
+        return memory_cache
+
+    shared_cache: GenerationCache
+    if backend.endswith("disk"):
+        if not _CACHE_DB_PATH:
+            raise RuntimeError("GEMINI_CACHE_DB_PATH must be set to use the disk generation cache.")
+        shared_cache = SQLiteCache(_CACHE_DB_PATH, _CACHE_DB_TTL_SECONDS, max_bytes=_CACHE_DB_MAX_BYTES)
+    else:
+        shared_cache = RedisCache(
+            _CACHE_REDIS_URL, _CACHE_REDIS_TTL_SECONDS, timeout_seconds=_CACHE_REDIS_TIMEOUT_SECONDS
+        )
+    if backend.startswith("memory+"):
+        return TieredCache(memory_cache, shared_cache)
+    return shared_cache
+
+
+_generation_cache = _build_generation_cache()
 
 
 def _hash_prompt(prompt: str) -> str:
@@ -54,33 +141,725 @@ def _hash_prompt(prompt: str) -> str:
     return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
 
 
-def _cache_get(model_name: str, prompt: str) -> str | None:
-    if _CACHE_TTL_SECONDS <= 0:
+# Prompt canonicalization for cache keys. Prompts are still sent to Gemini verbatim; only
+# the key is computed from the canonical form, so texts that differ in line endings,
+# Unicode composition or whitespace share one cache entry.
+# Bump the version whenever a step's behaviour changes so old entries stop matching.
+_CANONICALIZATION_VERSION = 1
+_CANONICALIZATION_STEPS = ("newlines", "nfc", "nfkc", "strip", "spaces")
+_HORIZONTAL_WHITESPACE_RE = re.compile(r"[^\S\n]+")
+
+
+def _parse_canonicalization_steps(raw: str) -> Tuple[str, ...]:
+    if raw.strip().lower() in ("", "none", "off"):
+        return ()
+    steps = tuple(step.strip().lower() for step in raw.split(",") if step.strip())
+    unknown = [step for step in steps if step not in _CANONICALIZATION_STEPS]
+    if unknown:
+        raise RuntimeError(
+            f"Unknown GEMINI_PROMPT_CANONICALIZATION step(s): {', '.join(unknown)}. "
+            f"Choose from: {', '.join(_CANONICALIZATION_STEPS)}."
+        )
+    return steps
+
+
+_canonicalization_steps = _parse_canonicalization_steps(
+    os.environ.get("GEMINI_PROMPT_CANONICALIZATION", "newlines,nfc,strip,spaces")
+)
+
+
+def _canonicalize_prompt(prompt: str) -> str:
+    text = prompt
+    for step in _canonicalization_steps:
+        if step == "newlines":
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        elif step in ("nfc", "nfkc"):
+            text = unicodedata.normalize(step.upper(), text)
+        elif step == "strip":
+            text = "\n".join(line.rstrip() for line in text.strip().split("\n"))
+        elif step == "spaces":
+            text = _HORIZONTAL_WHITESPACE_RE.sub(" ", text)
+    return text
+
+
+def _prompt_key(prompt: str) -> str:
+    """Return the cache key hash for `prompt`, namespaced by the canonicalization config."""
+    if not _canonicalization_steps:
+        return _hash_prompt(prompt)
+    prefix = f"c{_CANONICALIZATION_VERSION}:{'+'.join(_canonicalization_steps)}\n"
+    return _hash_prompt(prefix + _canonicalize_prompt(prompt))
+
+
+# Shadow index of raw-prompt keys, used only to measure how many hits canonicalization adds.
+_raw_key_index = LRUTTLCache(_CACHE_MAX_ITEMS, _CACHE_TTL_SECONDS, stripes=_CACHE_STRIPES)
+_canonical_stats_lock = threading.Lock()
+_canonical_stats = {"lookups": 0, "hits": 0, "canonical_only_hits": 0}
+
+
+def _record_lookup(model_name: str, prompt: str, hit: bool) -> None:
+    canonical_only = False
+    if hit and _canonicalization_steps:
+        canonical_only = _raw_key_index.get(model_name, _hash_prompt(prompt)) is None
+    with _canonical_stats_lock:
+        _canonical_stats["lookups"] += 1
+        if hit:
+            _canonical_stats["hits"] += 1
+        if canonical_only:
+            _canonical_stats["canonical_only_hits"] += 1
+
+
+def _remember_raw_key(model_name: str, prompt: str) -> None:
+    if _canonicalization_steps:
+        _raw_key_index.put(model_name, _hash_prompt(prompt), "")
+
+
+def get_canonicalization_stats() -> Dict[str, object]:
+    """
+    Report how much prompt canonicalization raises the generation cache hit rate.
+
+    `canonical_only_hits` counts hits whose exact raw prompt was never cached, i.e. hits
+    that a raw sha256 key would have missed. `hit_rate_uplift` is that count divided
+    by the number of lookups.
+    """
+    with _canonical_stats_lock:
+        stats: Dict[str, object] = dict(_canonical_stats)
+    lookups = stats["lookups"] or 0
+    stats["version"] = _CANONICALIZATION_VERSION
+    stats["steps"] = list(_canonicalization_steps)
+    stats["hit_rate"] = (stats["hits"] / lookups) if lookups else 0.0
+    stats["hit_rate_uplift"] = (stats["canonical_only_hits"] / lookups) if lookups else 0.0
+    return stats
+
+
+def get_cache_stats() -> Dict[str, int]:
+    """
+    Return the counters of the configured generation cache backend.
+
+    For tiered backends the memory tier's counters are top level and the shared
+    tier's carry an `l2_` prefix.
+    """
+    return _generation_cache.stats()
+
+
+class _SingleFlight:
+    """
+    Collapse concurrent calls that share a key into one execution.
+
+    The first caller for a key runs `fn`; callers arriving while it is in flight
+    block on the same future and receive its result or re-raise its exception.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[str, str], Future] = {}
+        self.coalesced = 0
+
+    def do(self, key: Tuple[str, str], fn: Callable[[], str], timeout: float | None = None) -> str:
+        """Run or join the call for `key`; followers give up after `timeout` seconds."""
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+        if not is_leader:
+            try:
+                return future.result(timeout=None if timeout is None else max(timeout, 0))
+            except FutureTimeoutError:
+                raise DeadlineExceeded("Gemini generation failed: request deadline exceeded") from None
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+_inflight = _SingleFlight()
+
+
+class _BackgroundRefresher:
+    """
+    Run stale-entry refreshes on a small thread pool, at most one per key at a time.
+
+    A key scheduled while its refresh is still pending is counted and dropped, so a
+    burst of stale hits on a popular prompt costs one remote call.
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max(1, max_workers)
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._pid = 0
+        self._pending: set[Tuple[str, str]] = set()
+        self.started = 0
+        self.deduplicated = 0
+        self.failed = 0
+
+    def _ensure_executor(self) -> ThreadPoolExecutor:
+        # Called with the lock held. A forked worker inherits no pool threads, so start anew.
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="gemini-refresh")
+            self._pid = os.getpid()
+            self._pending = set()
+        return self._executor
+
+    def schedule(self, key: Tuple[str, str], fn: Callable[[], object]) -> bool:
+        """Queue `fn` unless a refresh for `key` is already pending; return whether it was queued."""
+        with self._lock:
+            executor = self._ensure_executor()
+            if key in self._pending:
+                self.deduplicated += 1
+                return False
+            self._pending.add(key)
+            self.started += 1
+        executor.submit(self._run, key, fn)
+        return True
+
+    def _run(self, key: Tuple[str, str], fn: Callable[[], object]) -> None:
+        try:
+            fn()
+        except Exception:
+            # The failure is already recorded by the breaker and negative cache.
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "started": self.started,
+                "deduplicated": self.deduplicated,
+                "failed": self.failed,
+            }
+
+
+_refresher = _BackgroundRefresher(_REFRESH_WORKERS)
+
+
+def get_refresh_stats() -> Dict[str, int]:
+    """Return pending/started/deduplicated/failed counts of stale-while-revalidate refreshes."""
+    return _refresher.stats()
+
+
+def _refresh_generation(model_name: str, prompt: str, prompt_hash: str, user_id: str | None) -> None:
+    # No caller is waiting, so the refresh gets no request deadline, only per-attempt timeouts.
+    with generation_context(user_id=user_id):
+        _inflight.do((model_name, prompt_hash), lambda: _generate_and_cache(model_name, prompt, prompt_hash))
+
+
+def _serve_stale(model_name: str, prompt: str, prompt_hash: str) -> str | None:
+    """Return a stale cached value and schedule its refresh, or None if there is none."""
+    get_stale = getattr(_generation_cache, "get_stale", None)
+    if get_stale is None:
+        return None
+    stale = get_stale(model_name, prompt_hash)
+    if stale is None:
         return None
-    now = time.time()
-    key = (model_name, _hash_prompt(prompt))
-    with _cache_lock:
-        entry = _cache_store.get(key)
-        if not entry:
-            return None
-        ts, value = entry
-        if now - ts > _CACHE_TTL_SECONDS:
-            # expired
-            _cache_store.pop(key, None)
-            return None
-        return value
-
-
-def _cache_put(model_name: str, prompt: str, text: str) -> None:
-    if _CACHE_TTL_SECONDS <= 0:
+    # While the prompt's last attempt is negatively cached, keep serving stale without retrying.
+    if _failure_cache.get(model_name, prompt_hash) is None:
+        user_id = _current_user.get()
+        _refresher.schedule(
+            (model_name, prompt_hash),
+            lambda: _refresh_generation(model_name, prompt, prompt_hash, user_id),
+        )
+    return stale
+
+
+def get_coalesced_count() -> int:
+    """Return how many generation calls were served by an identical in-flight call."""
+    return _inflight.coalesced + _async_loop.coalesced
+
+
+# Failure handling: a per-model circuit breaker plus a short-lived per-prompt negative cache,
+# so an outage or rate limit fails fast instead of tying up a worker on every request.
+_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_FAILURE_THRESHOLD", "5"))
+_BREAKER_RECOVERY_SECONDS = float(os.environ.get("GEMINI_BREAKER_RECOVERY_SECONDS", "30"))
+_NEGATIVE_CACHE_TTL_SECONDS = int(os.environ.get("GEMINI_NEGATIVE_CACHE_TTL_SECONDS", "15"))
+_breakers = CircuitBreakerRegistry(_BREAKER_FAILURE_THRESHOLD, _BREAKER_RECOVERY_SECONDS)
+_failure_cache = LRUTTLCache(_CACHE_MAX_ITEMS, _NEGATIVE_CACHE_TTL_SECONDS, stripes=_CACHE_STRIPES)
+
+
+def get_breaker_states() -> Dict[str, Dict[str, object]]:
+    """Return state, consecutive failures, trip and rejection counts for each model's breaker."""
+    return _breakers.snapshot()
+
+
+def get_negative_cache_stats() -> Dict[str, int]:
+    """Return hit/miss counters of the per-prompt failure cache."""
+    return _failure_cache.stats()
+
+
+def _acquire_breaker(model_name: str):
+    breaker = _breakers.get(model_name)
+    if not breaker.allow():
+        raise CircuitOpenError(
+            f"Gemini generation failed: circuit open for {model_name} after repeated errors"
+        )
+    return breaker
+
+
+# Outbound rate limiting: a global RPM/TPM budget shared fairly across users. Calls
+# served from the cache or coalesced onto another call never consume quota.
+_RATE_LIMIT_RPM = float(os.environ.get("GEMINI_RATE_LIMIT_RPM", "0"))  # 0 disables the limiter
+_RATE_LIMIT_TPM = float(os.environ.get("GEMINI_RATE_LIMIT_TPM", "0"))  # 0 disables the token budget
+_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get("GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS", "10"))
+_rate_limiter = FairRateLimiter(_RATE_LIMIT_RPM, _RATE_LIMIT_TPM, _RATE_LIMIT_MAX_WAIT_SECONDS)
+
+# Who the current generation is for and when it must finish by; set by the web layer
+# via `generation_context`.
+_current_user: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("gemini_user_id", default=None)
+_current_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("gemini_deadline", default=None)
+
+
+@contextlib.contextmanager
+def generation_context(user_id: object = None, deadline: float | None = None) -> Iterator[None]:
+    """
+    Scope Gemini calls made inside the block to a user and an overall deadline.
+
+    Args:
+        user_id: Caller identity used for fair rate limiting.
+        deadline: Absolute `time.monotonic()` time by which generation must finish.
+            Queueing, attempts and retry backoff all stop at the deadline.
+
+    Contextvars do not flow into worker threads on their own; enter the context
+    again inside pool workers when fanning work out.
+    """
+    user_token = _current_user.set(None if user_id is None else str(user_id))
+    deadline_token = _current_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _current_deadline.reset(deadline_token)
+        _current_user.reset(user_token)
+
+
+def get_rate_limiter_stats() -> Dict[str, float]:
+    """Return queue depth, wait-time totals and grant/rejection counts of the Gemini limiter."""
+    return _rate_limiter.stats()
+
+
+def _admit(model_name: str, prompt: str, user_id: str | None, deadline: float | None = None):
+    """Check the model's breaker, then wait for rate-limit capacity. Returns the breaker."""
+    _check_deadline(deadline)
+    breaker = _acquire_breaker(model_name)
+    try:
+        _rate_limiter.acquire(user_id, max(1, estimate_tokens(prompt)), remaining_seconds(deadline))
+    except BaseException:
+        breaker.release()
+        raise
+    return breaker
+
+
+# Retries: bounded attempts with jittered exponential backoff for transient errors only,
+# and a per-attempt timeout so a hung call cannot hold a request thread indefinitely.
+_RETRY_MAX_ATTEMPTS = int(os.environ.get("GEMINI_RETRY_MAX_ATTEMPTS", "3"))
+_RETRY_BASE_DELAY_SECONDS = float(os.environ.get("GEMINI_RETRY_BASE_DELAY_SECONDS", "0.5"))
+_RETRY_MAX_DELAY_SECONDS = float(os.environ.get("GEMINI_RETRY_MAX_DELAY_SECONDS", "8"))
+_CALL_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_CALL_TIMEOUT_SECONDS", "30"))
+_retry_policy = RetryPolicy(
+    _RETRY_MAX_ATTEMPTS, _RETRY_BASE_DELAY_SECONDS, _RETRY_MAX_DELAY_SECONDS, _CALL_TIMEOUT_SECONDS
+)
+
+
+def _retryable_api_errors() -> Tuple[type, ...]:
+    if google_exceptions is None:  # pragma: no cover
+        return ()
+    return (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.InternalServerError,
+        google_exceptions.BadGateway,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.GatewayTimeout,
+        google_exceptions.DeadlineExceeded,
+    )
+
+
+_RETRYABLE_API_ERRORS = _retryable_api_errors()
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    # `_call_gemini` wraps SDK errors in RuntimeError, so look through the cause chain.
+    cause: BaseException | None = exc
+    while cause is not None:
+        if isinstance(cause, (TimeoutError, ConnectionError) + _RETRYABLE_API_ERRORS):
+            return True
+        cause = cause.__cause__
+    return False
+
+
+def _check_deadline(deadline: float | None) -> None:
+    remaining = remaining_seconds(deadline)
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("Gemini generation failed: request deadline exceeded")
+
+
+def get_retry_stats() -> Dict[str, float]:
+    """Return attempt/retry counts and time spent in remote calls, including backoff."""
+    return _retry_policy.stats()
+
+
+def _request_options(timeout: float | None) -> Dict[str, float] | None:
+    return {"timeout": timeout} if timeout is not None else None
+
+
+# One GenerativeModel per model name. The SDK creates its API client lazily on the first
+# request and keeps it on the instance, so reusing instances also reuses the transport.
+_model_registry: Dict[str, Any] = {}
+_model_registry_lock = threading.Lock()
+
+
+def _get_model(model_name: str) -> Any:
+    model = _model_registry.get(model_name)
+    if model is not None:
+        return model
+    with _model_registry_lock:
+        model = _model_registry.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            _model_registry[model_name] = model
+        return model
+
+
+def prewarm_models(model_names: Iterable[str] | None = None) -> None:
+    """
+    Configure the SDK and build model clients ahead of the first request.
+
+    Args:
+        model_names: Models to build. Defaults to the comma-separated
+            `GEMINI_PREWARM_MODELS` env var, or the default model (every routed
+            model when `GEMINI_ROUTER_MODELS` is set) if that is unset.
+
+    Raises:
+        RuntimeError: if the SDK is unavailable or the API key is missing.
+    """
+    _configure_once()
+    if _fake_backend is not None:
         return
-    key = (model_name, _hash_prompt(prompt))
-    with _cache_lock:
-        # Simple size cap eviction: drop oldest by timestamp when exceeding max items
-        if len(_cache_store) >= _CACHE_MAX_ITEMS:
-            oldest_key = min(_cache_store.items(), key=lambda kv: kv[1][0])[0]
-            _cache_store.pop(oldest_key, None)
-        _cache_store[key] = (time.time(), text)
+    if model_names is None:
+        configured = os.environ.get("GEMINI_PREWARM_MODELS", "")
+        model_names = [name.strip() for name in configured.split(",") if name.strip()]
+        if not model_names:
+            model_names = list(_router.models) if _router is not None else [_default_model_name()]
+    for model_name in model_names:
+        _get_model(model_name)
+
+
+def _default_model_name() -> str:
+    if _router is not None:
+        return ROUTED_MODEL_NAME
+    return os.environ.get("GEMINI_MODEL_NAME", "models/gemini-2.0-flash")
+
+
+def _response_text(response: Any) -> str:
+    # Newer SDKs expose `.text`; older may require concatenating parts.
+    text = getattr(response, "text", None)
+    if not text:
+        # Fallback: join candidates content
+        text = "".join(getattr(candidate, "content", "") for candidate in getattr(response, "candidates", [])).strip()
+    if not text:
+        raise RuntimeError("Empty response from Gemini")
+    return text
+
+
+# Offline stand-in for the remote call (AI_TEXT_GENERATOR=fake in the app). Everything above
+# the network call still runs, so load tests measure the real orchestration.
+_fake_backend: FakeGenerator | None = None
+
+
+def use_fake_backend(engine: FakeGenerator | None) -> None:
+    """Answer remote calls from `engine` instead of Gemini; None restores the real API."""
+    global _fake_backend
+    _fake_backend = engine
+
+
+def _call_gemini(model_name: str, prompt: str, timeout: float | None = None) -> str:
+    if _fake_backend is not None:
+        return _fake_backend.generate(prompt, model_name=model_name, timeout=timeout)
+    try:
+        model = _get_model(model_name)
+        response = model.generate_content(prompt, request_options=_request_options(timeout))
+        text = _response_text(response)
+    except Exception as exc:  # pragma: no cover
+        raise RuntimeError(f"Gemini generation failed: {exc}") from exc
+    return text
+
+
+# Record/replay of remote responses for reproducible benchmarks. "record" appends every
+# successful remote call to GEMINI_CASSETTE_PATH; "replay" answers from it with the recorded
+# latency (times GEMINI_CASSETTE_SPEED) and never touches the network.
+_CASSETTE_MODE = os.environ.get("GEMINI_CASSETTE_MODE", "off")
+_CASSETTE_PATH = os.environ.get("GEMINI_CASSETTE_PATH", "")
+_CASSETTE_SPEED = float(os.environ.get("GEMINI_CASSETTE_SPEED", "1"))
+
+
+def _build_cassette(mode: str = _CASSETTE_MODE) -> Cassette | None:
+    if mode not in CASSETTE_MODES:
+        raise RuntimeError(f"Unknown GEMINI_CASSETTE_MODE {mode!r}; expected one of {', '.join(CASSETTE_MODES)}")
+    if mode == "off":
+        return None
+    return Cassette(_CASSETTE_PATH, mode, _CASSETTE_SPEED)
+
+
+_cassette = _build_cassette()
+
+
+def get_cassette_stats() -> Dict[str, object] | None:
+    """Return entry/record/replay/miss counts of the active cassette, or None when off."""
+    return _cassette.stats() if _cassette is not None else None
+
+
+# Wall-clock latency of every remote attempt, per model, for `/api/metrics`.
+_call_latency = LatencyRecorder()
+
+
+def get_latency_stats() -> Dict[str, Dict[str, object]]:
+    """Return the per-model latency histogram of remote Gemini calls (cumulative buckets)."""
+    return _call_latency.snapshot()
+
+
+def _timed_call_gemini(model_name: str, prompt: str, timeout: float | None = None) -> str:
+    cassette = _cassette
+    started = time.perf_counter()
+    try:
+        if cassette is not None and cassette.replaying:
+            text = cassette.replay(model_name, _hash_prompt(prompt))
+        else:
+            text = _call_gemini(model_name, prompt, timeout=timeout)
+    except Exception:
+        _call_latency.observe(model_name, time.perf_counter() - started, error=True)
+        raise
+    elapsed = time.perf_counter() - started
+    _call_latency.observe(model_name, elapsed)
+    if cassette is not None:
+        cassette.record(model_name, _hash_prompt(prompt), text, elapsed)
+    return text
+
+
+def _store_generation(model_name: str, prompt: str, prompt_hash: str, text: str) -> None:
+    _generation_cache.put(model_name, prompt_hash, text)
+    _remember_raw_key(model_name, prompt)
+
+
+# Latency-aware routing. With GEMINI_ROUTER_MODELS set, requests that name no model (or the
+# logical model "auto") go to the fastest healthy model of that list, judged by EWMAs of latency
+# and error rate. Cache, negative cache and coalescing key on "auto", so an answer from any
+# routed model serves later requests. With GEMINI_ROUTER_HEDGE, a sync request still running
+# after the chosen model's recent p95 also goes to the next best model; the first answer wins.
+# At most GEMINI_HEDGE_WORKERS hedges run at once per process; past that, requests go unhedged
+# rather than queue for a slot. Primaries are never limited by it.
+ROUTED_MODEL_NAME = "auto"
+_ROUTER_MODELS = [name.strip() for name in os.environ.get("GEMINI_ROUTER_MODELS", "").split(",") if name.strip()]
+_ROUTER_HEDGE = os.environ.get("GEMINI_ROUTER_HEDGE", "0").lower() in ("1", "true", "yes")
+_HEDGE_MIN_SAMPLES = int(os.environ.get("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+_HEDGE_WORKERS = int(os.environ.get("GEMINI_HEDGE_WORKERS", "16"))
+_router = ModelRouter(_ROUTER_MODELS) if _ROUTER_MODELS else None
+_hedge_lock = threading.Lock()
+_hedge_slots: Tuple[int, threading.BoundedSemaphore] | None = None
+_hedge_stats = {"hedged": 0, "hedge_wins": 0, "hedges_skipped": 0}
+
+
+def model_candidates(model_name: str | None = None) -> list[str]:
+    """Concrete models a request for `model_name` (default: the configured model) may be served by."""
+    model_name = model_name or _default_model_name()
+    if model_name == ROUTED_MODEL_NAME and _router is not None:
+        return list(_router.models)
+    return [model_name]
+
+
+def get_router_stats() -> Dict[str, object] | None:
+    """Return per-model latency/error EWMAs and hedge counts, or None when routing is off."""
+    if _router is None:
+        return None
+    with _hedge_lock:
+        hedges = dict(_hedge_stats)
+    return {"models": _router.snapshot(), **hedges}
+
+
+def _hedge_semaphore() -> threading.BoundedSemaphore:
+    global _hedge_slots
+    with _hedge_lock:
+        # Slots held by threads of the parent process are never released in a forked worker.
+        if _hedge_slots is None or _hedge_slots[0] != os.getpid():
+            _hedge_slots = (os.getpid(), threading.BoundedSemaphore(max(1, _HEDGE_WORKERS)))
+        return _hedge_slots[1]
+
+
+def _start_attempt(name: str, fn: Callable[[], str], on_exit: Callable[[], None] | None = None) -> Future:
+    """Run `fn` on its own daemon thread, so a call that loses a hedge never holds up a pool."""
+    future: Future = Future()
+
+    def run() -> None:
+        try:
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(fn())
+            except BaseException as exc:
+                future.set_exception(exc)
+        finally:
+            if on_exit is not None:
+                on_exit()
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+
+def _open_models() -> set[str]:
+    return {name for name, state in _breakers.snapshot().items() if state["state"] == CircuitBreaker.OPEN}
+
+
+def _route(model_name: str, exclude: set[str] | None = None) -> str | None:
+    """Map the logical routed model to a concrete one; other names pass through."""
+    if model_name != ROUTED_MODEL_NAME or _router is None:
+        return model_name
+    unavailable = _open_models() | (exclude or set())
+    chosen = _router.choose(unavailable)
+    if chosen is None and not exclude:
+        # Every breaker is open: pick anyway and let admission fail fast.
+        chosen = _router.choose()
+    if chosen is not None:
+        _router.started(chosen)
+    return chosen
+
+
+def _record_route(model_name: str, seconds: float, ok: bool) -> None:
+    if _router is not None:
+        _router.record(model_name, seconds, ok)
+
+
+class _HedgeCancelled(Exception):
+    """The other attempt of a hedged request already answered."""
+
+
+def _attempt_model(
+    model_name: str,
+    prompt: str,
+    user_id: str | None,
+    deadline: float | None,
+    cancelled: threading.Event | None = None,
+) -> str:
+    """
+    One admitted, retried, timed generation against a concrete model (no caching).
+
+    Once `cancelled` is set no further retry starts; the abandoned attempt counts as
+    neither a success nor a failure.
+    """
+    breaker = _admit(model_name, prompt, user_id, deadline)
+    started = time.perf_counter()
+
+    def call(timeout: float | None) -> str:
+        if cancelled is not None and cancelled.is_set():
+            raise _HedgeCancelled()
+        return _timed_call_gemini(model_name, prompt, timeout=timeout)
+
+    try:
+        text = _retry_policy.run(call, _is_retryable, deadline)
+    except _HedgeCancelled:
+        breaker.release()
+        raise
+    except Exception:
+        breaker.record_failure()
+        _record_route(model_name, time.perf_counter() - started, ok=False)
+        raise
+    breaker.record_success()
+    _record_route(model_name, time.perf_counter() - started, ok=True)
+    return text
+
+
+def _hedged_generate(prompt: str, user_id: str | None, deadline: float | None) -> str:
+    primary = _route(ROUTED_MODEL_NAME)
+    delay = _router.hedge_delay(primary, _HEDGE_MIN_SAMPLES) if _ROUTER_HEDGE else None
+    if delay is None or len(_router.models) < 2:
+        return _attempt_model(primary, prompt, user_id, deadline)
+
+    cancelled = threading.Event()
+    futures = [_start_attempt(
+        "gemini-primary", lambda: _attempt_model(primary, prompt, user_id, deadline, cancelled)
+    )]
+    remaining = remaining_seconds(deadline)
+    done, _ = wait(futures, timeout=delay if remaining is None else min(delay, max(remaining, 0)))
+    if not done:
+        slots = _hedge_semaphore()
+        if not slots.acquire(blocking=False):
+            with _hedge_lock:
+                _hedge_stats["hedges_skipped"] += 1
+        else:
+            secondary = _route(ROUTED_MODEL_NAME, exclude={primary})
+            if secondary is None:
+                slots.release()
+            else:
+                with _hedge_lock:
+                    _hedge_stats["hedged"] += 1
+                futures.append(_start_attempt(
+                    "gemini-hedge",
+                    lambda: _attempt_model(secondary, prompt, user_id, deadline, cancelled),
+                    on_exit=slots.release,
+                ))
+
+    # First success wins; the loser finishes its current call (updating the router) but
+    # starts no further retries.
+    errors: list[BaseException] = []
+    try:
+        for future in as_completed(futures, timeout=remaining_seconds(deadline)):
+            try:
+                text = future.result()
+            except Exception as exc:
+                errors.append(exc)
+                continue
+            if future is not futures[0]:
+                with _hedge_lock:
+                    _hedge_stats["hedge_wins"] += 1
+            return text
+    except FutureTimeoutError:
+        raise DeadlineExceeded("Gemini generation failed: request deadline exceeded") from None
+    finally:
+        cancelled.set()
+    raise errors[0]
+
+
+def _generate_routed(prompt: str, prompt_hash: str) -> str:
+    try:
+        text = _hedged_generate(prompt, _current_user.get(), _current_deadline.get())
+    except Exception as exc:
+        # Admission is inside the attempts here: only cache failures that reached a model.
+        if not isinstance(exc, (DeadlineExceeded, RateLimitExceeded, CircuitOpenError)):
+            _failure_cache.put(ROUTED_MODEL_NAME, prompt_hash, str(exc))
+        raise
+    _store_generation(ROUTED_MODEL_NAME, prompt, prompt_hash, text)
+    return text
+
+
+def _generate_and_cache(model_name: str, prompt: str, prompt_hash: str) -> str:
+    if model_name == ROUTED_MODEL_NAME and _router is not None:
+        return _generate_routed(prompt, prompt_hash)
+    deadline = _current_deadline.get()
+    breaker = _admit(model_name, prompt, _current_user.get(), deadline)
+    try:
+        text = _retry_policy.run(
+            lambda timeout: _timed_call_gemini(model_name, prompt, timeout=timeout),
+            _is_retryable,
+            deadline,
+        )
+    except Exception as exc:
+        breaker.record_failure()
+        # Running out of this caller's time says nothing about the next caller's prompt.
+        if not isinstance(exc, DeadlineExceeded):
+            _failure_cache.put(model_name, prompt_hash, str(exc))
+        raise
+    breaker.record_success()
+    _store_generation(model_name, prompt, prompt_hash, text)
+    return text
 
 
 def generate_text_with_gemini(prompt: str, model_name: str | None = None) -> str:
@@ -99,15 +878,35 @@ def generate_text_with_gemini(prompt: str, model_name: str | None = None) -> str
         RuntimeError: If the SDK/API key is not configured or generation fails.
 
     Caching notes:
-        - This function implements a simple in-process, time-based cache (TTL) keyed by
+        - This function uses an in-process LRU cache with a TTL keyed by
           (model_name, sha256(prompt)). This avoids recomputing identical generations for a
-          period (default 5 minutes). The cache is process-local and ephemeral.
-        - For production, prefer an external cache (Redis/Memcached) with:
-            key: f"gemini:{model}:{sha256(prompt)}"
-            value: generated_text
-            TTL: tuned to your freshness/cost needs (e.g., 5–60 minutes)
-          You can also cache negative results/timeouts to throttle repeated failures.
-        - Consider prompt normalization (trim whitespace, collapse spaces) to increase cache hits.
+          period (default 5 minutes). The cache is process-local and ephemeral; see
+          `generation_cache.LRUTTLCache`. `GEMINI_CACHE_MAX_BYTES` bounds it by size as well,
+          and `GEMINI_CACHE_COMPRESS_MIN_BYTES` zlib-compresses larger values. `GEMINI_CACHE_BACKEND` can put a shared SQLite
+          or Redis-protocol tier behind it, or use either on its own.
+        - The Redis tier stores key f"gemini:{model}:{key_hash}" with a server-side TTL
+          (`GEMINI_CACHE_REDIS_TTL_SECONDS`), tuned to your freshness/cost needs.
+        - Failures are cached per prompt for `GEMINI_NEGATIVE_CACHE_TTL_SECONDS` and feed a
+          per-model circuit breaker, so outages fail fast; see `get_breaker_states()`.
+        - Remote calls wait for capacity in a fair per-user queue when `GEMINI_RATE_LIMIT_RPM`
+          is set; wrap calls in `generation_context(user_id=...)` to attribute them.
+        - Transient errors (429/5xx/timeouts) are retried with jittered exponential backoff;
+          each attempt is capped by `GEMINI_CALL_TIMEOUT_SECONDS` and the whole call by the
+          `generation_context` deadline. See `get_retry_stats()`.
+        - With `GEMINI_CACHE_STALE_SECONDS` set, an entry past its TTL is still returned for
+          that long while one background refresh per key regenerates it; see
+          `get_refresh_stats()`. After the window, callers block on a fresh generation.
+        - With `GEMINI_ROUTER_MODELS` set, requests without a model go to the fastest healthy
+          model of that list, optionally hedged to a second one after the first's p95
+          (`GEMINI_ROUTER_HEDGE`); see `get_router_stats()`.
+        - Concurrent callers with the same (model_name, sha256(prompt)) are coalesced onto a
+          single in-flight request; see `get_coalesced_count()`.
+        - `GEMINI_CASSETTE_MODE=record|replay` writes remote responses and their latency to
+          `GEMINI_CASSETTE_PATH`, or serves them back from it without network access. Set
+          `GEMINI_CACHE_TTL_SECONDS=0` to replay every call rather than only cache misses.
+        - Cache keys are computed from a canonical form of the prompt (line endings, Unicode
+          NFC, trailing/outer whitespace, runs of spaces) selected by
+          `GEMINI_PROMPT_CANONICALIZATION`; see `get_canonicalization_stats()`.
         - Bust the cache when models are updated or when you roll out new safety/parameters.
     """
 
@@ -115,28 +914,376 @@ def generate_text_with_gemini(prompt: str, model_name: str | None = None) -> str
         raise RuntimeError("Prompt must be a non-empty string")
 
     _configure_once()
-    model_name = model_name or os.environ.get("GEMINI_MODEL_NAME", "models/gemini-2.0-flash")
+    model_name = model_name or _default_model_name()
 
-    cached = _cache_get(model_name, prompt)
+    prompt_hash = _prompt_key(prompt)
+    cached = _generation_cache.get(model_name, prompt_hash)
+    if cached is None:
+        cached = _serve_stale(model_name, prompt, prompt_hash)
+    _record_lookup(model_name, prompt, cached is not None)
     if cached is not None:
         return cached
 
+    recent_failure = _failure_cache.get(model_name, prompt_hash)
+    if recent_failure is not None:
+        raise RuntimeError(recent_failure)
+
+    # Identical prompts already in flight share one remote call instead of racing the cache.
+    return _inflight.do(
+        (model_name, prompt_hash),
+        lambda: _generate_and_cache(model_name, prompt, prompt_hash),
+        timeout=remaining_seconds(_current_deadline.get()),
+    )
+
+
+def _stream_gemini(model_name: str, prompt: str, timeout: float | None = None) -> Iterator[str]:
+    if _fake_backend is not None:
+        yield from _fake_backend.stream(prompt, model_name=model_name, timeout=timeout)
+        return
+    try:
+        model = _get_model(model_name)
+        response = model.generate_content(prompt, stream=True, request_options=_request_options(timeout))
+        for chunk in response:
+            try:
+                delta = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety metadata only) carry no delta.
+                continue
+            if delta:
+                yield delta
+    except Exception as exc:  # pragma: no cover
+        raise RuntimeError(f"Gemini generation failed: {exc}") from exc
+
+
+def _remote_stream(model_name: str, prompt: str, timeout: float | None = None) -> Iterator[str]:
+    cassette = _cassette
+    if cassette is not None and cassette.replaying:
+        # Cassettes keep whole responses, so a replayed stream is one delta.
+        yield cassette.replay(model_name, _hash_prompt(prompt))
+        return
+    yield from _stream_gemini(model_name, prompt, timeout=timeout)
+
+
+def stream_text_with_gemini(prompt: str, model_name: str | None = None) -> Iterator[str]:
+    """
+    Stream generated text from Gemini as a sequence of text deltas.
+
+    Shares the cache, negative cache and circuit breaker of `generate_text_with_gemini`.
+    A cache hit yields the whole cached text as a single delta. When the stream
+    completes, the joined text is written to the generation cache. Streams are not
+    coalesced: each caller gets its own remote stream.
+
+    Raises:
+        RuntimeError: If the SDK/API key is not configured or generation fails. As this is
+            a generator, errors surface on iteration rather than on the call itself.
+    """
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise RuntimeError("Prompt must be a non-empty string")
+
+    _configure_once()
+    model_name = model_name or _default_model_name()
+
+    prompt_hash = _prompt_key(prompt)
+    cached = _generation_cache.get(model_name, prompt_hash)
+    if cached is None:
+        cached = _serve_stale(model_name, prompt, prompt_hash)
+    _record_lookup(model_name, prompt, cached is not None)
+    if cached is not None:
+        yield cached
+        return
+
+    recent_failure = _failure_cache.get(model_name, prompt_hash)
+    if recent_failure is not None:
+        raise RuntimeError(recent_failure)
+
+    deadline = _current_deadline.get()
+    # Streams are routed but never hedged: deltas from two models can't be interleaved.
+    remote_model = _route(model_name)
+    breaker = _admit(remote_model, prompt, _current_user.get(), deadline)
+    parts: list[str] = []
+    started = time.perf_counter()
+    try:
+        # Deltas may already have reached the client, so streams are never retried.
+        for delta in _remote_stream(remote_model, prompt, timeout=_retry_policy.attempt_timeout(deadline)):
+            parts.append(delta)
+            yield delta
+        if not parts:
+            raise RuntimeError("Gemini generation failed: Empty response from Gemini")
+    except GeneratorExit:
+        # Client went away mid-stream; the partial text must not be cached. A disconnect says
+        # nothing about upstream health, so free a half-open probe slot without an outcome.
+        breaker.release()
+        raise
+    except Exception as exc:
+        elapsed = time.perf_counter() - started
+        _call_latency.observe(remote_model, elapsed, error=True)
+        _record_route(remote_model, elapsed, ok=False)
+        breaker.record_failure()
+        if not isinstance(exc, DeadlineExceeded):
+            _failure_cache.put(model_name, prompt_hash, str(exc))
+        raise
+    elapsed = time.perf_counter() - started
+    _call_latency.observe(remote_model, elapsed)
+    _record_route(remote_model, elapsed, ok=True)
+    breaker.record_success()
+    text = "".join(parts)
+    if _cassette is not None:
+        _cassette.record(remote_model, _hash_prompt(prompt), text, elapsed)
+    _store_generation(model_name, prompt, prompt_hash, text)
+
+
+class _BackgroundLoop:
+    """
+    A single long-lived event loop thread that owns all async Gemini calls.
+
+    The SDK's async client is bound to the loop it was first used on, and callers
+    such as Flask async views run each request on a fresh loop. Running every async
+    generation here keeps one client and lets one thread carry many in-flight calls.
+    Because only this thread touches `inflight`, async coalescing needs no lock.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pid = 0
+        self.inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.coalesced = 0
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # A forked worker inherits the object but not the thread, so start a new one.
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="gemini-async", daemon=True).start()
+                self._loop = loop
+                self._pid = os.getpid()
+                self.inflight = {}
+            return self._loop
+
+    async def run(self, coro: Awaitable[str]) -> str:
+        """Run `coro` on the background loop and await its result from the caller's loop."""
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        return await asyncio.wrap_future(future)
+
+
+_async_loop = _BackgroundLoop()
+
+
+async def _acall_gemini(model_name: str, prompt: str, timeout: float | None = None) -> str:
+    if _fake_backend is not None:
+        return await _fake_backend.agenerate(prompt, model_name=model_name, timeout=timeout)
     try:
-        model = genai.GenerativeModel(model_name)
-        response = model.generate_content(prompt)
-        # Newer SDKs expose `.text`; older may require concatenating parts.
-        text = getattr(response, "text", None)
-        if not text:
-            # Fallback: join candidates content
-            text = "".join(getattr(candidate, "content", "") for candidate in getattr(response, "candidates", [])).strip()
-        if not text:
-            raise RuntimeError("Empty response from Gemini")
+        model = _get_model(model_name)
+        response = await model.generate_content_async(prompt, request_options=_request_options(timeout))
+        text = _response_text(response)
     except Exception as exc:  # pragma: no cover
         raise RuntimeError(f"Gemini generation failed: {exc}") from exc
+    return text
+
 
-    _cache_put(model_name, prompt, text)
+async def _atimed_call_gemini(model_name: str, prompt: str, timeout: float | None = None) -> str:
+    cassette = _cassette
+    started = time.perf_counter()
+    try:
+        if cassette is not None and cassette.replaying:
+            text = await cassette.areplay(model_name, _hash_prompt(prompt))
+        else:
+            text = await _acall_gemini(model_name, prompt, timeout=timeout)
+    except Exception:
+        _call_latency.observe(model_name, time.perf_counter() - started, error=True)
+        raise
+    elapsed = time.perf_counter() - started
+    _call_latency.observe(model_name, elapsed)
+    if cassette is not None:
+        # Appending a line is a small blocking write; acceptable for a benchmarking mode.
+        cassette.record(model_name, _hash_prompt(prompt), text, elapsed)
     return text
 
 
+async def _agenerate_and_cache(
+    model_name: str, prompt: str, prompt_hash: str, user_id: str | None, deadline: float | None
+) -> str:
+    # Runs on the background loop.
+    key = (model_name, prompt_hash)
+    existing = _async_loop.inflight.get(key)
+    if existing is not None:
+        _async_loop.coalesced += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(existing), remaining_seconds(deadline))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Gemini generation failed: request deadline exceeded") from None
 
+    future = asyncio.get_running_loop().create_future()
+    _async_loop.inflight[key] = future
+    try:
+        # Async calls are routed but not hedged.
+        remote_model = _route(model_name)
+        if _rate_limiter.enabled:
+            # Queueing for capacity blocks, so keep it off the event loop.
+            loop = asyncio.get_running_loop()
+            breaker = await loop.run_in_executor(None, _admit, remote_model, prompt, user_id, deadline)
+        else:
+            _check_deadline(deadline)
+            breaker = _acquire_breaker(remote_model)
+        started = time.perf_counter()
+        try:
+            text = await _retry_policy.arun(
+                lambda timeout: _atimed_call_gemini(remote_model, prompt, timeout=timeout),
+                _is_retryable,
+                deadline,
+            )
+        except Exception as exc:
+            breaker.record_failure()
+            _record_route(remote_model, time.perf_counter() - started, ok=False)
+            if not isinstance(exc, DeadlineExceeded):
+                _failure_cache.put(model_name, prompt_hash, str(exc))
+            raise
+        breaker.record_success()
+        _record_route(remote_model, time.perf_counter() - started, ok=True)
+        # The L2/L3 tiers do blocking SQLite and Redis I/O, so keep them off the shared loop.
+        await asyncio.get_running_loop().run_in_executor(
+            None, _store_generation, model_name, prompt, prompt_hash, text
+        )
+    except BaseException as exc:
+        future.set_exception(exc)
+        # Mark the exception retrieved so unawaited leaders don't log warnings.
+        future.exception()
+        raise
+    else:
+        future.set_result(text)
+        return text
+    finally:
+        _async_loop.inflight.pop(key, None)
+
+
+async def agenerate_text_with_gemini(prompt: str, model_name: str | None = None) -> str:
+    """
+    Async counterpart of `generate_text_with_gemini`.
 
+    Cache hits and recent failures are answered on the caller's loop. Misses are
+    awaited on a shared background loop (see `_BackgroundLoop`) using the SDK's
+    native async API, so hundreds of generations can be in flight without a thread
+    each. Identical in-flight prompts are coalesced as in the sync path.
+
+    Raises:
+        RuntimeError: If the SDK/API key is not configured or generation fails.
+    """
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise RuntimeError("Prompt must be a non-empty string")
+
+    _configure_once()
+    model_name = model_name or _default_model_name()
+
+    prompt_hash = _prompt_key(prompt)
+    cached = _generation_cache.get(model_name, prompt_hash)
+    if cached is None:
+        cached = _serve_stale(model_name, prompt, prompt_hash)
+    _record_lookup(model_name, prompt, cached is not None)
+    if cached is not None:
+        return cached
+
+    recent_failure = _failure_cache.get(model_name, prompt_hash)
+    if recent_failure is not None:
+        raise RuntimeError(recent_failure)
+
+    return await _async_loop.run(
+        _agenerate_and_cache(model_name, prompt, prompt_hash, _current_user.get(), _current_deadline.get())
+    )
+
+
+# Counter-like keys of the cache stats dicts; everything else is a point-in-time gauge.
+_CACHE_COUNTER_STATS = ("hits", "misses", "stale_hits", "evictions", "expirations", "errors")
+
+
+def render_prometheus_metrics() -> str:
+    """
+    Render cache, latency and resilience metrics in the Prometheus text format.
+
+    Cache series carry a `tier` label: `l1` for the configured (or memory) tier and
+    `l2` for the shared tier of a tiered backend. Counters are per process; the
+    disk tier's `items`/`bytes` gauges describe the shared file.
+    """
+    out = PrometheusText()
+    for key, value in get_cache_stats().items():
+        tier, name = ("l2", key[3:]) if key.startswith("l2_") else ("l1", key)
+        if name in _CACHE_COUNTER_STATS:
+            out.sample(f"gemini_cache_{name}_total", "counter", f"Generation cache {name}.", value, tier=tier)
+        elif name in ("items", "bytes"):
+            out.sample(f"gemini_cache_{name}", "gauge", f"Generation cache size in {name}.", value, tier=tier)
+        elif name == "raw_bytes":
+            out.sample(
+                "gemini_cache_raw_bytes", "gauge", "Uncompressed size of cached values in bytes.",
+                value, tier=tier,
+            )
+        elif name == "compression_ratio":
+            out.sample(
+                "gemini_cache_compression_ratio", "gauge", "Uncompressed over stored bytes of cached values.",
+                value, tier=tier,
+            )
+    out.sample(
+        "gemini_cache_max_items", "gauge", "Configured GEMINI_CACHE_MAX_ITEMS.", _CACHE_MAX_ITEMS
+    )
+    out.sample(
+        "gemini_cache_max_bytes", "gauge", "Configured GEMINI_CACHE_MAX_BYTES (0 = unbounded).", _CACHE_MAX_BYTES
+    )
+    out.sample(
+        "gemini_cache_ttl_seconds", "gauge", "Configured GEMINI_CACHE_TTL_SECONDS.", _CACHE_TTL_SECONDS
+    )
+    out.sample(
+        "gemini_coalesced_calls_total", "counter",
+        "Generations served by an identical in-flight call.", get_coalesced_count(),
+    )
+    for model_name, snapshot in get_latency_stats().items():
+        out.histogram(
+            "gemini_request_duration_seconds", "Latency of remote Gemini calls per attempt.",
+            snapshot, model=model_name,
+        )
+        out.sample(
+            "gemini_request_errors_total", "counter", "Remote Gemini calls that raised.",
+            snapshot["errors"], model=model_name,
+        )
+    for model_name, state in get_breaker_states().items():
+        out.sample(
+            "gemini_circuit_open", "gauge", "1 while the model's circuit breaker is not closed.",
+            state["state"] != CircuitBreaker.CLOSED, model=model_name,
+        )
+    for name, value in get_refresh_stats().items():
+        if name == "pending":
+            out.sample("gemini_cache_refreshes_pending", "gauge", "Stale-entry refreshes in flight.", value)
+        else:
+            out.sample(
+                f"gemini_cache_refreshes_{name}_total", "counter", f"Stale-entry refreshes {name}.", value
+            )
+    router = get_router_stats()
+    if router is not None:
+        for model_name, health in router["models"].items():
+            if health["latency_ewma_seconds"] is not None:
+                out.sample(
+                    "gemini_router_latency_ewma_seconds", "gauge", "EWMA of successful call latency per model.",
+                    health["latency_ewma_seconds"], model=model_name,
+                )
+            out.sample(
+                "gemini_router_error_rate_ewma", "gauge", "EWMA of the error rate per model.",
+                health["error_rate_ewma"], model=model_name,
+            )
+        out.sample("gemini_router_hedged_total", "counter", "Hedged requests sent to a second model.", router["hedged"])
+        out.sample(
+            "gemini_router_hedges_skipped_total", "counter",
+            "Hedges not sent because GEMINI_HEDGE_WORKERS were all busy.", router["hedges_skipped"],
+        )
+        out.sample(
+            "gemini_router_hedge_wins_total", "counter", "Hedged requests answered first by the second model.",
+            router["hedge_wins"],
+        )
+    retry = get_retry_stats()
+    out.sample("gemini_retries_total", "counter", "Retried remote attempts.", retry["retries"])
+    limiter = get_rate_limiter_stats()
+    out.sample(
+        "gemini_rate_limit_rejected_total", "counter", "Calls rejected by the rate limiter.",
+        limiter["rejected"],
+    )
+    out.sample(
+        "gemini_rate_limit_queue_depth", "gauge", "Calls waiting for rate limit capacity.",
+        limiter["queue_depth"],
+    )
+    return out.render()
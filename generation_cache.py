@@ -0,0 +1,620 @@
+from __future__ import annotations
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+from urllib.parse import unquote, urlparse
+
+from services.interfaces import GenerationCache
+
+CacheKey = Tuple[str, str]
+
+
+class _Stripe:
+    """One independently locked LRU segment of an `LRUTTLCache`."""
+
+    __slots__ = (
+        "lock", "entries", "capacity", "max_bytes", "bytes", "raw_bytes", "compressed",
+        "hits", "misses", "evictions", "expirations", "stale_hits",
+    )
+
+    def __init__(self, capacity: int, max_bytes: int) -> None:
+        self.lock = threading.Lock()
+        # key -> (stored_at, value, size_bytes, raw_bytes); insertion order doubles as
+        # recency order. `value` is zlib-compressed bytes when it was worth compressing.
+        self.entries: "OrderedDict[CacheKey, Tuple[float, str | bytes, int, int]]" = OrderedDict()
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.raw_bytes = 0
+        self.compressed = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+
+    def drop(self, key: CacheKey) -> None:
+        _, value, size_bytes, raw_bytes = self.entries.pop(key)
+        self.bytes -= size_bytes
+        self.raw_bytes -= raw_bytes
+        self.compressed -= isinstance(value, bytes)
+
+    def drop_oldest(self) -> None:
+        self.drop(next(iter(self.entries)))
+        self.evictions += 1
+
+
+class LRUTTLCache:
+    """
+    In-process LRU cache with a per-entry TTL and O(1) get/put.
+
+    Keys are `(model_name, prompt_hash)` pairs. The key space is split across
+    `stripes` independently locked segments so concurrent requests for different
+    prompts rarely contend on the same lock. Each stripe is an `OrderedDict`
+    kept in recency order, so eviction pops the least recently used entry of
+    that stripe instead of scanning the whole store.
+
+    Eviction is LRU per stripe, which approximates global LRU closely once the
+    cache holds more than a handful of entries per stripe.
+
+    Besides `max_items`, the cache can be bounded by `max_bytes` of stored values
+    (0 = no byte bound), split evenly across stripes; a value larger than one
+    stripe's share is not cached. Values of at least `compress_min_bytes` UTF-8
+    bytes (0 = never) are stored zlib-compressed when that makes them smaller,
+    trading a little CPU on each hit for more entries per byte of RAM.
+
+    With `stale_seconds` > 0, entries outlive their TTL by that long: `get` treats
+    them as misses, but `get_stale` still returns them, so callers can serve a
+    stale value while they refresh it.
+    """
+
+    def __init__(
+        self,
+        max_items: int,
+        ttl_seconds: float,
+        stripes: int = 8,
+        max_bytes: int = 0,
+        compress_min_bytes: int = 0,
+        compress_level: int = 1,
+        stale_seconds: float = 0,
+    ) -> None:
+        self.max_items = max(0, int(max_items))
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = max(0.0, stale_seconds)
+        self.max_bytes = max(0, int(max_bytes))
+        self.compress_min_bytes = max(0, int(compress_min_bytes))
+        self.compress_level = compress_level
+        stripe_count = max(1, min(int(stripes), self.max_items or 1))
+        # Spread capacity so the stripes together never exceed `max_items` / `max_bytes`.
+        base, extra = divmod(self.max_items, stripe_count)
+        stripe_bytes = self.max_bytes // stripe_count
+        self._stripes = [
+            _Stripe(base + (1 if i < extra else 0), stripe_bytes) for i in range(stripe_count)
+        ]
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_items > 0
+
+    def _stripe_for(self, key: CacheKey) -> _Stripe:
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def _encode(self, text: str) -> Tuple[str | bytes, int, int]:
+        raw = text.encode("utf-8")
+        if self.compress_min_bytes and len(raw) >= self.compress_min_bytes:
+            packed = zlib.compress(raw, self.compress_level)
+            if len(packed) < len(raw):
+                return packed, len(packed), len(raw)
+        return text, len(raw), len(raw)
+
+    def get(self, model_name: str, prompt_hash: str) -> str | None:
+        if not self.enabled:
+            return None
+        key = (model_name, prompt_hash)
+        stripe = self._stripe_for(key)
+        now = time.monotonic()
+        with stripe.lock:
+            entry = stripe.entries.get(key)
+            if entry is None:
+                stripe.misses += 1
+                return None
+            stored_at, value = entry[0], entry[1]
+            age = now - stored_at
+            if age > self.ttl_seconds:
+                # Keep it around for `get_stale` until the stale window has passed too.
+                if age > self.ttl_seconds + self.stale_seconds:
+                    stripe.drop(key)
+                    stripe.expirations += 1
+                stripe.misses += 1
+                return None
+            stripe.entries.move_to_end(key)
+            stripe.hits += 1
+        return self._decode(value)
+
+    @staticmethod
+    def _decode(value: str | bytes) -> str:
+        # Callers decompress outside the stripe lock; the stored bytes are immutable.
+        return zlib.decompress(value).decode("utf-8") if isinstance(value, bytes) else value
+
+    def get_stale(self, model_name: str, prompt_hash: str) -> str | None:
+        """Return an entry past its TTL but still inside the stale window, else None."""
+        if not self.enabled or self.stale_seconds <= 0:
+            return None
+        key = (model_name, prompt_hash)
+        stripe = self._stripe_for(key)
+        now = time.monotonic()
+        with stripe.lock:
+            entry = stripe.entries.get(key)
+            if entry is None:
+                return None
+            age = now - entry[0]
+            if age <= self.ttl_seconds or age > self.ttl_seconds + self.stale_seconds:
+                return None
+            stripe.entries.move_to_end(key)
+            stripe.stale_hits += 1
+            value = entry[1]
+        return self._decode(value)
+
+    def put(self, model_name: str, prompt_hash: str, text: str) -> None:
+        if not self.enabled:
+            return
+        key = (model_name, prompt_hash)
+        stripe = self._stripe_for(key)
+        if stripe.capacity <= 0:
+            return
+        value, size_bytes, raw_bytes = self._encode(text)
+        if stripe.max_bytes and size_bytes > stripe.max_bytes:
+            return
+        now = time.monotonic()
+        with stripe.lock:
+            if key in stripe.entries:
+                stripe.drop(key)
+            while stripe.entries and (
+                len(stripe.entries) >= stripe.capacity
+                or (stripe.max_bytes and stripe.bytes + size_bytes > stripe.max_bytes)
+            ):
+                stripe.drop_oldest()
+            stripe.entries[key] = (now, value, size_bytes, raw_bytes)
+            stripe.bytes += size_bytes
+            stripe.raw_bytes += raw_bytes
+            stripe.compressed += isinstance(value, bytes)
+
+    def clear(self) -> None:
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+                stripe.bytes = stripe.raw_bytes = stripe.compressed = 0
+
+    def __len__(self) -> int:
+        return sum(len(stripe.entries) for stripe in self._stripes)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return a snapshot of hit/miss/eviction/expiry counters and the current size.
+
+        `bytes` is what the stored values occupy, `raw_bytes` their uncompressed size,
+        and `compression_ratio` is raw over stored (1.0 when nothing is compressed).
+        """
+        totals: Dict[str, float] = {
+            "hits": 0, "misses": 0, "stale_hits": 0, "evictions": 0, "expirations": 0,
+            "items": 0, "bytes": 0, "raw_bytes": 0, "compressed_items": 0,
+        }
+        for stripe in self._stripes:
+            with stripe.lock:
+                totals["hits"] += stripe.hits
+                totals["misses"] += stripe.misses
+                totals["stale_hits"] += stripe.stale_hits
+                totals["evictions"] += stripe.evictions
+                totals["expirations"] += stripe.expirations
+                totals["items"] += len(stripe.entries)
+                totals["bytes"] += stripe.bytes
+                totals["raw_bytes"] += stripe.raw_bytes
+                totals["compressed_items"] += stripe.compressed
+        totals["compression_ratio"] = (totals["raw_bytes"] / totals["bytes"]) if totals["bytes"] else 1.0
+        return totals
+
+
+class SQLiteCache:
+    """
+    Disk-backed generation cache shared by every process that opens the same file.
+
+    Entries live in a single SQLite table keyed by `(model_name, prompt_hash)`.
+    The database runs in WAL mode with a busy timeout so many gunicorn workers can
+    read concurrently while one writes. Each thread (and each forked process)
+    opens its own connection lazily.
+
+    The total size of stored values is kept under `max_bytes` by deleting the
+    least recently accessed rows. Expired rows are dropped on read and during
+    pruning, which runs every `prune_every` writes rather than on each one.
+
+    Like `RedisCache`, the cache is best effort: a database error (typically
+    "database is locked" once `timeout_seconds` pass) counts as a miss or a skipped
+    write and is tallied in `errors`, so it never fails a generation.
+    """
+
+    # Avoid a write on every hit: only refresh `accessed_at` when it is this stale.
+    _TOUCH_INTERVAL_SECONDS = 30.0
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: float,
+        max_bytes: int = 256 * 1024 * 1024,
+        prune_every: int = 32,
+        timeout_seconds: float = 5.0,
+    ) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max(0, int(max_bytes))
+        self.prune_every = max(1, int(prune_every))
+        self.timeout_seconds = timeout_seconds
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        self._puts_since_prune = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._errors = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection()  # create the schema eagerly so misconfiguration fails fast
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_bytes > 0
+
+    def _count_error(self) -> None:
+        with self._counter_lock:
+            self._errors += 1
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork, so remember which process opened them.
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=self.timeout_seconds, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            " model_name TEXT NOT NULL,"
+            " prompt_hash TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " size_bytes INTEGER NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (model_name, prompt_hash))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_generations_accessed_at ON generations (accessed_at)"
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, model_name: str, prompt_hash: str) -> str | None:
+        if not self.enabled:
+            return None
+        try:
+            return self._get(model_name, prompt_hash)
+        except sqlite3.Error:
+            with self._counter_lock:
+                self._errors += 1
+                self._misses += 1
+            return None
+
+    def _get(self, model_name: str, prompt_hash: str) -> str | None:
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, stored_at, accessed_at FROM generations"
+            " WHERE model_name = ? AND prompt_hash = ?",
+            (model_name, prompt_hash),
+        ).fetchone()
+        if row is None:
+            with self._counter_lock:
+                self._misses += 1
+            return None
+        value, stored_at, accessed_at = row
+        if now - stored_at > self.ttl_seconds:
+            conn.execute(
+                "DELETE FROM generations WHERE model_name = ? AND prompt_hash = ? AND stored_at = ?",
+                (model_name, prompt_hash, stored_at),
+            )
+            with self._counter_lock:
+                self._expirations += 1
+                self._misses += 1
+            return None
+        if now - accessed_at > self._TOUCH_INTERVAL_SECONDS:
+            conn.execute(
+                "UPDATE generations SET accessed_at = ? WHERE model_name = ? AND prompt_hash = ?",
+                (now, model_name, prompt_hash),
+            )
+        with self._counter_lock:
+            self._hits += 1
+        return value
+
+    def put(self, model_name: str, prompt_hash: str, text: str) -> None:
+        if not self.enabled:
+            return
+        size_bytes = len(text.encode("utf-8"))
+        if size_bytes > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO generations"
+                " (model_name, prompt_hash, value, size_bytes, stored_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (model_name, prompt_hash, text, size_bytes, now, now),
+            )
+        except sqlite3.Error:
+            self._count_error()
+            return
+        with self._counter_lock:
+            self._puts_since_prune += 1
+            should_prune = self._puts_since_prune >= self.prune_every
+            if should_prune:
+                self._puts_since_prune = 0
+        if should_prune:
+            self.prune()
+
+    def prune(self) -> None:
+        """
+        Drop expired rows, then evict least recently accessed rows beyond `max_bytes`.
+
+        Skipped (and counted in `errors`) when the database stays locked; a later
+        prune catches up.
+        """
+        try:
+            self._prune()
+        except sqlite3.Error:
+            self._count_error()
+
+    def _prune(self) -> None:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute(
+                "DELETE FROM generations WHERE stored_at < ?", (now - self.ttl_seconds,)
+            ).rowcount
+            (total,) = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM generations").fetchone()
+            excess = total - self.max_bytes
+            victims = []
+            if excess > 0:
+                for rowid, size_bytes in conn.execute(
+                    "SELECT rowid, size_bytes FROM generations ORDER BY accessed_at"
+                ):
+                    victims.append((rowid,))
+                    excess -= size_bytes
+                    if excess <= 0:
+                        break
+                conn.executemany("DELETE FROM generations WHERE rowid = ?", victims)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._counter_lock:
+            self._expirations += max(expired, 0)
+            self._evictions += len(victims)
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM generations")
+
+    def __len__(self) -> int:
+        (count,) = self._connection().execute("SELECT COUNT(*) FROM generations").fetchone()
+        return count
+
+    def stats(self) -> Dict[str, int]:
+        """Return this process's hit/miss/eviction/expiry/error counters and the shared size."""
+        with self._counter_lock:
+            totals = {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "errors": self._errors,
+            }
+        try:
+            totals["items"], totals["bytes"] = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM generations"
+            ).fetchone()
+        except sqlite3.Error:
+            self._count_error()
+            totals["items"] = totals["bytes"] = 0
+        return totals
+
+
+class TieredCache:
+    """
+    Two-level cache: a fast in-process L1 in front of a slower shared L2.
+
+    Reads try L1 first and promote L2 hits into L1. Writes go to both tiers.
+    """
+
+    def __init__(self, l1: LRUTTLCache, l2: GenerationCache) -> None:
+        self.l1 = l1
+        self.l2 = l2
+
+    def get(self, model_name: str, prompt_hash: str) -> str | None:
+        value = self.l1.get(model_name, prompt_hash)
+        if value is not None:
+            return value
+        value = self.l2.get(model_name, prompt_hash)
+        if value is not None:
+            self.l1.put(model_name, prompt_hash, value)
+        return value
+
+    def get_stale(self, model_name: str, prompt_hash: str) -> str | None:
+        # Only the memory tier keeps entries past their TTL.
+        return self.l1.get_stale(model_name, prompt_hash)
+
+    def put(self, model_name: str, prompt_hash: str, text: str) -> None:
+        self.l1.put(model_name, prompt_hash, text)
+        self.l2.put(model_name, prompt_hash, text)
+
+    def clear(self) -> None:
+        self.l1.clear()
+        clear = getattr(self.l2, "clear", None)
+        if clear is not None:
+            clear()
+
+    def __len__(self) -> int:
+        return len(self.l1)
+
+    def stats(self) -> Dict[str, int]:
+        """Return L1 counters, plus L2 counters under an `l2_` prefix."""
+        totals = self.l1.stats()
+        totals.update({f"l2_{name}": value for name, value in self.l2.stats().items()})
+        return totals
+
+
+class RedisError(Exception):
+    """Error reply or protocol violation from a Redis-protocol server."""
+
+
+class RedisCache:
+    """
+    Generation cache stored in any server speaking the Redis protocol (RESP).
+
+    Talks RESP directly over a socket, so it needs no client library and works
+    with Redis, KeyDB, Valkey or a local fake. Keys are
+    `f"{key_prefix}{model_name}:{prompt_hash}"` and expire server-side after
+    `ttl_seconds`. Each thread (and each forked process) keeps its own connection.
+
+    The cache is best effort: a connection or protocol error counts as a miss and
+    is tallied in `errors`, so a cache outage never fails a generation.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        ttl_seconds: float,
+        key_prefix: str = "gemini:",
+        timeout_seconds: float = 0.5,
+    ) -> None:
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise RuntimeError(f"Unsupported Redis URL scheme: {parsed.scheme!r}. Use redis://host:port/db.")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.ttl_seconds = ttl_seconds
+        self.key_prefix = key_prefix
+        self.timeout_seconds = timeout_seconds
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def _key(self, model_name: str, prompt_hash: str) -> str:
+        return f"{self.key_prefix}{model_name}:{prompt_hash}"
+
+    def _connect(self) -> Tuple[socket.socket, Any]:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout_seconds)
+        reader = sock.makefile("rb")
+        self._local.sock, self._local.reader, self._local.pid = sock, reader, os.getpid()
+        if self.password:
+            self._execute("AUTH", self.password)
+        if self.db:
+            self._execute("SELECT", str(self.db))
+        return sock, reader
+
+    def _disconnect(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = self._local.reader = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _execute(self, *args: str | bytes) -> Any:
+        sock, reader = self._local.sock, self._local.reader
+        parts: List[bytes] = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else arg.encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        sock.sendall(b"".join(parts))
+        return self._read_reply(reader)
+
+    def _read_reply(self, reader: Any) -> Any:
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise RedisError("connection closed mid-reply")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(body.decode("utf-8", errors="replace"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise RedisError("connection closed mid-reply")
+            return data[:-2]
+        if kind == b"*":
+            length = int(body)
+            return None if length < 0 else [self._read_reply(reader) for _ in range(length)]
+        raise RedisError(f"unexpected reply type {kind!r}")
+
+    def command(self, *args: str | bytes) -> Any:
+        """Send one command, reconnecting first if this thread has no live connection."""
+        try:
+            if getattr(self._local, "sock", None) is None or getattr(self._local, "pid", None) != os.getpid():
+                self._connect()
+            return self._execute(*args)
+        except (OSError, RedisError):
+            # The connection may be half-read; never reuse it.
+            self._disconnect()
+            raise
+
+    def get(self, model_name: str, prompt_hash: str) -> str | None:
+        if not self.enabled:
+            return None
+        try:
+            value = self.command("GET", self._key(model_name, prompt_hash))
+        except (OSError, RedisError):
+            with self._counter_lock:
+                self._errors += 1
+                self._misses += 1
+            return None
+        with self._counter_lock:
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return None if value is None else value.decode("utf-8")
+
+    def put(self, model_name: str, prompt_hash: str, text: str) -> None:
+        if not self.enabled:
+            return
+        ttl_ms = str(max(1, int(self.ttl_seconds * 1000)))
+        try:
+            self.command("SET", self._key(model_name, prompt_hash), text, "PX", ttl_ms)
+        except (OSError, RedisError):
+            with self._counter_lock:
+                self._errors += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Return this process's hit/miss counts and connection/protocol error count."""
+        with self._counter_lock:
+            return {"hits": self._hits, "misses": self._misses, "errors": self._errors}
@@ -0,0 +1,103 @@
+"""
+Background worker threads that drain a job queue by polling.
+
+The queue itself lives elsewhere (for uploads, a database table); the pool only
+calls `run_once()` in a loop. `run_once` returns True when it did some work, in
+which case the worker immediately looks for more, and False when the queue was
+empty, in which case it sleeps until `notify()` or `poll_seconds` pass. Polling
+means jobs enqueued by other processes, or left behind by a restart, are picked
+up without any signal.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from typing import Callable, Dict, List
+
+
+class PollingWorkers:
+    """
+    A fixed number of daemon threads calling `run_once()` until stopped. Thread-safe.
+
+    Args:
+        run_once: does at most one job; returns whether there was one. Exceptions are
+            counted (see `stats`) and treated as an empty poll, so one bad job cannot
+            spin a worker.
+        workers: thread count; 0 makes `start` a no-op.
+        poll_seconds: idle sleep between polls.
+        name: thread name prefix.
+    """
+
+    def __init__(self, run_once: Callable[[], bool], workers: int, poll_seconds: float = 1.0,
+                 name: str = "worker") -> None:
+        self.run_once = run_once
+        self.workers = max(0, int(workers))
+        self.poll_seconds = max(0.01, poll_seconds)
+        self.name = name
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._pid = 0
+        self.processed = 0
+        self.errors = 0
+        self.last_error: str | None = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads) and self._pid == os.getpid() and not self._stopping.is_set()
+
+    def start(self) -> None:
+        """Start the threads if they are not running in this process. Idempotent and cheap."""
+        if self.workers == 0 or self.running:
+            return
+        with self._lock:
+            # A forked worker inherits no threads, so start anew there.
+            if self._threads and self._pid == os.getpid() and not self._stopping.is_set():
+                return
+            self._stopping = threading.Event()
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._loop, args=(self._stopping,), name=f"{self.name}-{index}", daemon=True)
+                for index in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def notify(self) -> None:
+        """Wake idle workers now, e.g. right after enqueueing a job."""
+        self._wake.set()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            threads, self._threads = self._threads, []
+            self._stopping.set()
+            self._wake.set()
+        for thread in threads:
+            thread.join(timeout)
+
+    def _loop(self, stopping: threading.Event) -> None:
+        while not stopping.is_set():
+            try:
+                did_work = self.run_once()
+            except Exception as exc:
+                with self._lock:
+                    self.errors += 1
+                    self.last_error = str(exc)
+                did_work = False
+            if did_work:
+                with self._lock:
+                    self.processed += 1
+                continue
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": self.running,
+                "processed": self.processed,
+                "errors": self.errors,
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,129 @@
+"""
+Minimal in-process metrics: latency histograms and a Prometheus text renderer.
+
+Kept dependency-free on purpose; the app only needs a handful of counters,
+gauges and histograms, and they are exposed at `/api/metrics` in the
+Prometheus text exposition format (version 0.0.4).
+"""
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+# Upper bounds in seconds, spanning a fast cached-model reply to a slow long generation.
+DEFAULT_LATENCY_BUCKETS: Tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of durations in seconds. Thread-safe."""
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # One slot per bucket plus the implicit +Inf bucket.
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._errors = 0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += seconds
+            if error:
+                self._errors += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        """Return cumulative bucket counts (Prometheus style), count, sum and errors."""
+        with self._lock:
+            counts = list(self._counts)
+            total, errors = self._sum, self._errors
+        cumulative: List[Tuple[float, int]] = []
+        running = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            running += count
+            cumulative.append((bound, running))
+        return {"buckets": cumulative, "count": running, "sum": total, "errors": errors}
+
+
+class LatencyRecorder:
+    """A `LatencyHistogram` per label value (e.g. per model name)."""
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, LatencyHistogram] = {}
+
+    def observe(self, label: str, seconds: float, error: bool = False) -> None:
+        histogram = self._histograms.get(label)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(label, LatencyHistogram(self.buckets))
+        histogram.observe(seconds, error)
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {label: histogram.snapshot() for label, histogram in sorted(histograms.items())}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+
+def _escape_label(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Mapping[str, object]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class PrometheusText:
+    """
+    Accumulates metric families and renders them in the Prometheus text format.
+
+    Samples are grouped by family, so each family is rendered once and contiguously
+    however its samples were interleaved with other families' when added.
+    """
+
+    def __init__(self) -> None:
+        self._families: Dict[str, List[str]] = {}
+
+    def _family(self, name: str, kind: str, help_text: str) -> List[str]:
+        lines = self._families.get(name)
+        if lines is None:
+            lines = self._families[name] = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        return lines
+
+    def sample(self, name: str, kind: str, help_text: str, value: float, **labels: object) -> None:
+        """Add one counter or gauge sample; repeated names share one HELP/TYPE header."""
+        self._family(name, kind, help_text).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def histogram(self, name: str, help_text: str, snapshot: Mapping[str, object], **labels: object) -> None:
+        """Add one labelled series from a `LatencyHistogram.snapshot()`."""
+        lines = self._family(name, "histogram", help_text)
+        for bound, count in snapshot["buckets"]:
+            series_labels = dict(labels, le=_format_value(bound))
+            lines.append(f"{name}_bucket{_format_labels(series_labels)} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(snapshot['sum'])}")
+        lines.append(f"{name}_count{_format_labels(labels)} {snapshot['count']}")
+
+    def render(self) -> str:
+        return "\n".join(line for lines in self._families.values() for line in lines) + "\n"
@@ -0,0 +1,542 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a call is rejected because its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Classic three-state circuit breaker.
+
+    - closed: calls flow; `failure_threshold` consecutive failures trip it open.
+    - open: calls are rejected until `recovery_seconds` have passed.
+    - half_open: up to `half_open_max_calls` probe calls are let through. A success
+      closes the breaker, a failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        recovery_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+    ) -> None:
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.recovery_seconds = recovery_seconds
+        self.half_open_max_calls = max(1, int(half_open_max_calls))
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._trips = 0
+        self._rejections = 0
+
+    def allow(self) -> bool:
+        """Return True if a call may proceed; callers must then record its outcome."""
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_seconds:
+                    self._rejections += 1
+                    return False
+                self._state = self.HALF_OPEN
+                self._half_open_in_flight = 0
+            if self._state == self.HALF_OPEN:
+                if self._half_open_in_flight >= self.half_open_max_calls:
+                    self._rejections += 1
+                    return False
+                self._half_open_in_flight += 1
+            return True
+
+    def release(self) -> None:
+        """Give back an admitted call that never ran or whose outcome is unknown (e.g. a client disconnect)."""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._half_open_in_flight > 0:
+                self._half_open_in_flight -= 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            self._half_open_in_flight = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._trips += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._half_open_in_flight = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def snapshot(self) -> Dict[str, object]:
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._consecutive_failures,
+                "trips": self._trips,
+                "rejections": self._rejections,
+            }
+
+
+class CircuitBreakerRegistry:
+    """Lazily created circuit breakers, one per name (e.g. per model)."""
+
+    def __init__(self, failure_threshold: int = 5, recovery_seconds: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is not None:
+            return breaker
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.recovery_seconds)
+                self._breakers[name] = breaker
+            return breaker
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.snapshot() for name, breaker in breakers.items()}
+
+
+class RateLimitExceeded(RuntimeError):
+    """Raised when a call could not get rate-limit capacity within the maximum wait."""
+
+
+class _Waiter:
+    __slots__ = ("user_id", "tokens", "enqueued_at")
+
+    def __init__(self, user_id: str, tokens: int) -> None:
+        self.user_id = user_id
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+
+
+class FairRateLimiter:
+    """
+    Token-bucket limiter for outbound calls with round-robin fairness across users.
+
+    Two buckets are enforced: requests per minute (`rpm`) and, optionally, tokens per
+    minute (`tpm`). Each bucket starts full and refills continuously, and `burst`
+    caps the request bucket (defaults to `rpm`). When capacity runs out, callers
+    queue per user. Capacity goes to the head of each user's queue in turn, so one
+    user with many queued calls cannot starve the rest. A caller that waits longer
+    than `max_wait_seconds` gets `RateLimitExceeded`.
+    """
+
+    def __init__(
+        self,
+        rpm: float,
+        tpm: float = 0,
+        max_wait_seconds: float = 10.0,
+        burst: float | None = None,
+    ) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait_seconds = max_wait_seconds
+        self._request_capacity = float(burst if burst is not None else rpm)
+        self._request_tokens = self._request_capacity
+        self._token_tokens = float(tpm)
+        self._refilled_at = time.monotonic()
+        self._cond = threading.Condition()
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._queued = 0
+        self._granted = 0
+        self._delayed = 0
+        self._rejected = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rpm > 0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        self._request_tokens = min(self._request_capacity, self._request_tokens + elapsed * self.rpm / 60.0)
+        if self.tpm > 0:
+            self._token_tokens = min(float(self.tpm), self._token_tokens + elapsed * self.tpm / 60.0)
+
+    def _seconds_until_available(self, tokens: int) -> float:
+        waits = [max(0.0, (1 - self._request_tokens) * 60.0 / self.rpm)]
+        if self.tpm > 0:
+            # A single call larger than the whole bucket is admitted once the bucket is full.
+            needed = min(float(tokens), float(self.tpm))
+            waits.append(max(0.0, (needed - self._token_tokens) * 60.0 / self.tpm))
+        return max(waits)
+
+    def _try_consume(self, tokens: int) -> bool:
+        if self._seconds_until_available(tokens) > 0:
+            return False
+        self._request_tokens -= 1
+        if self.tpm > 0:
+            self._token_tokens -= tokens
+        return True
+
+    def _is_next(self, waiter: _Waiter) -> bool:
+        queue = next(iter(self._queues.values()))
+        return queue[0] is waiter
+
+    def _dequeue(self, waiter: _Waiter, served: bool) -> None:
+        queue = self._queues[waiter.user_id]
+        queue.remove(waiter)
+        self._queued -= 1
+        if not queue:
+            del self._queues[waiter.user_id]
+        elif served:
+            # Round robin: the user just served goes to the back of the line.
+            self._queues.move_to_end(waiter.user_id)
+
+    def acquire(
+        self, user_id: str | None = None, tokens: int = 1, max_wait_seconds: float | None = None
+    ) -> float:
+        """
+        Block until capacity is available for one call of `tokens` tokens.
+
+        `max_wait_seconds` can only shorten the limiter's own maximum wait, e.g. to
+        respect a caller's deadline.
+
+        Returns:
+            The number of seconds spent waiting.
+
+        Raises:
+            RateLimitExceeded: if capacity is not granted within `max_wait_seconds`.
+        """
+        if not self.enabled:
+            return 0.0
+        user_id = user_id or "anonymous"
+        with self._cond:
+            self._refill(time.monotonic())
+            if not self._queues and self._try_consume(tokens):
+                self._granted += 1
+                return 0.0
+            waiter = _Waiter(user_id, tokens)
+            self._queues.setdefault(user_id, deque()).append(waiter)
+            self._queued += 1
+            max_wait = self.max_wait_seconds
+            if max_wait_seconds is not None:
+                max_wait = max(0.0, min(max_wait, max_wait_seconds))
+            deadline = waiter.enqueued_at + max_wait
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._is_next(waiter) and self._try_consume(tokens):
+                    self._dequeue(waiter, served=True)
+                    waited = now - waiter.enqueued_at
+                    self._granted += 1
+                    self._delayed += 1
+                    self._wait_seconds_total += waited
+                    self._wait_seconds_max = max(self._wait_seconds_max, waited)
+                    self._cond.notify_all()
+                    return waited
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._dequeue(waiter, served=False)
+                    self._rejected += 1
+                    self._cond.notify_all()
+                    raise RateLimitExceeded(
+                        f"Gemini rate limit: no capacity within {max_wait:g}s"
+                    )
+                timeout = remaining
+                if self._is_next(waiter):
+                    timeout = min(remaining, self._seconds_until_available(tokens))
+                self._cond.wait(timeout=max(timeout, 0.001))
+
+    def stats(self) -> Dict[str, float]:
+        """Return queue depth, grant/delay/rejection counts and wait-time totals."""
+        with self._cond:
+            return {
+                "queue_depth": self._queued,
+                "queued_users": len(self._queues),
+                "granted": self._granted,
+                "delayed": self._delayed,
+                "rejected": self._rejected,
+                "wait_seconds_total": self._wait_seconds_total,
+                "wait_seconds_max": self._wait_seconds_max,
+            }
+
+
+class DeadlineExceeded(RuntimeError):
+    """Raised when a call's overall deadline passes before it could complete."""
+
+
+def remaining_seconds(deadline: float | None) -> float | None:
+    """Seconds left until a `time.monotonic()` deadline, or None when there is no deadline."""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class RetryPolicy:
+    """
+    Bounded retries with exponential backoff, full jitter and an overall deadline.
+
+    Each attempt gets a timeout of `attempt_timeout_seconds`, shortened to the time
+    left before `deadline`. Only exceptions that `is_retryable` accepts are retried,
+    up to `max_attempts` in total. The sleep before retry *n* is drawn uniformly
+    from [0, min(max_delay, base_delay * 2**(n-1))]. A retry that could not start
+    before the deadline is not attempted.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay_seconds: float = 0.5,
+        max_delay_seconds: float = 8.0,
+        attempt_timeout_seconds: float | None = 30.0,
+    ) -> None:
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._attempts = 0
+        self._retries = 0
+        self._deadline_exceeded = 0
+        self._seconds_total = 0.0
+        self._backoff_seconds_total = 0.0
+
+    def backoff(self, attempt: int) -> float:
+        """Jittered delay to sleep after failed attempt number `attempt` (1-based)."""
+        ceiling = min(self.max_delay_seconds, self.base_delay_seconds * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    def attempt_timeout(self, deadline: float | None) -> float | None:
+        """Timeout for the next attempt; raises DeadlineExceeded if the deadline has passed."""
+        remaining = remaining_seconds(deadline)
+        if remaining is not None and remaining <= 0:
+            with self._lock:
+                self._deadline_exceeded += 1
+            raise DeadlineExceeded("Gemini generation failed: request deadline exceeded")
+        if remaining is None:
+            return self.attempt_timeout_seconds
+        if self.attempt_timeout_seconds is None:
+            return remaining
+        return min(self.attempt_timeout_seconds, remaining)
+
+    def _next_delay(self, attempt: int, exc: BaseException, is_retryable, deadline: float | None):
+        """Return the delay before the next attempt, or None if `exc` should propagate."""
+        if attempt >= self.max_attempts or not is_retryable(exc):
+            return None
+        delay = self.backoff(attempt)
+        remaining = remaining_seconds(deadline)
+        if remaining is not None and delay >= remaining:
+            return None
+        with self._lock:
+            self._retries += 1
+            self._backoff_seconds_total += delay
+        return delay
+
+    def _record(self, attempts: int, started: float) -> None:
+        with self._lock:
+            self._calls += 1
+            self._attempts += attempts
+            self._seconds_total += time.monotonic() - started
+
+    def run(
+        self,
+        fn: Callable[[float | None], T],
+        is_retryable: Callable[[BaseException], bool],
+        deadline: float | None = None,
+    ) -> T:
+        """Call `fn(timeout)` until it succeeds, fails permanently, or runs out of time."""
+        started = time.monotonic()
+        attempt = 0
+        try:
+            while True:
+                timeout = self.attempt_timeout(deadline)
+                attempt += 1
+                try:
+                    return fn(timeout)
+                except Exception as exc:
+                    delay = self._next_delay(attempt, exc, is_retryable, deadline)
+                    if delay is None:
+                        raise
+                time.sleep(delay)
+        finally:
+            self._record(attempt, started)
+
+    async def arun(
+        self,
+        fn: Callable[[float | None], Awaitable[T]],
+        is_retryable: Callable[[BaseException], bool],
+        deadline: float | None = None,
+    ) -> T:
+        """Async counterpart of `run`; backoff sleeps don't block the event loop."""
+        started = time.monotonic()
+        attempt = 0
+        try:
+            while True:
+                timeout = self.attempt_timeout(deadline)
+                attempt += 1
+                try:
+                    return await fn(timeout)
+                except Exception as exc:
+                    delay = self._next_delay(attempt, exc, is_retryable, deadline)
+                    if delay is None:
+                        raise
+                await asyncio.sleep(delay)
+        finally:
+            self._record(attempt, started)
+
+    def stats(self) -> Dict[str, float]:
+        """Return call/attempt/retry counts and time spent, including backoff sleeps."""
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "attempts": self._attempts,
+                "retries": self._retries,
+                "deadline_exceeded": self._deadline_exceeded,
+                "seconds_total": self._seconds_total,
+                "backoff_seconds_total": self._backoff_seconds_total,
+            }
+
+
+class _ModelHealth:
+    __slots__ = ("latency", "error_rate", "updated_at", "samples", "recent", "requests", "errors")
+
+    def __init__(self, window: int) -> None:
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        self.updated_at = 0.0
+        self.samples = 0
+        self.recent: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+
+class ModelRouter:
+    """
+    Route each request to the currently fastest healthy model.
+
+    Every finished call updates two exponentially weighted moving averages per
+    model: latency of successful calls and error rate (1 for a failure, 0 for a
+    success). A model is healthy while its error rate is below `max_error_rate`.
+    The error rate also halves every `error_half_life_seconds` without new data,
+    so a model that stopped being picked after an outage becomes eligible again
+    and gets re-probed.
+
+    `choose` prefers models with no samples yet (so every model is measured),
+    then the healthy model with the lowest latency, then the least failing one.
+    A failed call is a sample: it feeds the error rate but not the latency.
+    `hedge_delay` gives the p95 of a model's recent successful latencies: the
+    point after which a duplicate request to a second model is worth its cost.
+    """
+
+    def __init__(
+        self,
+        models: list[str],
+        alpha: float = 0.2,
+        max_error_rate: float = 0.5,
+        error_half_life_seconds: float = 30.0,
+        window: int = 200,
+    ) -> None:
+        if not models:
+            raise RuntimeError("ModelRouter needs at least one model")
+        self.models = list(dict.fromkeys(models))
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.error_half_life_seconds = error_half_life_seconds
+        self._lock = threading.Lock()
+        self._health = {model: _ModelHealth(window) for model in self.models}
+
+    def _error_rate(self, health: _ModelHealth, now: float) -> float:
+        if health.samples == 0 or self.error_half_life_seconds <= 0:
+            return health.error_rate
+        return health.error_rate * 0.5 ** ((now - health.updated_at) / self.error_half_life_seconds)
+
+    def choose(self, exclude: set[str] | frozenset[str] = frozenset()) -> str | None:
+        """Return the best model not in `exclude`, or None if every model is excluded."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [model for model in self.models if model not in exclude]
+            if not candidates:
+                return None
+            # Failures count as samples too, so a model that only ever fails is not re-probed forever.
+            unmeasured = [model for model in candidates if self._health[model].samples == 0]
+            if unmeasured:
+                # Spread first requests so one slow first call can't starve a model of samples.
+                return min(unmeasured, key=lambda model: self._health[model].requests)
+            healthy = [
+                model for model in candidates
+                if self._error_rate(self._health[model], now) < self.max_error_rate
+            ]
+            if healthy:
+                # Models without a success yet have no latency; rank them after measured ones.
+                return min(healthy, key=lambda model: (self._health[model].latency is None,
+                                                       self._health[model].latency or 0.0))
+            return min(candidates, key=lambda model: self._error_rate(self._health[model], now))
+
+    def started(self, model: str) -> None:
+        """Note that a request was sent to `model` (used to spread first requests)."""
+        with self._lock:
+            self._health[model].requests += 1
+
+    def record(self, model: str, seconds: float, ok: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            health = self._health.get(model)
+            if health is None:
+                return
+            error_rate = self._error_rate(health, now)
+            health.error_rate = error_rate + self.alpha * ((0.0 if ok else 1.0) - error_rate)
+            health.updated_at = now
+            health.samples += 1
+            if ok:
+                health.latency = seconds if health.latency is None else (
+                    health.latency + self.alpha * (seconds - health.latency)
+                )
+                health.recent.append(seconds)
+            else:
+                health.errors += 1
+
+    def hedge_delay(self, model: str, min_samples: int = 20) -> float | None:
+        """Return the p95 of recent successful latencies, or None with too few samples."""
+        with self._lock:
+            recent = sorted(self._health[model].recent)
+        if len(recent) < max(1, min_samples):
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+
+    def snapshot(self) -> Dict[str, Dict[str, float | None]]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: {
+                    "latency_ewma_seconds": health.latency,
+                    "error_rate_ewma": self._error_rate(health, now),
+                    "requests": health.requests,
+                    "errors": health.errors,
+                }
+                for model, health in self._health.items()
+            }
@@ -1,12 +1,29 @@
 from __future__ import annotations
-from services.interfaces import TextExtractor, TextGenerator
-from text_extractor import extract_text_from_file as _extract
-from gemini_service import generate_text_with_gemini as _gen
+from typing import Iterator, Tuple
+from text_extractor import extract_text_from_file as _extract, iter_pages as _iter_pages
+from gemini_service import generate_text_with_gemini as _gen, prewarm_models as _prewarm
+from gemini_service import stream_text_with_gemini as _stream
+from gemini_service import agenerate_text_with_gemini as _agen
 
 class DefaultTextExtractor:
     def __call__(self, file_path: str) -> str:
         return _extract(file_path)
 
+class DefaultPageExtractor:
+    def __call__(self, file_path: str) -> Iterator[Tuple[int, str]]:
+        return _iter_pages(file_path)
+
 class GeminiTextGenerator:
     def __call__(self, prompt: str, model_name: str | None = None) -> str:
         return _gen(prompt, model_name=model_name)
+
+    def prewarm(self, model_names: list[str] | None = None) -> None:
+        _prewarm(model_names)
+
+class GeminiStreamingTextGenerator:
+    def __call__(self, prompt: str, model_name: str | None = None) -> Iterator[str]:
+        return _stream(prompt, model_name=model_name)
+
+class AsyncGeminiTextGenerator:
+    async def __call__(self, prompt: str, model_name: str | None = None) -> str:
+        return await _agen(prompt, model_name=model_name)
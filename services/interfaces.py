@@ -1,9 +1,22 @@
 from __future__ import annotations
-from typing import Protocol
+from typing import Dict, Iterator, Protocol, Tuple
 
 class TextExtractor(Protocol):
     def __call__(self, file_path: str) -> str: ...
 
+class PageExtractor(Protocol):
+    def __call__(self, file_path: str) -> Iterator[Tuple[int, str]]: ...
+
 class TextGenerator(Protocol):
     def __call__(self, prompt: str, model_name: str | None = None) -> str: ...
 
+class StreamingTextGenerator(Protocol):
+    def __call__(self, prompt: str, model_name: str | None = None) -> Iterator[str]: ...
+
+class AsyncTextGenerator(Protocol):
+    async def __call__(self, prompt: str, model_name: str | None = None) -> str: ...
+
+class GenerationCache(Protocol):
+    def get(self, model_name: str, prompt_hash: str) -> str | None: ...
+    def put(self, model_name: str, prompt_hash: str, text: str) -> None: ...
+    def stats(self) -> Dict[str, int]: ...
@@ -0,0 +1,205 @@
+"""
+Near-duplicate cache: serve a stored reply for text that is almost, not exactly, the same.
+
+Texts are reduced to MinHash signatures over word shingles, so the fraction of
+matching signature slots estimates the Jaccard similarity of the two shingle
+sets. Signatures use one-permutation hashing (each shingle is hashed once and
+binned, rather than hashed once per slot) with rotation densification for empty
+bins, so building one is linear in the text length. An LSH index (signature
+bands hashed into buckets) finds candidate neighbours without comparing against
+every stored entry; a candidate is served only if its estimated similarity
+reaches `threshold`.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Set, Tuple
+
+_EMPTY = -1
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+Signature = Tuple[int, ...]
+
+
+def _choose_rows_per_band(num_perm: int, threshold: float) -> int:
+    """
+    Pick the band width whose LSH S-curve midpoint, (1/b)^(1/r), sits a little
+    below `threshold`. Candidates are verified afterwards, so this errs towards
+    recall: pairs at the threshold collide in at least one band almost always.
+    """
+    target = max(0.0, threshold - 0.1)
+    best = 1
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1.0 / bands) ** (1.0 / rows) <= target:
+            best = rows
+    return best
+
+
+class _Entry:
+    __slots__ = ("namespace", "signature", "value", "stored_at")
+
+    def __init__(self, namespace: str, signature: Signature, value: str, stored_at: float) -> None:
+        self.namespace = namespace
+        self.signature = signature
+        self.value = value
+        self.stored_at = stored_at
+
+
+class MinHashLSHCache:
+    """
+    Bounded LRU/TTL cache looked up by MinHash similarity instead of exact keys. Thread-safe.
+
+    Compute a text's signature once with `signature()` and pass it to both `get`
+    and `put`. `namespace` keeps unrelated kinds of replies apart (e.g. per route
+    and model).
+
+    Args:
+        threshold: minimum estimated Jaccard similarity in (0, 1] for a hit.
+        max_items: entries kept before the least recently used is evicted.
+        ttl_seconds: entry lifetime.
+        num_perm: signature length; more is more accurate and slower.
+        shingle_size: words per shingle.
+        seed: salts the shingle hash; caches only compare signatures built with the same seed.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        max_items: int = 1024,
+        ttl_seconds: float = 3600,
+        num_perm: int = 128,
+        shingle_size: int = 3,
+        seed: int = 1,
+    ) -> None:
+        if not 0.0 < threshold <= 1.0:
+            raise RuntimeError("Similarity threshold must be in (0, 1]")
+        self.threshold = threshold
+        self.max_items = max(1, int(max_items))
+        self.ttl_seconds = ttl_seconds
+        self.num_perm = num_perm
+        self.shingle_size = max(1, int(shingle_size))
+        self.rows_per_band = _choose_rows_per_band(num_perm, threshold)
+        self._salt = seed.to_bytes(8, "big", signed=True)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, Signature], Set[int]] = {}
+        self._next_id = 0
+        self._hits = 0
+        self._exact_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._similarity_sum = 0.0
+
+    def _shingles(self, text: str) -> Set[int]:
+        tokens = _TOKEN_RE.findall(text.lower())
+        k = self.shingle_size
+        grams = {" ".join(tokens[i:i + k]) for i in range(max(1, len(tokens) - k + 1))}
+        return {
+            int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8, salt=self._salt).digest(), "big")
+            for gram in grams
+        }
+
+    def signature(self, text: str) -> Signature:
+        """Return the MinHash signature of `text` (word shingles, case-insensitive)."""
+        bins = [_EMPTY] * self.num_perm
+        for shingle in self._shingles(text):
+            value, index = divmod(shingle, self.num_perm)
+            if bins[index] == _EMPTY or value < bins[index]:
+                bins[index] = value
+        if _EMPTY in bins:
+            # Short texts leave bins empty; borrow the next non-empty bin to the right,
+            # tagged with the distance so borrowed and genuine minima never collide.
+            filled = [i for i, value in enumerate(bins) if value != _EMPTY]
+            if not filled:
+                return tuple(bins)
+            for i in range(self.num_perm):
+                if bins[i] == _EMPTY:
+                    distance = next(((j - i) % self.num_perm for j in filled if j > i), None)
+                    if distance is None:
+                        distance = filled[0] + self.num_perm - i
+                    source = (i + distance) % self.num_perm
+                    bins[i] = (distance << 64) | bins[source]
+        return tuple(bins)
+
+    def _band_keys(self, namespace: str, signature: Signature) -> List[Tuple[str, int, Signature]]:
+        r = self.rows_per_band
+        return [(namespace, i, signature[i:i + r]) for i in range(0, self.num_perm, r)]
+
+    def similarity(self, left: Signature, right: Signature) -> float:
+        """Estimated Jaccard similarity of the texts behind two signatures."""
+        return sum(1 for x, y in zip(left, right) if x == y) / self.num_perm
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for key in self._band_keys(entry.namespace, entry.signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def get(self, namespace: str, signature: Signature) -> str | None:
+        now = time.monotonic()
+        with self._lock:
+            candidates: Set[int] = set()
+            for key in self._band_keys(namespace, signature):
+                candidates.update(self._buckets.get(key, ()))
+            best_id, best_similarity = None, 0.0
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if now - entry.stored_at > self.ttl_seconds:
+                    self._remove(entry_id)
+                    self._expirations += 1
+                    continue
+                score = self.similarity(signature, entry.signature)
+                if score > best_similarity:
+                    best_id, best_similarity = entry_id, score
+            if best_id is None or best_similarity < self.threshold:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self._hits += 1
+            self._exact_hits += best_similarity == 1.0
+            self._similarity_sum += best_similarity
+            return self._entries[best_id].value
+
+    def put(self, namespace: str, signature: Signature, value: str) -> None:
+        with self._lock:
+            while len(self._entries) >= self.max_items:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(namespace, signature, value, time.monotonic())
+            for key in self._band_keys(namespace, signature):
+                self._buckets.setdefault(key, set()).add(entry_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counts, how many hits were near (not exact) duplicates, and the threshold."""
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "hits": self._hits,
+                "near_duplicate_hits": self._hits - self._exact_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "items": len(self._entries),
+                "mean_hit_similarity": (self._similarity_sum / self._hits) if self._hits else 0.0,
+            }
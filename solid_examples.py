@@ -31,12 +31,16 @@ class GeminiTextGenerator:
             raise ValueError("Gemini API key is required. Set GEMINI_API_KEY environment variable or pass api_key parameter.")
         
         genai.configure(api_key=self.api_key)
+        # Reuse model instances (and their API clients) instead of building one per call
+        self.models = {}
     
     def __call__(self, prompt: str, model_name: str | None = None) -> str:
         model_name = model_name or "gemini-1.5-flash"
         
         try:
-            model = genai.GenerativeModel(model_name)
+            if model_name not in self.models:
+                self.models[model_name] = genai.GenerativeModel(model_name)
+            model = self.models[model_name]
             response = model.generate_content(prompt)
             return response.text
         except Exception as e:
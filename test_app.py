@@ -1,7 +1,10 @@
 import pytest
+import io
 import json
 import tempfile
 import os
+import threading
+import time
 from app import app, db, User, Document
 from werkzeug.security import generate_password_hash
 
@@ -47,6 +50,13 @@ class TestHealthEndpoint:
         assert data['status'] == 'success'
         assert 'Hello from EduBot!' in data['message']
 
+    def test_metrics_endpoint_serves_prometheus_text(self, client):
+        """Test that metrics are exposed in the Prometheus text format without auth."""
+        response = client.get('/api/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        assert b'# TYPE gemini_cache_hits_total counter' in response.data
+
 class TestAuthentication:
     """Test authentication endpoints."""
     
@@ -182,6 +192,434 @@ class TestFileUpload:
         finally:
             os.unlink(temp_file_path)
 
+    def test_upload_extracts_pages_incrementally(self, client, auth_headers, monkeypatch):
+        """Test that the upload joins streamed pages and reports the page count."""
+        monkeypatch.setattr('app._page_extractor', lambda path: iter([(1, 'Page one'), (3, 'Page three')]))
+        response = client.post('/api/upload', headers=auth_headers,
+                               data={'file': (io.BytesIO(b'%PDF-1.4'), 'notes.pdf')})
+        assert response.status_code == 201
+        data = json.loads(response.data)
+        assert data['extracted_pages'] == 2
+        assert data['extracted_text_truncated'] is False
+        document = db.session.get(Document, data['file']['id'])
+        assert document.extracted_text == 'Page one\nPage three'
+    
+    def test_upload_stops_extracting_past_the_text_limit(self, client, auth_headers, monkeypatch):
+        """Test that extraction stops pulling pages once the text limit is reached."""
+        pulled = []
+        def pages(path):
+            for number in range(1, 1001):
+                pulled.append(number)
+                yield number, 'x' * 100
+        monkeypatch.setattr('app._page_extractor', pages)
+        monkeypatch.setitem(app.config, 'MAX_EXTRACTED_TEXT_CHARS', 250)
+        response = client.post('/api/upload', headers=auth_headers,
+                               data={'file': (io.BytesIO(b'%PDF-1.4'), 'book.pdf')})
+        data = json.loads(response.data)
+        assert data['extracted_text_chars'] == 250
+        assert data['extracted_text_truncated'] is True
+        assert data['extracted_text_max_chars'] == 250
+        assert len(pulled) == 3
+
+    @pytest.mark.parametrize('max_chars, text, page_count', [
+        (7, 'aaaa\nbb', 2),      # cut inside page two
+        (5, 'aaaa', 1),          # only the separator would fit
+        (4, 'aaaa', 1),          # cut right after page one
+        (9, 'aaaa\nbbbb', 2),    # page two fills the limit exactly
+    ])
+    def test_page_count_matches_the_kept_text(self, max_chars, text, page_count):
+        """Test that a page cut by the text limit is counted only if some of its text is kept."""
+        from app import _collect_pages
+        pages = iter([(1, 'aaaa'), (2, 'bbbb'), (3, 'cccc')])
+        assert _collect_pages(pages, max_chars) == (text, page_count, True)
+    
+class TestUploadDeduplication:
+    """Test content-addressed storage of identical uploads."""
+    
+    def _upload(self, client, headers, content, name='syllabus.txt'):
+        return json.loads(client.post('/api/upload', headers=headers,
+                                      data={'file': (io.BytesIO(content), name)}).data)
+    
+    def _second_user_headers(self, client):
+        client.post('/api/auth/register', json={'email': 'other@example.com', 'password': 'password123'})
+        token = client.post('/api/auth/login',
+                            json={'email': 'other@example.com', 'password': 'password123'}).json['access_token']
+        return {'Authorization': f'Bearer {token}'}
+    
+    def test_identical_uploads_share_file_and_extraction(self, client, auth_headers, monkeypatch, tmp_path):
+        """Test that a repeated upload reuses the stored bytes and text without extracting again."""
+        from app import DefaultPageExtractor
+        extracted = []
+        real = DefaultPageExtractor()
+        def counting(path):
+            extracted.append(path)
+            return real(path)
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        monkeypatch.setattr('app._page_extractor', counting)
+        other_headers = self._second_user_headers(client)
+        
+        first = self._upload(client, auth_headers, b'Week 1: cells\nWeek 2: energy\n')
+        second = self._upload(client, other_headers, b'Week 1: cells\nWeek 2: energy\n')
+        
+        assert len(extracted) == 1
+        assert first['file']['relative_path'] == second['file']['relative_path']
+        assert second['extracted_text_chars'] == first['extracted_text_chars']
+        stored = [p for p in tmp_path.rglob('*') if p.is_file()]
+        assert len(stored) == 1
+    
+    def test_deduplication_is_only_reported_for_the_callers_own_uploads(self, client, auth_headers, monkeypatch,
+                                                                         tmp_path):
+        """Test that the response does not reveal whether another user uploaded the same bytes."""
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        other_headers = self._second_user_headers(client)
+        first = self._upload(client, auth_headers, b'Shared handout')
+        from_other_user = self._upload(client, other_headers, b'Shared handout')
+        repeated = self._upload(client, auth_headers, b'Shared handout')
+        
+        assert first['deduplicated'] is False
+        assert from_other_user['deduplicated'] is False
+        assert repeated['deduplicated'] is True
+        assert 'sha256' not in from_other_user['file']
+    
+    def test_reupload_after_delete_is_served_from_the_extraction_cache(self, client, auth_headers, monkeypatch,
+                                                                        tmp_path):
+        """Test that bytes extracted before are not extracted again once their blob is gone."""
+        from app import DefaultPageExtractor
+        from extraction_cache import ExtractionCache
+        extracted = []
+        real = DefaultPageExtractor()
+        def counting(path):
+            extracted.append(path)
+            return real(path)
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        monkeypatch.setattr('app._page_extractor', counting)
+        cache = ExtractionCache(str(tmp_path / 'extractions.db'))
+        monkeypatch.setattr('app._extraction_cache', cache)
+        
+        first = self._upload(client, auth_headers, b'Week 1: cells\nWeek 2: energy\n')
+        client.delete(f"/api/documents/{first['file']['id']}", headers=auth_headers)
+        second = self._upload(client, auth_headers, b'Week 1: cells\nWeek 2: energy\n')
+        
+        assert len(extracted) == 1
+        assert second['deduplicated'] is False
+        assert second['extracted_pages'] == first['extracted_pages']
+        assert second['extracted_text_chars'] == first['extracted_text_chars']
+        assert cache.stats()['hits'] == 1
+    
+    def test_new_extractor_version_misses_the_extraction_cache(self, client, auth_headers, monkeypatch, tmp_path):
+        """Test that cached extractions from an older extractor version are purged and not served."""
+        import app as app_module
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        monkeypatch.setitem(app.config, 'EXTRACTION_CACHE_PATH', str(tmp_path / 'extractions.db'))
+        monkeypatch.setattr('app._extraction_cache', app_module._open_extraction_cache())
+        first = self._upload(client, auth_headers, b'Week 1: cells\n')
+        client.delete(f"/api/documents/{first['file']['id']}", headers=auth_headers)
+        
+        monkeypatch.setattr('app.extractor_version', lambda extension: 'next')
+        cache = app_module._open_extraction_cache()
+        assert cache.stats()['items'] == 0
+        monkeypatch.setattr('app._extraction_cache', cache)
+        self._upload(client, auth_headers, b'Week 1: cells\n')
+        stats = cache.stats()
+        assert stats['hits'] == 0 and stats['items'] == 1
+    
+    def test_blob_is_removed_with_its_last_document(self, client, auth_headers, monkeypatch, tmp_path):
+        """Test that deletes only remove the shared file once no document references it."""
+        from app import Blob
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        first = self._upload(client, auth_headers, b'Shared notes')
+        second = self._upload(client, auth_headers, b'Shared notes')
+        path = first['file']['relative_path']
+        assert Blob.query.one().ref_count == 2
+        
+        assert client.delete(f"/api/documents/{first['file']['id']}", headers=auth_headers).status_code == 200
+        assert os.path.exists(path)
+        assert Blob.query.one().ref_count == 1
+        
+        assert client.delete(f"/api/documents/{second['file']['id']}", headers=auth_headers).status_code == 200
+        assert not os.path.exists(path)
+        assert Blob.query.count() == 0
+    
+    def test_failed_delete_keeps_the_blob_file(self, client, auth_headers, monkeypatch, tmp_path):
+        """Test that the last document's file is only removed once its delete commits."""
+        from app import Blob
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        uploaded = self._upload(client, auth_headers, b'Only copy')
+        path = uploaded['file']['relative_path']
+        real_commit = db.session.commit
+        def failing_commit():
+            raise RuntimeError('disk full')
+        monkeypatch.setattr(db.session, 'commit', failing_commit)
+        with pytest.raises(RuntimeError):
+            client.delete(f"/api/documents/{uploaded['file']['id']}", headers=auth_headers)
+        monkeypatch.setattr(db.session, 'commit', real_commit)
+        
+        assert os.path.exists(path)
+        assert Blob.query.one().ref_count == 1
+        assert [p.name for p in tmp_path.rglob('*') if p.is_file()] == [os.path.basename(path)]
+    
+    def test_same_bytes_with_another_extension_are_stored_separately(self, client, auth_headers, monkeypatch, tmp_path):
+        """Test that the extension is part of the blob key, since it decides extraction."""
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        monkeypatch.setattr('app._page_extractor', lambda path: iter([(1, 'text')]))
+        as_txt = self._upload(client, auth_headers, b'same bytes', 'a.txt')
+        as_pdf = self._upload(client, auth_headers, b'same bytes', 'a.pdf')
+        assert as_pdf['deduplicated'] is False
+        assert as_txt['file']['relative_path'] != as_pdf['file']['relative_path']
+    
+    def test_failed_extraction_leaves_no_file(self, client, auth_headers, monkeypatch, tmp_path):
+        """Test that the streamed temp file is removed when extraction fails."""
+        def failing(path):
+            raise ValueError('corrupt PDF')
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        monkeypatch.setattr('app._page_extractor', failing)
+        response = client.post('/api/upload', headers=auth_headers,
+                               data={'file': (io.BytesIO(b'%PDF-broken'), 'bad.pdf')})
+        assert response.status_code == 400
+        assert not [p for p in tmp_path.rglob('*') if p.is_file()]
+    
+    def test_missing_columns_are_added_to_existing_tables(self, client):
+        """Test that a database created before blob_id existed gains the column on startup."""
+        import sqlalchemy as sa
+        from app import _add_missing_columns
+        with db.engine.begin() as connection:
+            connection.execute(sa.text('DROP TABLE documents'))
+            connection.execute(sa.text(
+                'CREATE TABLE documents (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, '
+                'original_name VARCHAR(255) NOT NULL, stored_name VARCHAR(255) NOT NULL, '
+                'relative_path VARCHAR(1024) NOT NULL, mime_type VARCHAR(100), size_bytes INTEGER, '
+                'extracted_text TEXT, created_at DATETIME NOT NULL)'
+            ))
+        _add_missing_columns()
+        columns = {column['name'] for column in sa.inspect(db.engine).get_columns('documents')}
+        assert {'blob_id', 'status', 'status_detail'} <= columns
+
+class TestHelperProcesses:
+    """Test that spawned extraction workers skip the app's startup side effects."""
+    
+    def test_reimport_as_mp_main_skips_startup(self, tmp_path):
+        """Test the import a spawned pool worker makes of `python app.py`: no schema, no ingest threads."""
+        import subprocess
+        import sys
+        database = tmp_path / 'helper.db'
+        script = (
+            "import json, runpy\n"
+            "ns = runpy.run_path('app.py', run_name='__mp_main__')\n"
+            "print(json.dumps([ns['_IS_HELPER_PROCESS'], ns['_ingest_workers'].running]))\n"
+        )
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}', INGEST_MODE='async', INGEST_WORKERS='2')
+        result = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=env, capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+        assert json.loads(result.stdout.strip().splitlines()[-1]) == [True, False]
+        assert not database.exists() or database.stat().st_size == 0
+
+class TestAsyncIngest:
+    """Test uploads whose text is extracted by background jobs."""
+    
+    @pytest.fixture
+    def async_mode(self, monkeypatch, tmp_path):
+        # No worker threads in tests: jobs are run explicitly with _run_next_extraction_job.
+        monkeypatch.setitem(app.config, 'INGEST_MODE', 'async')
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    
+    def _upload(self, client, headers, content=b'Week 1: cells', name='syllabus.txt'):
+        return client.post('/api/upload', headers=headers, data={'file': (io.BytesIO(content), name)})
+    
+    def test_upload_returns_202_and_job_completes(self, client, auth_headers, async_mode):
+        """Test that an async upload is accepted before extraction and becomes ready once its job runs."""
+        from app import _run_next_extraction_job
+        response = self._upload(client, auth_headers)
+        assert response.status_code == 202
+        data = json.loads(response.data)
+        doc_id = data['file']['id']
+        assert data['status'] == 'pending' and data['job_id']
+        assert response.headers['Location'] == data['status_url'] == f'/api/documents/{doc_id}/status'
+        status = client.get(data['status_url'], headers=auth_headers).json
+        assert status['status'] == 'pending' and status['job']['status'] == 'queued'
+        
+        assert _run_next_extraction_job() is True
+        assert _run_next_extraction_job() is False
+        
+        db.session.expire_all()
+        status = client.get(data['status_url'], headers=auth_headers).json
+        assert status['status'] == 'ready'
+        assert status['job'] == {'id': data['job_id'], 'status': 'done', 'attempts': 1}
+        assert status['extracted_text_chars'] == len('Week 1: cells')
+        assert status['extracted_text_truncated'] is False
+        assert status['extracted_text_max_chars'] == app.config['MAX_EXTRACTED_TEXT_CHARS']
+        assert db.session.get(Document, doc_id).extracted_text == 'Week 1: cells'
+    
+    def test_identical_bytes_are_ready_immediately(self, client, auth_headers, async_mode):
+        """Test that a duplicate of an extracted upload skips the queue."""
+        from app import _run_next_extraction_job
+        self._upload(client, auth_headers)
+        _run_next_extraction_job()
+        response = self._upload(client, auth_headers)
+        assert response.status_code == 201
+        assert response.json['deduplicated'] is True
+    
+    def test_another_users_copy_still_queues(self, client, auth_headers, async_mode):
+        """Test that an upload matching another user's document is answered like a new one."""
+        from app import _run_next_extraction_job
+        self._upload(client, auth_headers)
+        _run_next_extraction_job()
+        client.post('/api/auth/register', json={'email': 'other@example.com', 'password': 'password123'})
+        token = client.post('/api/auth/login',
+                            json={'email': 'other@example.com', 'password': 'password123'}).json['access_token']
+        response = self._upload(client, {'Authorization': f'Bearer {token}'})
+        assert response.status_code == 202
+        assert _run_next_extraction_job() is True
+        db.session.expire_all()
+        assert db.session.get(Document, response.json['file']['id']).extracted_text == 'Week 1: cells'
+    
+    def test_job_reads_the_extraction_cache(self, client, auth_headers, async_mode, monkeypatch, tmp_path):
+        """Test that a queued extraction of previously extracted bytes is a cache lookup."""
+        from app import DefaultPageExtractor, _run_next_extraction_job
+        from extraction_cache import ExtractionCache
+        extracted = []
+        real = DefaultPageExtractor()
+        def counting(path):
+            extracted.append(path)
+            return real(path)
+        monkeypatch.setattr('app._page_extractor', counting)
+        cache = ExtractionCache(str(tmp_path / 'extractions.db'))
+        monkeypatch.setattr('app._extraction_cache', cache)
+        first = self._upload(client, auth_headers).json
+        _run_next_extraction_job()
+        client.delete(f"/api/documents/{first['file']['id']}", headers=auth_headers)
+        
+        second = self._upload(client, auth_headers)
+        assert second.status_code == 202
+        _run_next_extraction_job()
+        
+        db.session.expire_all()
+        assert len(extracted) == 1
+        assert db.session.get(Document, second.json['file']['id']).extracted_text == 'Week 1: cells'
+        assert cache.stats()['hits'] == 1
+    
+    def test_failing_job_is_retried_then_marked_failed(self, client, auth_headers, async_mode, monkeypatch):
+        """Test that extraction errors are retried with backoff and surface as a failed status."""
+        from app import ExtractionJob, _run_next_extraction_job
+        def failing(path):
+            raise ValueError('corrupt PDF')
+        monkeypatch.setattr('app._page_extractor', failing)
+        monkeypatch.setitem(app.config, 'INGEST_MAX_ATTEMPTS', 2)
+        doc_id = self._upload(client, auth_headers).json['file']['id']
+        
+        assert _run_next_extraction_job() is True
+        db.session.expire_all()
+        job = ExtractionJob.query.one()
+        assert job.status == 'queued' and job.attempts == 1
+        assert _run_next_extraction_job() is False  # backing off
+        job.available_at = job.created_at
+        db.session.commit()
+        assert _run_next_extraction_job() is True
+        
+        db.session.expire_all()
+        status = client.get(f'/api/documents/{doc_id}/status', headers=auth_headers).json
+        assert status['status'] == 'failed'
+        assert status['detail'] == 'corrupt PDF'
+        assert status['job']['status'] == 'failed' and status['job']['attempts'] == 2
+    
+    def test_job_abandoned_by_a_dead_worker_is_reclaimed(self, client, auth_headers, async_mode):
+        """Test that a running job whose lease expired (e.g. after a restart) is picked up again."""
+        from datetime import datetime, timedelta
+        from app import ExtractionJob, _run_next_extraction_job
+        doc_id = self._upload(client, auth_headers).json['file']['id']
+        job = ExtractionJob.query.one()
+        job.status, job.attempts, job.locked_at = 'running', 1, datetime.utcnow()
+        db.session.commit()
+        assert _run_next_extraction_job() is False  # still leased
+        
+        job.locked_at = datetime.utcnow() - timedelta(seconds=app.config['INGEST_LEASE_SECONDS'] + 1)
+        db.session.commit()
+        assert _run_next_extraction_job() is True
+        db.session.expire_all()
+        assert db.session.get(Document, doc_id).status == 'ready'
+        assert ExtractionJob.query.one().attempts == 2
+    
+    def test_status_stream_reports_until_ready(self, client, auth_headers, async_mode, monkeypatch):
+        """Test that the SSE subscription sends the pending state, then the ready state once the job runs."""
+        from app import _run_next_extraction_job
+        monkeypatch.setitem(app.config, 'INGEST_POLL_SECONDS', 0.05)
+        doc_id = self._upload(client, auth_headers).json['file']['id']
+        worker = threading.Timer(0.2, _run_next_extraction_job)
+        worker.start()
+        try:
+            response = client.get(f'/api/documents/{doc_id}/status/stream', headers=auth_headers)
+            body = response.get_data(as_text=True)
+        finally:
+            worker.join()
+        assert response.mimetype == 'text/event-stream'
+        events = [block for block in body.split('\n\n') if block]
+        assert json.loads(events[0].split('data: ', 1)[1])['status'] == 'pending'
+        assert events[-1].startswith('event: done\n')
+        assert json.loads(events[-1].split('data: ', 1)[1])['status'] == 'ready'
+    
+    def test_deleting_a_pending_document_drops_its_job(self, client, auth_headers, async_mode):
+        """Test that deleting a queued document removes the job and its file."""
+        from app import ExtractionJob, _run_next_extraction_job
+        data = self._upload(client, auth_headers).json
+        assert client.delete(f"/api/documents/{data['file']['id']}", headers=auth_headers).status_code == 200
+        assert ExtractionJob.query.count() == 0
+        assert not os.path.exists(data['file']['relative_path'])
+        assert _run_next_extraction_job() is False
+    
+    def test_status_requires_ownership(self, client, auth_headers, async_mode):
+        """Test that another user cannot read a document's status."""
+        doc_id = self._upload(client, auth_headers).json['file']['id']
+        client.post('/api/auth/register', json={'email': 'other@example.com', 'password': 'password123'})
+        token = client.post('/api/auth/login',
+                            json={'email': 'other@example.com', 'password': 'password123'}).json['access_token']
+        response = client.get(f'/api/documents/{doc_id}/status', headers={'Authorization': f'Bearer {token}'})
+        assert response.status_code == 403
+
+class TestReextractCommand:
+    """Test the `flask reextract-documents` maintenance command."""
+    
+    def test_reextract_refreshes_text_through_the_cache(self, client, auth_headers, monkeypatch, tmp_path):
+        """Test that re-extraction rewrites document text and blob metadata, reusing cached extractions."""
+        from extraction_cache import ExtractionCache
+        from app import Blob
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        upload = client.post('/api/upload', headers=auth_headers,
+                             data={'file': (io.BytesIO(b'Original notes'), 'notes.txt')})
+        doc_id = json.loads(upload.data)['file']['id']
+        document = db.session.get(Document, doc_id)
+        document.extracted_text = 'stale'
+        blob = db.session.get(Blob, document.blob_id)
+        blob.page_count, blob.text_truncated = None, True
+        db.session.commit()
+        cache = ExtractionCache(str(tmp_path / 'extractions.db'))
+        monkeypatch.setattr('app._extraction_cache', cache)
+        
+        runner = app.test_cli_runner()
+        assert 'updated 1' in runner.invoke(args=['reextract-documents']).output
+        runner.invoke(args=['reextract-documents'])
+        
+        db.session.expire_all()
+        document = db.session.get(Document, doc_id)
+        assert document.extracted_text == 'Original notes'
+        blob = db.session.get(Blob, document.blob_id)
+        assert blob.page_count == 1 and blob.text_truncated is False
+        assert cache.stats()['hits'] == 1
+    
+    def test_reextract_leaves_queued_documents_to_their_job(self, client, auth_headers, monkeypatch, tmp_path):
+        """Test that documents awaiting async extraction are not marked ready by the command."""
+        monkeypatch.setitem(app.config, 'INGEST_MODE', 'async')
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        upload = client.post('/api/upload', headers=auth_headers,
+                             data={'file': (io.BytesIO(b'Queued notes'), 'notes.txt')})
+        doc_id = upload.json['file']['id']
+        
+        output = app.test_cli_runner().invoke(args=['reextract-documents']).output
+        
+        db.session.expire_all()
+        assert 'updated 0' in output and 'queued 1' in output
+        document = db.session.get(Document, doc_id)
+        assert document.status == 'pending' and document.extracted_text is None
+
 class TestAIEndpoints:
     """Test AI generation endpoints."""
     
@@ -203,6 +641,307 @@ class TestAIEndpoints:
         # Accept 400 (API key missing) or 500 (generation failed) - both indicate endpoint works
         assert response.status_code in [400, 500], f"Expected 400 or 500, got {response.status_code}: {response.data.decode()}"
 
+def _sse_events(response):
+    """Parse a text/event-stream body into (event, data) pairs."""
+    events = []
+    for block in response.get_data(as_text=True).strip().split('\n\n'):
+        event, data = 'message', None
+        for line in block.split('\n'):
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: '):
+                data = json.loads(line[len('data: '):])
+        events.append((event, data))
+    return events
+
+class TestBatchGeneration:
+    """Test the batch generation endpoint."""
+    
+    def test_batch_dedupes_and_keeps_input_order(self, client, auth_headers, monkeypatch):
+        """Test that duplicates are generated once and results follow input order."""
+        calls = []
+        def fake_generator(prompt, model_name=None):
+            calls.append(prompt)
+            if prompt == 'bad':
+                raise RuntimeError('boom')
+            return prompt.upper()
+        monkeypatch.setattr('app._text_generator', fake_generator)
+        response = client.post('/api/ai/generate/batch',
+                             headers=auth_headers,
+                             json={'prompts': ['one', 'two', 'one', 'bad']})
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['unique_prompts'] == 3
+        assert data['results'] == [
+            {'output': 'ONE'},
+            {'output': 'TWO'},
+            {'output': 'ONE'},
+            {'error': 'generation failed', 'details': 'boom'},
+        ]
+        assert sorted(calls) == ['bad', 'one', 'two']
+    
+    def test_batch_respects_request_concurrency(self, client, auth_headers, monkeypatch):
+        """Test that no more than the per-request limit runs at once."""
+        lock = threading.Lock()
+        state = {'active': 0, 'peak': 0}
+        def slow_generator(prompt, model_name=None):
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            time.sleep(0.02)
+            with lock:
+                state['active'] -= 1
+            return prompt
+        monkeypatch.setattr('app._text_generator', slow_generator)
+        response = client.post('/api/ai/generate/batch',
+                             headers=auth_headers,
+                             json={'prompts': [f'p{i}' for i in range(12)], 'concurrency': 2})
+        assert response.status_code == 200
+        assert 1 <= state['peak'] <= 2
+    
+    def test_batch_items_fail_when_no_slot_frees_before_the_deadline(self, client, auth_headers, monkeypatch):
+        """Test that a saturated batch pool fails items at the deadline instead of holding the request."""
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()  # another request holds the only slot
+        monkeypatch.setattr('app._batch_slots', slots)
+        monkeypatch.setitem(app.config, 'AI_REQUEST_DEADLINE_SECONDS', 0.1)
+        monkeypatch.setattr('app._text_generator', lambda prompt, model_name=None: prompt)
+        started = time.monotonic()
+        response = client.post('/api/ai/generate/batch', headers=auth_headers, json={'prompts': ['one', 'two']})
+        assert time.monotonic() - started < 2
+        results = json.loads(response.data)['results']
+        assert all(result['error'] == 'generation failed' for result in results)
+        assert 'deadline exceeded' in results[0]['details']
+        slots.release()
+    
+    def test_batch_validation(self, client, auth_headers):
+        """Test batch payload validation."""
+        response = client.post('/api/ai/generate/batch', headers=auth_headers, json={'prompts': []})
+        assert response.status_code == 400
+        response = client.post('/api/ai/generate/batch', headers=auth_headers, json={'prompts': ['ok', '']})
+        assert response.status_code == 400
+        response = client.post('/api/ai/generate/batch', headers=auth_headers,
+                             json={'prompts': ['p'] * (app.config['AI_BATCH_MAX_PROMPTS'] + 1)})
+        assert response.status_code == 400
+
+class TestStreamingEndpoints:
+    """Test server-sent event AI endpoints."""
+    
+    def test_generate_stream_emits_deltas_then_done(self, client, auth_headers, monkeypatch):
+        """Test that each delta is streamed and the done event carries the full output."""
+        monkeypatch.setattr('app._streaming_text_generator',
+                            lambda prompt, model_name=None: iter(['Hel', 'lo']))
+        response = client.post('/api/ai/generate/stream',
+                             headers=auth_headers,
+                             json={'prompt': 'Say hello'})
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        assert _sse_events(response) == [
+            ('message', {'delta': 'Hel'}),
+            ('message', {'delta': 'lo'}),
+            ('done', {'output': 'Hello'}),
+        ]
+    
+    def test_flashcards_stream_done_event_has_cards(self, client, auth_headers, monkeypatch):
+        """Test that the flashcards stream parses the full output into cards."""
+        chunks = ['[{"question": "Q1", ', '"answer": "A1"}]']
+        monkeypatch.setattr('app._streaming_text_generator',
+                            lambda prompt, model_name=None: iter(chunks))
+        response = client.post('/api/ai/flashcards/stream',
+                             headers=auth_headers,
+                             json={'text': 'Some notes'})
+        event, data = _sse_events(response)[-1]
+        assert event == 'done'
+        assert data['cards'] == [{'question': 'Q1', 'answer': 'A1'}]
+        assert data['meta']['strategy'] == 'as_is'
+    
+    def test_stream_failure_emits_error_event(self, client, auth_headers, monkeypatch):
+        """Test that generation errors are reported as an SSE error event."""
+        def failing(prompt, model_name=None):
+            raise RuntimeError('GEMINI_API_KEY is not set')
+            yield  # pragma: no cover
+        monkeypatch.setattr('app._streaming_text_generator', failing)
+        response = client.post('/api/ai/summarize/stream',
+                             headers=auth_headers,
+                             json={'text': 'Some notes'})
+        event, data = _sse_events(response)[-1]
+        assert event == 'error'
+        assert data['error'] == 'summarization failed'
+    
+    def test_stream_requires_text(self, client, auth_headers):
+        """Test validation happens before the stream starts."""
+        response = client.post('/api/ai/summarize/stream', headers=auth_headers, json={})
+        assert response.status_code == 400
+
+class TestSummarySimilarityCache:
+    """Test the near-duplicate summary tier."""
+    
+    def test_resubmitted_text_reuses_summary(self, client, auth_headers, monkeypatch):
+        """Test that a lightly edited resubmission is served without a new generation."""
+        from similarity_cache import MinHashLSHCache
+        calls = []
+        def fake_generator(prompt, model_name=None):
+            calls.append(prompt)
+            return '• summary'
+        monkeypatch.setattr('app._text_generator', fake_generator)
+        monkeypatch.setattr('app._summary_similarity_cache', MinHashLSHCache(0.8))
+        text = ' '.join(f'sentence {i} about cell biology and energy.' for i in range(60))
+        first = client.post('/api/ai/summarize', headers=auth_headers, json={'text': text})
+        second = client.post('/api/ai/summarize', headers=auth_headers,
+                             json={'text': text.replace('sentence 7', 'sentense 7')})
+        assert json.loads(first.data)['summary'] == json.loads(second.data)['summary'] == '• summary'
+        assert len(calls) == 1
+        metrics = client.get('/api/metrics').data
+        assert b'summary_similarity_near_duplicate_hits_total 1' in metrics
+
+class TestFakeGenerator:
+    """Test the offline generator selectable with AI_TEXT_GENERATOR."""
+    
+    def test_fake_backend_runs_under_the_gemini_stack(self, client, auth_headers, monkeypatch):
+        """Test that the fake replaces only the remote call, so caching and metrics still apply."""
+        import gemini_service
+        from app import _build_text_generators
+        from fake_generator import FakeGenerator
+        engine = FakeGenerator(0, 0)
+        monkeypatch.setattr(FakeGenerator, 'from_env', classmethod(lambda cls: engine))
+        monkeypatch.setattr(gemini_service, '_fake_backend', None)
+        monkeypatch.setattr(gemini_service, '_generation_cache', gemini_service.LRUTTLCache(16, 60))
+        monkeypatch.setattr(gemini_service, '_call_latency', gemini_service.LatencyRecorder())
+        monkeypatch.setattr(gemini_service, '_router', None)
+        generator, _, _ = _build_text_generators('fake')
+        monkeypatch.setattr('app._text_generator', generator)
+        for _ in range(2):
+            response = client.post('/api/ai/flashcards',
+                                 headers=auth_headers,
+                                 json={'text': 'Mitochondria produce ATP for the cell.'})
+            assert response.status_code == 200
+            assert len(json.loads(response.data)['cards']) >= 5
+        assert engine.calls == 1  # the repeat was a generation cache hit
+        assert sum(stats['count'] for stats in gemini_service.get_latency_stats().values()) == 1
+    
+    def test_unknown_backend_is_rejected(self):
+        """Test that a typo in AI_TEXT_GENERATOR fails at startup."""
+        from app import _build_text_generators
+        with pytest.raises(RuntimeError):
+            _build_text_generators('gpt')
+
+class TestAsyncAIEndpoints:
+    """Test async variants of the AI endpoints."""
+    
+    def test_async_summarize_awaits_generator(self, client, auth_headers, monkeypatch):
+        """Test that the async summarize route returns the awaited summary."""
+        async def fake_generator(prompt, model_name=None):
+            return '• point'
+        monkeypatch.setattr('app._async_text_generator', fake_generator)
+        response = client.post('/api/ai/async/summarize',
+                             headers=auth_headers,
+                             json={'text': 'Some notes'})
+        assert response.status_code == 200
+        assert json.loads(response.data)['summary'] == '• point'
+    
+    def test_async_generate_reports_failures(self, client, auth_headers, monkeypatch):
+        """Test that async generation errors map to 400 like the sync route."""
+        async def failing(prompt, model_name=None):
+            raise RuntimeError('GEMINI_API_KEY is not set')
+        monkeypatch.setattr('app._async_text_generator', failing)
+        response = client.post('/api/ai/async/generate',
+                             headers=auth_headers,
+                             json={'prompt': 'Hello'})
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'] == 'generation failed'
+
+class TestInputShaping:
+    """Test token estimation and input shaping on the summarize and flashcards routes."""
+    
+    LONG_TEXT = '\n\n'.join(
+        f'Paragraph {i}. Cells turn glucose into ATP. Mitochondria host the reactions.' for i in range(200)
+    )
+    
+    def test_small_text_is_sent_as_is(self, client, auth_headers, monkeypatch):
+        """Test that short inputs report their estimate and reach the model unchanged."""
+        prompts = []
+        def fake_generator(prompt, model_name=None):
+            prompts.append(prompt)
+            return '• point'
+        monkeypatch.setattr('app._text_generator', fake_generator)
+        response = client.post('/api/ai/summarize', headers=auth_headers, json={'text': 'Some notes'})
+        meta = json.loads(response.data)['meta']
+        assert meta['strategy'] == 'as_is'
+        assert meta['estimated_tokens'] == meta['sent_tokens'] > 0
+        assert len(prompts) == 1 and 'Some notes' in prompts[0]
+    
+    def test_large_text_is_summarized_in_parts_then_merged(self, client, auth_headers, monkeypatch):
+        """Test that a text over the budget is split, summarized per part, then merged once."""
+        prompts = []
+        def fake_generator(prompt, model_name=None):
+            prompts.append(prompt)
+            return '• merged' if 'consecutive parts' in prompt else '• part'
+        monkeypatch.setattr('app._text_generator', fake_generator)
+        monkeypatch.setitem(app.config, 'AI_INPUT_TOKEN_BUDGET', 1500)
+        response = client.post('/api/ai/summarize', headers=auth_headers, json={'text': self.LONG_TEXT})
+        data = json.loads(response.data)
+        assert data['summary'] == '• merged'
+        assert data['meta']['strategy'] == 'split'
+        assert len(prompts) == data['meta']['chunks'] + 1
+        assert 'Paragraph' not in prompts[-1]
+    
+    def test_text_beyond_all_chunks_is_truncated(self, client, auth_headers, monkeypatch):
+        """Test that the middle of an oversized text is cut and the ends are kept."""
+        prompts = []
+        def fake_generator(prompt, model_name=None):
+            prompts.append(prompt)
+            return '[{"question": "Q", "answer": "A"}]'
+        monkeypatch.setattr('app._text_generator', fake_generator)
+        monkeypatch.setitem(app.config, 'AI_INPUT_TOKEN_BUDGET', 500)
+        monkeypatch.setitem(app.config, 'AI_INPUT_MAX_CHUNKS', 1)
+        response = client.post('/api/ai/flashcards', headers=auth_headers, json={'text': self.LONG_TEXT})
+        data = json.loads(response.data)
+        assert data['meta']['strategy'] == 'truncate'
+        assert data['meta']['sent_tokens'] <= 500 < data['meta']['estimated_tokens']
+        assert 'Paragraph 0.' in prompts[0] and 'Paragraph 199.' in prompts[0]
+        assert 'Paragraph 100.' not in prompts[0]
+        assert data['cards'] == [{'question': 'Q', 'answer': 'A'}]
+    
+    def test_model_context_caps_the_budget(self, monkeypatch):
+        """Test that a small context window wins over the configured input budget."""
+        from app import _input_token_budget
+        monkeypatch.setitem(app.config, 'AI_INPUT_TOKEN_BUDGET', 30000)
+        monkeypatch.setitem(app.config, 'AI_MODEL_CONTEXT_TOKENS', {'models/small': 8192})
+        monkeypatch.setitem(app.config, 'AI_CONTEXT_RESERVE_TOKENS', 4096)
+        assert _input_token_budget('models/small') == 4096
+        assert _input_token_budget('models/unlisted') == 30000
+    
+    def test_shaping_is_off_by_default(self, client, auth_headers, monkeypatch):
+        """Test that without AI_INPUT_TOKEN_BUDGET long texts within the context window reach the model whole."""
+        prompts = []
+        def fake_generator(prompt, model_name=None):
+            prompts.append(prompt)
+            return '• point'
+        monkeypatch.setattr('app._text_generator', fake_generator)
+        response = client.post('/api/ai/summarize', headers=auth_headers, json={'text': self.LONG_TEXT * 20})
+        assert json.loads(response.data)['meta']['strategy'] == 'as_is'
+        assert len(prompts) == 1 and 'Paragraph 100.' in prompts[0]
+    
+    def test_default_budget_still_fits_the_context_window(self, client, auth_headers, monkeypatch):
+        """Test that with shaping off, texts larger than the model's context window are still cut to fit."""
+        from app import _input_token_budget, model_candidates
+        prompts = []
+        def fake_generator(prompt, model_name=None):
+            prompts.append(prompt)
+            return '• merged' if 'consecutive parts' in prompt else '• part'
+        monkeypatch.setattr('app._text_generator', fake_generator)
+        monkeypatch.setitem(app.config, 'AI_MODEL_CONTEXT_TOKENS', {name: 1500 for name in model_candidates()})
+        monkeypatch.setitem(app.config, 'AI_CONTEXT_RESERVE_TOKENS', 500)
+        assert app.config['AI_INPUT_TOKEN_BUDGET'] == 0
+        assert _input_token_budget() == 1000
+        assert _input_token_budget('models/unlisted') == 0
+        
+        response = client.post('/api/ai/summarize', headers=auth_headers, json={'text': self.LONG_TEXT * 20})
+        meta = json.loads(response.data)['meta']
+        assert meta['strategy'] == 'truncate_split'
+        assert meta['chunks'] <= app.config['AI_INPUT_MAX_CHUNKS']
+        assert meta['sent_tokens'] <= 1000 * meta['chunks'] < meta['estimated_tokens']
+
 class TestDatabaseModels:
     """Test database models."""
     
@@ -0,0 +1,62 @@
+"""
+Unit tests for record/replay cassettes of Gemini responses
+"""
+import asyncio
+import json
+import time
+
+import pytest
+
+from cassette import Cassette, CassetteMiss
+
+
+class TestCassette:
+    """Recording to and replaying from a JSON Lines file"""
+
+    def test_records_hash_response_and_latency(self, tmp_path):
+        path = tmp_path / 'calls.jsonl'
+        Cassette(str(path), 'record').record('m', 'abc', 'réponse', 0.25)
+
+        (entry,) = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+        assert entry['model'] == 'm'
+        assert entry['prompt_hash'] == 'abc'
+        assert entry['response'] == 'réponse'
+        assert entry['latency_seconds'] == 0.25
+
+    def test_replay_sleeps_for_the_recorded_latency(self, tmp_path):
+        path = str(tmp_path / 'calls.jsonl')
+        Cassette(path, 'record').record('m', 'abc', 'text', 0.05)
+        cassette = Cassette(path, 'replay')
+
+        started = time.perf_counter()
+        assert cassette.replay('m', 'abc') == 'text'
+        assert time.perf_counter() - started >= 0.05
+        assert asyncio.run(cassette.areplay('m', 'abc')) == 'text'
+        assert cassette.stats()['replayed'] == 2
+
+    def test_speed_scales_replay_latency(self, tmp_path):
+        path = str(tmp_path / 'calls.jsonl')
+        Cassette(path, 'record').record('m', 'abc', 'text', 5.0)
+
+        started = time.perf_counter()
+        Cassette(path, 'replay', speed=0).replay('m', 'abc')
+        assert time.perf_counter() - started < 1.0
+
+    def test_latest_recording_wins(self, tmp_path):
+        path = str(tmp_path / 'calls.jsonl')
+        recorder = Cassette(path, 'record')
+        recorder.record('m', 'abc', 'old', 0)
+        recorder.record('m', 'abc', 'new', 0)
+        assert Cassette(path, 'replay', speed=0).replay('m', 'abc') == 'new'
+
+    def test_missing_entry_raises(self, tmp_path):
+        path = tmp_path / 'calls.jsonl'
+        path.write_text('')
+        cassette = Cassette(str(path), 'replay')
+        with pytest.raises(CassetteMiss):
+            cassette.replay('m', 'abc')
+        assert cassette.stats()['misses'] == 1
+
+    def test_replay_requires_an_existing_file(self, tmp_path):
+        with pytest.raises(RuntimeError):
+            Cassette(str(tmp_path / 'missing.jsonl'), 'replay')
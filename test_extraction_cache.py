@@ -0,0 +1,127 @@
+"""
+Unit tests for the on-disk extraction cache
+"""
+import sqlite3
+
+import pytest
+
+import text_extractor
+from extraction_cache import ExtractionCache, file_sha256
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ExtractionCache(str(tmp_path / "extractions.db"))
+
+
+class TestExtractionCache:
+    """Storage, versions and the size cap"""
+
+    def test_round_trip_is_stored_compressed(self, cache):
+        text = "Mitochondria produce ATP. " * 2000
+        cache.put("abc", ".pdf", "v1", text)
+        assert cache.get("abc", ".pdf", "v1") == text
+        stats = cache.stats()
+        assert stats["items"] == 1
+        assert stats["bytes"] < stats["raw_bytes"] / 10
+
+    def test_other_versions_miss_and_can_be_purged(self, cache):
+        cache.put("abc", ".pdf", "v1", "old extraction")
+        cache.put("def", ".txt", "t1", "plain text")
+        assert cache.get("abc", ".pdf", "v2") is None
+        assert cache.purge_other_versions(".pdf", "v2") == 1
+        assert cache.get("def", ".txt", "t1") == "plain text"
+        assert cache.stats()["items"] == 1
+
+    def test_least_recently_used_entries_are_evicted_over_the_cap(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(ExtractionCache, "_TOUCH_INTERVAL_SECONDS", 0.0)
+        cache = ExtractionCache(str(tmp_path / "extractions.db"), max_bytes=3000, compress_level=0)
+        for index in range(3):
+            cache.put(f"doc{index}", ".txt", "v", f"{index}" * 900)
+        assert cache.get("doc0", ".txt", "v") is not None  # now the most recently used
+        cache.put("doc3", ".txt", "v", "3" * 900)
+
+        assert cache.get("doc1", ".txt", "v") is None
+        assert cache.get("doc0", ".txt", "v") is not None
+        assert cache.get("doc3", ".txt", "v") is not None
+        assert cache.stats()["bytes"] <= 3000
+        assert cache.stats()["evictions"] >= 1
+
+    def test_entries_larger_than_the_cap_are_skipped(self, tmp_path):
+        cache = ExtractionCache(str(tmp_path / "extractions.db"), max_bytes=10, compress_level=0)
+        cache.put("big", ".txt", "v", "x" * 100)
+        assert cache.stats()["items"] == 0
+
+    def test_cache_is_shared_through_the_file(self, tmp_path):
+        path = str(tmp_path / "extractions.db")
+        ExtractionCache(path).put("abc", ".txt", "v", "shared")
+        assert ExtractionCache(path).get("abc", ".txt", "v") == "shared"
+
+
+    def test_page_count_is_stored_with_the_text(self, cache):
+        cache.put("abc", ".pdf", "v1", "one\ntwo", pages=2)
+        cache.put("def", ".txt", "t1", "plain text")
+        assert cache.get_entry("abc", ".pdf", "v1") == ("one\ntwo", 2)
+        assert cache.get_entry("def", ".txt", "t1") == ("plain text", None)
+
+    def test_database_errors_are_misses(self, tmp_path):
+        path = str(tmp_path / "extractions.db")
+        cache = ExtractionCache(path)
+        cache.put("abc", ".txt", "v", "kept")
+        with sqlite3.connect(path) as other:
+            other.execute("DROP TABLE extractions")
+        assert cache.get("abc", ".txt", "v") is None
+        cache.put("def", ".txt", "v", "lost")
+        stats = cache.stats()
+        assert stats["errors"] == 2
+        assert stats["misses"] == 1 and stats["items"] == 0
+
+class TestFileSha256:
+    """Content keys"""
+
+    def test_file_hash_matches_content(self, tmp_path):
+        path = tmp_path / "a.txt"
+        path.write_bytes(b"abc")
+        assert file_sha256(str(path)) == "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+
+
+class TestExtractorVersion:
+    """Fingerprints that invalidate cached extractions"""
+
+    def test_pdf_version_follows_pypdf2(self, monkeypatch):
+        before_pdf = text_extractor.extractor_version(".pdf")
+        before_txt = text_extractor.extractor_version(".txt")
+        monkeypatch.setattr(text_extractor, "_pdf_library_version", lambda: "99.0.0")
+        text_extractor.extractor_version.cache_clear()
+        try:
+            assert text_extractor.extractor_version(".pdf") != before_pdf
+            assert text_extractor.extractor_version(".txt") == before_txt
+        finally:
+            text_extractor.extractor_version.cache_clear()
+
+    def test_manual_version_bump_changes_every_extension(self, monkeypatch):
+        before = {ext: text_extractor.extractor_version(ext) for ext in (".pdf", ".txt")}
+        monkeypatch.setattr(text_extractor, "EXTRACTION_VERSION", text_extractor.EXTRACTION_VERSION + 1)
+        text_extractor.extractor_version.cache_clear()
+        try:
+            assert all(text_extractor.extractor_version(ext) != version for ext, version in before.items())
+        finally:
+            text_extractor.extractor_version.cache_clear()
+
+    @pytest.mark.parametrize("extension, function", [
+        (".txt", "_iter_txt_pages"), (".txt", "iter_pages"), (".pdf", "iter_pages"),
+    ])
+    def test_page_iterators_are_part_of_the_version(self, monkeypatch, extension, function):
+        before = text_extractor.extractor_version(extension)
+        real_getsource = text_extractor.inspect.getsource
+        changed = getattr(text_extractor, function)
+        monkeypatch.setattr(
+            text_extractor.inspect,
+            "getsource",
+            lambda obj: real_getsource(obj) + ("# changed" if obj is changed else ""),
+        )
+        text_extractor.extractor_version.cache_clear()
+        try:
+            assert text_extractor.extractor_version(extension) != before
+        finally:
+            text_extractor.extractor_version.cache_clear()
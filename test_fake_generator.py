@@ -0,0 +1,99 @@
+"""
+Unit tests for the offline fake generator used for load testing
+"""
+import asyncio
+import json
+import statistics
+
+import pytest
+
+from fake_generator import FakeGenerator
+
+
+class TestFakeGeneratorOutput:
+    """Deterministic, realistically shaped replies"""
+
+    def test_same_prompt_gives_same_output(self):
+        first = FakeGenerator(0, 0).generate('Explain osmosis', model_name='m')
+        second = FakeGenerator(0, 0).generate('Explain osmosis', model_name='m')
+        assert first == second
+        assert first != FakeGenerator(0, 0).generate('Explain osmosis', model_name='other')
+
+    def test_flashcard_prompts_get_valid_json(self):
+        prompt = 'Generate flashcards in JSON format.\n\nText:\nMitochondria produce ATP.\n\nJSON:'
+        cards = json.loads(FakeGenerator(0, 0).generate(prompt))
+        assert 5 <= len(cards) <= 6
+        assert all(set(card) == {'question', 'answer'} for card in cards)
+
+    def test_summary_prompts_get_bullets(self):
+        prompt = 'Please summarize.\n\nText to summarize:\nMitochondria produce ATP.\n\nSummary:'
+        lines = FakeGenerator(0, 0).generate(prompt).splitlines()
+        assert len(lines) >= 3
+        assert all(line.startswith('• ') for line in lines)
+
+    def test_output_length_follows_configuration(self):
+        text = FakeGenerator(0, 0, output_words=300).generate('Write an essay about cells')
+        assert len(text.split()) >= 300
+
+    def test_stream_joins_to_the_full_reply(self):
+        generator = FakeGenerator(0, 0)
+        chunks = list(generator.stream('Explain osmosis', chunks=4))
+        assert len(chunks) == 4
+        assert ''.join(chunks) == generator.render('Explain osmosis')
+
+    def test_rejects_empty_prompt(self):
+        with pytest.raises(RuntimeError):
+            FakeGenerator(0, 0).generate('  ')
+
+
+class TestFakeGeneratorLatencyAndErrors:
+    """Sampled latency distribution and injected errors"""
+
+    def test_latency_percentiles_match_configuration(self):
+        generator = FakeGenerator(p50_seconds=0.4, p99_seconds=2.5, seed=7)
+        samples = sorted(generator.sample_latency() for _ in range(20000))
+
+        assert statistics.median(samples) == pytest.approx(0.4, rel=0.05)
+        assert samples[int(len(samples) * 0.99)] == pytest.approx(2.5, rel=0.15)
+
+    def test_error_rate_is_honoured(self):
+        generator = FakeGenerator(0, 0, error_rate=0.25, seed=3)
+        failures = 0
+        for i in range(2000):
+            try:
+                generator.generate(f'prompt {i}')
+            except RuntimeError:
+                failures += 1
+        assert failures / 2000 == pytest.approx(0.25, abs=0.03)
+        assert generator.errors == failures
+
+    def test_async_path_fails_the_same_way(self):
+        generator = FakeGenerator(0, 0, error_rate=1.0)
+        with pytest.raises(RuntimeError, match='injected error'):
+            asyncio.run(generator.agenerate('hello'))
+
+    def test_slow_calls_time_out_as_retryable_errors(self):
+        generator = FakeGenerator(0.05, 0.05)
+        with pytest.raises(RuntimeError, match='timed out') as excinfo:
+            generator.generate('hello', timeout=0.01)
+        assert isinstance(excinfo.value.__cause__, TimeoutError)
+        assert generator.generate('hello', timeout=1) == generator.render('hello')
+
+    def test_injected_errors_are_retried_by_gemini_service(self, monkeypatch):
+        import gemini_service
+        generator = FakeGenerator(0, 0, error_rate=1.0)
+        monkeypatch.setattr(gemini_service, '_fake_backend', generator)
+        monkeypatch.setattr(gemini_service, '_generation_cache', gemini_service.LRUTTLCache(16, 60))
+        monkeypatch.setattr(gemini_service, '_failure_cache', gemini_service.LRUTTLCache(16, 60))
+        monkeypatch.setattr(gemini_service, '_breakers', gemini_service.CircuitBreakerRegistry(5, 60))
+        monkeypatch.setattr(gemini_service, '_retry_policy', gemini_service.RetryPolicy(3, 0, 0))
+        monkeypatch.setattr(gemini_service, '_router', None)
+        monkeypatch.setattr(gemini_service, '_cassette', None)
+        with pytest.raises(RuntimeError, match='injected error'):
+            gemini_service.generate_text_with_gemini('hello', model_name='m')
+        assert generator.calls == 3
+
+    @pytest.mark.parametrize('p50,p99,error_rate', [(-1, 1, 0), (2, 1, 0), (0.1, 1, 1.5)])
+    def test_rejects_bad_configuration(self, p50, p99, error_rate):
+        with pytest.raises(RuntimeError):
+            FakeGenerator(p50, p99, error_rate=error_rate)
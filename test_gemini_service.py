@@ -0,0 +1,708 @@
+"""
+Unit tests for gemini_service with the remote Gemini call replaced by a local fake
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import gemini_service
+from token_budget import estimate_tokens
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    """Skip SDK configuration and record every prompt that would reach Gemini."""
+    calls = []
+
+    def fake_call(model_name, prompt, timeout=None):
+        calls.append((model_name, prompt))
+        return f'output for {prompt}'
+
+    monkeypatch.setattr(gemini_service, '_configure_once', lambda: None)
+    monkeypatch.setattr(gemini_service, '_call_gemini', fake_call)
+    monkeypatch.setattr(gemini_service, '_generation_cache', gemini_service.LRUTTLCache(16, 60))
+    monkeypatch.setattr(gemini_service, '_inflight', gemini_service._SingleFlight())
+    monkeypatch.setattr(gemini_service, '_raw_key_index', gemini_service.LRUTTLCache(16, 60))
+    monkeypatch.setattr(
+        gemini_service, '_canonical_stats', {'lookups': 0, 'hits': 0, 'canonical_only_hits': 0}
+    )
+    monkeypatch.setattr(gemini_service, '_breakers', gemini_service.CircuitBreakerRegistry(2, 60))
+    monkeypatch.setattr(gemini_service, '_failure_cache', gemini_service.LRUTTLCache(16, 60))
+    monkeypatch.setattr(gemini_service, '_retry_policy', gemini_service.RetryPolicy(1))
+    monkeypatch.setattr(gemini_service, '_call_latency', gemini_service.LatencyRecorder())
+    monkeypatch.setattr(gemini_service, '_cassette', None)
+    monkeypatch.setattr(gemini_service, '_refresher', gemini_service._BackgroundRefresher(2))
+    monkeypatch.setattr(gemini_service, '_router', None)
+    return calls
+
+
+class TestGenerateTextWithGemini:
+    """Caching behaviour of generate_text_with_gemini"""
+
+    def test_rejects_empty_prompt(self, fake_gemini):
+        with pytest.raises(RuntimeError):
+            gemini_service.generate_text_with_gemini('   ')
+
+    def test_second_call_is_served_from_cache(self, fake_gemini):
+        first = gemini_service.generate_text_with_gemini('hello', model_name='m')
+        second = gemini_service.generate_text_with_gemini('hello', model_name='m')
+
+        assert first == second == 'output for hello'
+        assert len(fake_gemini) == 1
+        assert gemini_service.get_cache_stats()['hits'] == 1
+
+
+class TestMetrics:
+    """Latency histograms and the Prometheus rendering"""
+
+    def test_remote_calls_are_timed_per_model(self, fake_gemini, monkeypatch):
+        def flaky_call(model_name, prompt, timeout=None):
+            if prompt == 'bad':
+                raise RuntimeError('Gemini generation failed: boom')
+            return 'ok'
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', flaky_call)
+        gemini_service.generate_text_with_gemini('good', model_name='m')
+        gemini_service.generate_text_with_gemini('good', model_name='m')  # cache hit, not timed
+        with pytest.raises(RuntimeError):
+            gemini_service.generate_text_with_gemini('bad', model_name='m')
+
+        latency = gemini_service.get_latency_stats()
+        assert list(latency) == ['m']
+        assert latency['m']['count'] == 2
+        assert latency['m']['errors'] == 1
+
+    def test_render_includes_cache_and_latency_series(self, fake_gemini):
+        gemini_service.generate_text_with_gemini('hello', model_name='m')
+        gemini_service.generate_text_with_gemini('hello', model_name='m')
+
+        text = gemini_service.render_prometheus_metrics()
+        assert 'gemini_cache_hits_total{tier="l1"} 1' in text
+        assert 'gemini_cache_items{tier="l1"} 1' in text
+        assert 'gemini_cache_bytes{tier="l1"} %d' % len('output for hello') in text
+        assert 'gemini_request_duration_seconds_count{model="m"} 1' in text
+        assert 'gemini_request_duration_seconds_bucket{model="m",le="+Inf"} 1' in text
+
+    def test_each_family_is_rendered_contiguously(self, fake_gemini, monkeypatch, tmp_path):
+        tiered = gemini_service.TieredCache(
+            gemini_service.LRUTTLCache(16, 60), gemini_service.SQLiteCache(str(tmp_path / 'cache.db'), 60)
+        )
+        monkeypatch.setattr(gemini_service, '_generation_cache', tiered)
+        for model_name in ('a', 'b'):
+            gemini_service.generate_text_with_gemini('hello', model_name=model_name)
+            gemini_service.generate_text_with_gemini('hello', model_name=model_name)
+
+        seen, current = [], None
+        for line in gemini_service.render_prometheus_metrics().splitlines():
+            if line.startswith('# TYPE '):
+                current = line.split()[2]
+                assert current not in seen, f'{current} is split'
+                seen.append(current)
+            elif not line.startswith('#'):
+                assert line.startswith(current), f'{line!r} outside its family {current}'
+        assert 'gemini_cache_hits_total' in seen and 'gemini_request_errors_total' in seen
+
+
+class TestStaleWhileRevalidate:
+    """Serving expired entries while one background refresh runs"""
+
+    def _wait_for_refreshes(self):
+        deadline = time.monotonic() + 5
+        while gemini_service.get_refresh_stats()['pending'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_stale_value_is_served_and_refreshed_once(self, fake_gemini, monkeypatch):
+        cache = gemini_service.LRUTTLCache(16, ttl_seconds=0.05, stale_seconds=60)
+        monkeypatch.setattr(gemini_service, '_generation_cache', cache)
+        release = threading.Event()
+        versions = iter(['v1', 'v2'])
+
+        def slow_call(model_name, prompt, timeout=None):
+            text = next(versions)
+            if text == 'v2':
+                release.wait(5)
+            return text
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', slow_call)
+        assert gemini_service.generate_text_with_gemini('handout', model_name='m') == 'v1'
+        time.sleep(0.1)
+
+        # Expired: callers get v1 immediately while a single refresh is blocked in flight.
+        results = [gemini_service.generate_text_with_gemini('handout', model_name='m') for _ in range(5)]
+        assert results == ['v1'] * 5
+        stats = gemini_service.get_refresh_stats()
+        assert stats['started'] == 1
+        assert stats['deduplicated'] == 4
+
+        release.set()
+        self._wait_for_refreshes()
+        assert gemini_service.generate_text_with_gemini('handout', model_name='m') == 'v2'
+        assert cache.stats()['stale_hits'] == 5
+
+    def test_past_max_stale_the_caller_blocks(self, fake_gemini, monkeypatch):
+        cache = gemini_service.LRUTTLCache(16, ttl_seconds=0.02, stale_seconds=0.02)
+        monkeypatch.setattr(gemini_service, '_generation_cache', cache)
+        gemini_service.generate_text_with_gemini('handout', model_name='m')
+        time.sleep(0.1)
+
+        gemini_service.generate_text_with_gemini('handout', model_name='m')
+        assert len(fake_gemini) == 2
+        assert gemini_service.get_refresh_stats()['started'] == 0
+
+    def test_failed_refresh_keeps_serving_stale(self, fake_gemini, monkeypatch):
+        cache = gemini_service.LRUTTLCache(16, ttl_seconds=0.05, stale_seconds=60)
+        monkeypatch.setattr(gemini_service, '_generation_cache', cache)
+        gemini_service.generate_text_with_gemini('handout', model_name='m')
+        time.sleep(0.1)
+
+        def failing_call(model_name, prompt, timeout=None):
+            raise RuntimeError('Gemini generation failed: unavailable')
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', failing_call)
+        assert gemini_service.generate_text_with_gemini('handout', model_name='m') == 'output for handout'
+        self._wait_for_refreshes()
+        # The failure is negatively cached, so further stale hits do not retry yet.
+        assert gemini_service.generate_text_with_gemini('handout', model_name='m') == 'output for handout'
+        stats = gemini_service.get_refresh_stats()
+        assert stats['failed'] == 1
+        assert stats['started'] == 1
+
+
+class TestModelRouting:
+    """Latency-aware routing and hedged requests"""
+
+    @pytest.fixture
+    def router(self, fake_gemini, monkeypatch):
+        router = gemini_service.ModelRouter(['fast', 'slow'])
+        for _ in range(20):
+            router.record('fast', 0.01, ok=True)
+            router.record('slow', 0.2, ok=True)
+        monkeypatch.setattr(gemini_service, '_router', router)
+        monkeypatch.setattr(gemini_service, '_hedge_stats', {'hedged': 0, 'hedge_wins': 0, 'hedges_skipped': 0})
+        return router
+
+    def test_unnamed_requests_go_to_the_fastest_model(self, fake_gemini, router):
+        assert gemini_service.generate_text_with_gemini('hello') == 'output for hello'
+        assert fake_gemini == [('fast', 'hello')]
+        # Cached under the logical model, whichever model answered.
+        assert gemini_service._generation_cache.get('auto', gemini_service._prompt_key('hello'))
+
+    def test_explicit_model_bypasses_the_router(self, fake_gemini, router):
+        gemini_service.generate_text_with_gemini('hello', model_name='slow')
+        assert fake_gemini == [('slow', 'hello')]
+
+    def test_failures_steer_traffic_away(self, fake_gemini, router, monkeypatch):
+        def fast_is_down(model_name, prompt, timeout=None):
+            if model_name == 'fast':
+                raise RuntimeError('Gemini generation failed: unavailable')
+            return f'{model_name}: {prompt}'
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', fast_is_down)
+        for prompt in ('a', 'b', 'c', 'd', 'e'):
+            try:
+                gemini_service.generate_text_with_gemini(prompt)
+            except RuntimeError:
+                pass
+        assert gemini_service.generate_text_with_gemini('f') == 'slow: f'
+
+    def test_admission_rejections_are_not_negatively_cached(self, fake_gemini, router, monkeypatch):
+        limiter = gemini_service.FairRateLimiter(rpm=60, burst=1, max_wait_seconds=0.01)
+        monkeypatch.setattr(gemini_service, '_rate_limiter', limiter)
+        gemini_service.generate_text_with_gemini('first')
+        with pytest.raises(gemini_service.RateLimitExceeded):
+            gemini_service.generate_text_with_gemini('second')
+        assert gemini_service._failure_cache.get('auto', gemini_service._prompt_key('second')) is None
+
+        monkeypatch.setattr(gemini_service, '_rate_limiter', gemini_service.FairRateLimiter(rpm=0))
+        assert gemini_service.generate_text_with_gemini('second') == 'output for second'
+
+    def test_slow_primary_is_hedged_to_the_next_model(self, fake_gemini, router, monkeypatch):
+        monkeypatch.setattr(gemini_service, '_ROUTER_HEDGE', True)
+        release = threading.Event()
+
+        def stalled_fast(model_name, prompt, timeout=None):
+            if model_name == 'fast':
+                release.wait(5)
+            return f'{model_name}: {prompt}'
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', stalled_fast)
+        started = time.monotonic()
+        try:
+            assert gemini_service.generate_text_with_gemini('hello') == 'slow: hello'
+            assert time.monotonic() - started < 2
+        finally:
+            release.set()
+        stats = gemini_service.get_router_stats()
+        assert stats['hedged'] == 1
+        assert stats['hedge_wins'] == 1
+
+    def test_hedge_limit_does_not_serialize_primaries(self, fake_gemini, router, monkeypatch):
+        monkeypatch.setattr(gemini_service, '_ROUTER_HEDGE', True)
+        monkeypatch.setattr(gemini_service, '_HEDGE_WORKERS', 2)
+        monkeypatch.setattr(gemini_service, '_hedge_slots', None)
+
+        def slow_call(model_name, prompt, timeout=None):
+            time.sleep(0.3)
+            return f'{model_name}: {prompt}'
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', slow_call)
+        prompts = [f'prompt {i}' for i in range(8)]
+        started = time.monotonic()
+        threads = [threading.Thread(target=gemini_service.generate_text_with_gemini, args=(p,)) for p in prompts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Serialized behind two slots, eight 0.3 s calls would take at least 1.2 s.
+        assert time.monotonic() - started < 0.9
+        stats = gemini_service.get_router_stats()
+        assert stats['hedged'] <= 2
+        assert stats['hedged'] + stats['hedges_skipped'] == 8
+
+    def test_losing_attempt_stops_retrying(self, fake_gemini, router, monkeypatch):
+        monkeypatch.setattr(gemini_service, '_ROUTER_HEDGE', True)
+        monkeypatch.setattr(gemini_service, '_retry_policy', gemini_service.RetryPolicy(5, 0, 0))
+        calls = []
+
+        def flaky_fast(model_name, prompt, timeout=None):
+            calls.append(model_name)
+            if model_name == 'fast':
+                time.sleep(0.1)
+                raise TimeoutError('slow upstream')
+            return f'{model_name}: {prompt}'
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', flaky_fast)
+        assert gemini_service.generate_text_with_gemini('hello') == 'slow: hello'
+        time.sleep(0.3)
+        assert calls.count('fast') == 1
+        assert gemini_service._breakers.get('fast').state == gemini_service.CircuitBreaker.CLOSED
+
+    def test_fast_primary_is_not_hedged(self, fake_gemini, router, monkeypatch):
+        monkeypatch.setattr(gemini_service, '_ROUTER_HEDGE', True)
+        for _ in range(20):
+            # Widen the p95 so thread scheduling jitter can't trigger a hedge.
+            router.record('fast', 1.0, ok=True)
+        router.record('fast', 0.01, ok=True)
+        gemini_service.generate_text_with_gemini('hello')
+        assert gemini_service.get_router_stats()['hedged'] == 0
+
+    def test_async_calls_are_routed(self, fake_gemini, router, monkeypatch):
+        routed = []
+
+        async def fake_acall(model_name, prompt, timeout=None):
+            routed.append(model_name)
+            return f'{model_name}: {prompt}'
+
+        monkeypatch.setattr(gemini_service, '_acall_gemini', fake_acall)
+        assert asyncio.run(gemini_service.agenerate_text_with_gemini('hello')) == 'fast: hello'
+        assert routed == ['fast']
+
+    def test_streams_are_routed(self, fake_gemini, router, monkeypatch):
+        streamed = []
+
+        def fake_stream(model_name, prompt, timeout=None):
+            streamed.append(model_name)
+            yield 'chunk'
+
+        monkeypatch.setattr(gemini_service, '_stream_gemini', fake_stream)
+        assert list(gemini_service.stream_text_with_gemini('hello')) == ['chunk']
+        assert streamed == ['fast']
+
+
+class TestCassette:
+    """Record/replay of remote responses"""
+
+    def test_replay_serves_recorded_responses_offline(self, fake_gemini, monkeypatch, tmp_path):
+        path = str(tmp_path / 'calls.jsonl')
+        monkeypatch.setattr(gemini_service, '_cassette', gemini_service.Cassette(path, 'record'))
+        recorded = gemini_service.generate_text_with_gemini('hello', model_name='m')
+
+        def offline(model_name, prompt, timeout=None):
+            raise AssertionError('replay must not call Gemini')
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', offline)
+        monkeypatch.setattr(gemini_service, '_generation_cache', gemini_service.LRUTTLCache(16, 60))
+        monkeypatch.setattr(gemini_service, '_cassette', gemini_service.Cassette(path, 'replay', speed=0))
+
+        assert gemini_service.generate_text_with_gemini('hello', model_name='m') == recorded
+        assert list(gemini_service.stream_text_with_gemini('hello', model_name='m')) == [recorded]
+        assert gemini_service.get_cassette_stats()['replayed'] == 1
+
+    def test_replay_miss_is_an_error(self, fake_gemini, monkeypatch, tmp_path):
+        path = tmp_path / 'empty.jsonl'
+        path.write_text('')
+        monkeypatch.setattr(gemini_service, '_cassette', gemini_service.Cassette(str(path), 'replay'))
+
+        with pytest.raises(RuntimeError, match='no cassette entry'):
+            gemini_service.generate_text_with_gemini('never recorded', model_name='m')
+        assert fake_gemini == []
+
+    def test_unknown_mode_is_rejected(self):
+        with pytest.raises(RuntimeError):
+            gemini_service._build_cassette('rewind')
+
+
+class TestFailureHandling:
+    """Negative caching and the per-model circuit breaker"""
+
+    def test_failures_are_cached_per_prompt(self, fake_gemini, monkeypatch):
+        calls = []
+
+        def failing_call(model_name, prompt, timeout=None):
+            calls.append(prompt)
+            raise RuntimeError('Gemini generation failed: 429 quota exceeded')
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', failing_call)
+        for _ in range(3):
+            with pytest.raises(RuntimeError, match='quota exceeded'):
+                gemini_service.generate_text_with_gemini('hello', model_name='m')
+
+        assert calls == ['hello']
+
+    def test_breaker_opens_for_the_failing_model_only(self, fake_gemini, monkeypatch):
+        def failing_call(model_name, prompt, timeout=None):
+            if model_name == 'broken':
+                raise RuntimeError('Gemini generation failed: unavailable')
+            return 'ok'
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', failing_call)
+        for prompt in ('a', 'b'):
+            with pytest.raises(RuntimeError):
+                gemini_service.generate_text_with_gemini(prompt, model_name='broken')
+
+        with pytest.raises(gemini_service.CircuitOpenError):
+            gemini_service.generate_text_with_gemini('c', model_name='broken')
+        assert gemini_service.generate_text_with_gemini('c', model_name='healthy') == 'ok'
+
+        states = gemini_service.get_breaker_states()
+        assert states['broken']['state'] == 'open'
+        assert states['broken']['trips'] == 1
+        assert states['healthy']['state'] == 'closed'
+
+
+class TestRateLimiting:
+    """Outbound limiter sits behind the cache and is attributed per user"""
+
+    def test_limiter_sees_the_context_user_and_skips_cache_hits(self, fake_gemini, monkeypatch):
+        seen = []
+
+        class RecordingLimiter:
+            enabled = True
+
+            def acquire(self, user_id=None, tokens=1, max_wait_seconds=None):
+                seen.append((user_id, tokens))
+                return 0.0
+
+        monkeypatch.setattr(gemini_service, '_rate_limiter', RecordingLimiter())
+        with gemini_service.generation_context(user_id=42):
+            gemini_service.generate_text_with_gemini('x' * 40, model_name='m')
+            gemini_service.generate_text_with_gemini('x' * 40, model_name='m')
+
+        # Charged with the same estimate that input shaping uses
+        assert seen == [('42', estimate_tokens('x' * 40))]
+
+    def test_rate_limit_rejection_is_not_a_breaker_failure(self, fake_gemini, monkeypatch):
+        limiter = gemini_service.FairRateLimiter(rpm=60, burst=1, max_wait_seconds=0.01)
+        monkeypatch.setattr(gemini_service, '_rate_limiter', limiter)
+        gemini_service.generate_text_with_gemini('first', model_name='m')
+        for prompt in ('second', 'third'):
+            with pytest.raises(gemini_service.RateLimitExceeded):
+                gemini_service.generate_text_with_gemini(prompt, model_name='m')
+
+        assert gemini_service.get_breaker_states()['m']['state'] == 'closed'
+
+
+class TestRetriesAndDeadlines:
+    """Retry policy and deadlines around the remote call"""
+
+    def test_transient_errors_are_retried(self, fake_gemini, monkeypatch):
+        monkeypatch.setattr(gemini_service, '_retry_policy', gemini_service.RetryPolicy(3, 0, 0))
+        attempts = []
+
+        def flaky(model_name, prompt, timeout=None):
+            attempts.append(timeout)
+            if len(attempts) == 1:
+                raise RuntimeError('Gemini generation failed') from TimeoutError('read timed out')
+            return 'recovered'
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', flaky)
+        assert gemini_service.generate_text_with_gemini('hi', model_name='m') == 'recovered'
+        assert len(attempts) == 2
+        assert gemini_service.get_retry_stats()['retries'] == 1
+
+    def test_permanent_errors_are_not_retried(self, fake_gemini, monkeypatch):
+        monkeypatch.setattr(gemini_service, '_retry_policy', gemini_service.RetryPolicy(3, 0, 0))
+        attempts = []
+
+        def invalid(model_name, prompt, timeout=None):
+            attempts.append(prompt)
+            raise RuntimeError('Gemini generation failed: 400 API key not valid')
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', invalid)
+        with pytest.raises(RuntimeError):
+            gemini_service.generate_text_with_gemini('hi', model_name='m')
+        assert attempts == ['hi']
+
+    def test_expired_deadline_fails_without_calling_gemini(self, fake_gemini):
+        with gemini_service.generation_context(user_id=1, deadline=time.monotonic() - 1):
+            with pytest.raises(gemini_service.DeadlineExceeded):
+                gemini_service.generate_text_with_gemini('hi', model_name='m')
+        assert fake_gemini == []
+
+    def test_attempt_timeout_follows_deadline(self, fake_gemini, monkeypatch):
+        timeouts = []
+
+        def record(model_name, prompt, timeout=None):
+            timeouts.append(timeout)
+            return 'ok'
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', record)
+        with gemini_service.generation_context(deadline=time.monotonic() + 5):
+            gemini_service.generate_text_with_gemini('hi', model_name='m')
+        assert 0 < timeouts[0] <= 5
+
+
+class TestPromptCanonicalization:
+    """Cache keys built from canonicalized prompts"""
+
+    def test_whitespace_and_line_ending_variants_share_a_key(self):
+        assert gemini_service._prompt_key('Summarize:\r\nSome   text  \n') == \
+            gemini_service._prompt_key('Summarize:\nSome text')
+
+    def test_unicode_composition_variants_share_a_key(self):
+        composed = 'caf\u00e9'
+        decomposed = 'cafe\u0301'
+        assert gemini_service._prompt_key(composed) == gemini_service._prompt_key(decomposed)
+
+    def test_key_is_namespaced_by_version(self, monkeypatch):
+        before = gemini_service._prompt_key('hello')
+        monkeypatch.setattr(gemini_service, '_CANONICALIZATION_VERSION', 2)
+        assert gemini_service._prompt_key('hello') != before
+
+    def test_disabled_canonicalization_uses_raw_hash(self, monkeypatch):
+        monkeypatch.setattr(gemini_service, '_canonicalization_steps', ())
+        assert gemini_service._prompt_key('a  b') == gemini_service._hash_prompt('a  b')
+
+    def test_unknown_step_is_rejected(self):
+        with pytest.raises(RuntimeError):
+            gemini_service._parse_canonicalization_steps('newlines,lowercase')
+
+    def test_stats_count_hits_only_canonicalization_found(self, fake_gemini):
+        gemini_service.generate_text_with_gemini('Some text', model_name='m')
+        gemini_service.generate_text_with_gemini('Some text', model_name='m')
+        gemini_service.generate_text_with_gemini('Some   text\r\n', model_name='m')
+
+        stats = gemini_service.get_canonicalization_stats()
+        assert len(fake_gemini) == 1
+        assert stats['lookups'] == 3
+        assert stats['hits'] == 2
+        assert stats['canonical_only_hits'] == 1
+        assert stats['hit_rate_uplift'] == pytest.approx(1 / 3)
+
+
+class TestSingleFlight:
+    """Coalescing of identical in-flight prompts"""
+
+    def test_concurrent_identical_prompts_share_one_call(self, fake_gemini, monkeypatch):
+        release = threading.Event()
+        calls = []
+
+        def slow_call(model_name, prompt, timeout=None):
+            calls.append(prompt)
+            release.wait(timeout=5)
+            return 'shared'
+
+        monkeypatch.setattr(gemini_service, '_call_gemini', slow_call)
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(gemini_service.generate_text_with_gemini('same', model_name='m'))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while gemini_service.get_coalesced_count() < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert calls == ['same']
+        assert results == ['shared'] * 5
+        assert gemini_service.get_coalesced_count() == 4
+
+    def test_followers_receive_the_leaders_error(self):
+        flight = gemini_service._SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def failing():
+            started.set()
+            release.wait(timeout=5)
+            raise RuntimeError('boom')
+
+        def run(fn):
+            try:
+                flight.do(('m', 'k'), fn)
+            except RuntimeError as exc:
+                errors.append(str(exc))
+
+        leader = threading.Thread(target=run, args=(failing,))
+        leader.start()
+        started.wait(timeout=5)
+        follower = threading.Thread(target=run, args=(lambda: 'unused',))
+        follower.start()
+        deadline = time.monotonic() + 5
+        while flight.coalesced < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+
+        assert errors == ['boom', 'boom']
+
+
+class TestModelRegistry:
+    """Reuse of GenerativeModel instances"""
+
+    def test_model_is_built_once_per_name(self, monkeypatch):
+        built = []
+
+        class FakeGenAI:
+            @staticmethod
+            def GenerativeModel(model_name):
+                built.append(model_name)
+                return object()
+
+        monkeypatch.setattr(gemini_service, 'genai', FakeGenAI)
+        monkeypatch.setattr(gemini_service, '_model_registry', {})
+
+        first = gemini_service._get_model('m')
+        assert gemini_service._get_model('m') is first
+        gemini_service._get_model('other')
+        assert built == ['m', 'other']
+
+    def test_prewarm_builds_configured_models(self, monkeypatch):
+        monkeypatch.setattr(gemini_service, '_configure_once', lambda: None)
+        monkeypatch.setattr(gemini_service, '_model_registry', {})
+        monkeypatch.setattr(gemini_service, '_get_model', lambda name: gemini_service._model_registry.setdefault(name, name))
+        monkeypatch.setenv('GEMINI_PREWARM_MODELS', 'a, b')
+
+        gemini_service.prewarm_models()
+        assert sorted(gemini_service._model_registry) == ['a', 'b']
+
+
+class TestStreamTextWithGemini:
+    """Streaming generation shares the generation cache"""
+
+    def test_completed_stream_is_cached(self, fake_gemini, monkeypatch):
+        streamed = []
+
+        def fake_stream(model_name, prompt, timeout=None):
+            streamed.append(prompt)
+            yield 'Hel'
+            yield 'lo'
+
+        monkeypatch.setattr(gemini_service, '_stream_gemini', fake_stream)
+
+        assert list(gemini_service.stream_text_with_gemini('hi', model_name='m')) == ['Hel', 'lo']
+        assert list(gemini_service.stream_text_with_gemini('hi', model_name='m')) == ['Hello']
+        assert gemini_service.generate_text_with_gemini('hi', model_name='m') == 'Hello'
+        assert streamed == ['hi']
+        assert fake_gemini == []
+
+    def test_abandoned_stream_is_not_cached(self, fake_gemini, monkeypatch):
+        def fake_stream(model_name, prompt, timeout=None):
+            yield 'partial'
+            yield 'rest'
+
+        monkeypatch.setattr(gemini_service, '_stream_gemini', fake_stream)
+        stream = gemini_service.stream_text_with_gemini('hi', model_name='m')
+        assert next(stream) == 'partial'
+        stream.close()
+
+        assert gemini_service._generation_cache.get('m', gemini_service._prompt_key('hi')) is None
+
+    def test_disconnect_does_not_close_a_half_open_breaker(self, fake_gemini, monkeypatch):
+        def fake_stream(model_name, prompt, timeout=None):
+            yield 'partial'
+            yield 'rest'
+
+        monkeypatch.setattr(gemini_service, '_stream_gemini', fake_stream)
+        monkeypatch.setattr(gemini_service, '_breakers', gemini_service.CircuitBreakerRegistry(1, 0))
+        breaker = gemini_service._breakers.get('m')
+        breaker.record_failure()
+        assert breaker.state == gemini_service.CircuitBreaker.HALF_OPEN
+
+        stream = gemini_service.stream_text_with_gemini('hi', model_name='m')
+        assert next(stream) == 'partial'
+        stream.close()
+
+        # Still unproven, but the probe slot is free for the next caller
+        assert breaker.state == gemini_service.CircuitBreaker.HALF_OPEN
+        assert breaker.allow()
+
+
+class TestAsyncGeneration:
+    """agenerate_text_with_gemini on the shared background loop"""
+
+    def test_concurrent_identical_prompts_share_one_call(self, fake_gemini, monkeypatch):
+        calls = []
+
+        async def fake_acall(model_name, prompt, timeout=None):
+            calls.append(prompt)
+            await asyncio.sleep(0.05)
+            return f'async output for {prompt}'
+
+        monkeypatch.setattr(gemini_service, '_acall_gemini', fake_acall)
+        before = gemini_service.get_coalesced_count()
+
+        async def run():
+            return await asyncio.gather(
+                *(gemini_service.agenerate_text_with_gemini('same', model_name='m') for _ in range(10)),
+                gemini_service.agenerate_text_with_gemini('other', model_name='m'),
+            )
+
+        results = asyncio.run(run())
+
+        assert results == ['async output for same'] * 10 + ['async output for other']
+        assert sorted(calls) == ['other', 'same']
+        assert gemini_service.get_coalesced_count() - before == 9
+        assert gemini_service._generation_cache.get('m', gemini_service._prompt_key('same')) == 'async output for same'
+
+    def test_cache_writes_run_off_the_event_loop(self, fake_gemini, monkeypatch):
+        async def fake_acall(model_name, prompt, timeout=None):
+            return f'async output for {prompt}'
+
+        writers = []
+        real_put = gemini_service._generation_cache.put
+
+        def recording_put(model_name, prompt_hash, text):
+            writers.append(threading.current_thread().name)
+            real_put(model_name, prompt_hash, text)
+
+        monkeypatch.setattr(gemini_service, '_acall_gemini', fake_acall)
+        monkeypatch.setattr(gemini_service._generation_cache, 'put', recording_put)
+        assert asyncio.run(gemini_service.agenerate_text_with_gemini('stored', model_name='m')) == (
+            'async output for stored'
+        )
+        assert len(writers) == 1 and writers[0] != 'gemini-async'
+
+    def test_errors_propagate_and_are_negatively_cached(self, fake_gemini, monkeypatch):
+        calls = []
+
+        async def failing_acall(model_name, prompt, timeout=None):
+            calls.append(prompt)
+            raise RuntimeError('Gemini generation failed: unavailable')
+
+        monkeypatch.setattr(gemini_service, '_acall_gemini', failing_acall)
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match='unavailable'):
+                asyncio.run(gemini_service.agenerate_text_with_gemini('x', model_name='m'))
+        assert calls == ['x']
@@ -0,0 +1,361 @@
+"""
+Unit tests for the generation cache used by gemini_service
+"""
+import socketserver
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import gemini_service
+from generation_cache import LRUTTLCache, RedisCache, SQLiteCache, TieredCache
+
+
+class _FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Serve the handful of RESP commands RedisCache uses from an in-memory dict."""
+
+    def _read_command(self):
+        header = self.rfile.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            name = args[0].upper()
+            self.server.commands.append(name)
+            if name == b'GET':
+                value, expires_at = store.get(args[1], (None, None))
+                if value is None or (expires_at is not None and time.monotonic() >= expires_at):
+                    self.wfile.write(b'$-1\r\n')
+                else:
+                    self.wfile.write(b'$%d\r\n%s\r\n' % (len(value), value))
+            elif name == b'SET':
+                expires_at = None
+                if len(args) == 5 and args[3].upper() == b'PX':
+                    expires_at = time.monotonic() + int(args[4]) / 1000
+                store[args[1]] = (args[2], expires_at)
+                self.wfile.write(b'+OK\r\n')
+            elif name == b'SELECT':
+                self.wfile.write(b'+OK\r\n')
+            else:
+                self.wfile.write(b"-ERR unknown command '%s'\r\n" % name)
+
+
+@pytest.fixture
+def fake_redis():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _FakeRedisHandler)
+    server.daemon_threads = True
+    server.store = {}
+    server.commands = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestLRUTTLCache:
+    """LRU/TTL behaviour of the in-process generation cache"""
+
+    def test_put_then_get_returns_value(self):
+        cache = LRUTTLCache(max_items=4, ttl_seconds=60)
+        cache.put('model', 'abc', 'hello')
+        assert cache.get('model', 'abc') == 'hello'
+        assert cache.get('other-model', 'abc') is None
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUTTLCache(max_items=2, ttl_seconds=60, stripes=1)
+        cache.put('m', 'a', '1')
+        cache.put('m', 'b', '2')
+        # Touch "a" so that "b" becomes the LRU entry
+        assert cache.get('m', 'a') == '1'
+        cache.put('m', 'c', '3')
+
+        assert cache.get('m', 'b') is None
+        assert cache.get('m', 'a') == '1'
+        assert cache.get('m', 'c') == '3'
+        assert cache.stats()['evictions'] == 1
+
+    def test_never_exceeds_max_items(self):
+        cache = LRUTTLCache(max_items=10, ttl_seconds=60, stripes=4)
+        for i in range(100):
+            cache.put('m', str(i), 'x')
+        assert len(cache) <= 10
+
+    def test_expired_entries_are_dropped(self, monkeypatch):
+        cache = LRUTTLCache(max_items=4, ttl_seconds=5)
+        now = time.monotonic()
+        monkeypatch.setattr(time, 'monotonic', lambda: now)
+        cache.put('m', 'a', 'value')
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 6)
+
+        assert cache.get('m', 'a') is None
+        stats = cache.stats()
+        assert stats['expirations'] == 1
+        assert stats['items'] == 0
+
+    def test_stale_window_keeps_expired_entries_for_get_stale(self, monkeypatch):
+        cache = LRUTTLCache(max_items=4, ttl_seconds=5, stale_seconds=10)
+        now = time.monotonic()
+        monkeypatch.setattr(time, 'monotonic', lambda: now)
+        cache.put('m', 'a', 'value')
+        assert cache.get_stale('m', 'a') is None  # still fresh
+
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 6)
+        assert cache.get('m', 'a') is None
+        assert cache.get_stale('m', 'a') == 'value'
+
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 16)
+        assert cache.get('m', 'a') is None
+        assert cache.get_stale('m', 'a') is None
+        stats = cache.stats()
+        assert stats['stale_hits'] == 1
+        assert stats['expirations'] == 1
+        assert stats['items'] == 0
+
+    def test_counts_hits_and_misses(self):
+        cache = LRUTTLCache(max_items=4, ttl_seconds=60)
+        cache.put('m', 'a', 'value')
+        cache.get('m', 'a')
+        cache.get('m', 'a')
+        cache.get('m', 'missing')
+
+        stats = cache.stats()
+        assert stats['hits'] == 2
+        assert stats['misses'] == 1
+
+    def test_tracks_stored_bytes(self):
+        cache = LRUTTLCache(max_items=2, ttl_seconds=60, stripes=1)
+        cache.put('m', 'a', 'é' * 3)
+        cache.put('m', 'a', 'xy')
+        cache.put('m', 'b', 'xyz')
+        assert cache.stats()['bytes'] == 5
+        cache.put('m', 'c', 'w')  # evicts "a"
+        assert cache.stats()['bytes'] == 4
+        cache.clear()
+        assert cache.stats()['bytes'] == 0
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        cache = LRUTTLCache(max_items=100, ttl_seconds=60, stripes=1, max_bytes=25)
+        cache.put('m', 'a', 'x' * 10)
+        cache.put('m', 'b', 'x' * 10)
+        cache.put('m', 'c', 'x' * 10)
+
+        assert cache.get('m', 'a') is None
+        assert cache.get('m', 'c') == 'x' * 10
+        stats = cache.stats()
+        assert stats['bytes'] == 20
+        assert stats['evictions'] == 1
+
+    def test_values_over_budget_are_not_cached(self):
+        cache = LRUTTLCache(max_items=100, ttl_seconds=60, stripes=1, max_bytes=8)
+        cache.put('m', 'a', 'x' * 9)
+        assert cache.get('m', 'a') is None
+        assert len(cache) == 0
+
+    def test_large_values_are_compressed(self):
+        cache = LRUTTLCache(max_items=4, ttl_seconds=60, stripes=1, compress_min_bytes=100)
+        summary = '• Mitochondria produce ATP through cellular respiration.\n' * 40
+        cache.put('m', 'big', summary)
+        cache.put('m', 'small', 'short')
+
+        assert cache.get('m', 'big') == summary
+        assert cache.get('m', 'small') == 'short'
+        stats = cache.stats()
+        assert stats['compressed_items'] == 1
+        assert stats['raw_bytes'] == len(summary.encode('utf-8')) + 5
+        assert stats['bytes'] < stats['raw_bytes']
+        assert stats['compression_ratio'] > 5
+
+    def test_compression_lets_more_entries_fit_the_budget(self):
+        summaries = [f'{i}: ' + 'energy flows through the ecosystem. ' * 30 for i in range(20)]
+        plain = LRUTTLCache(max_items=100, ttl_seconds=60, stripes=1, max_bytes=8000)
+        packed = LRUTTLCache(max_items=100, ttl_seconds=60, stripes=1, max_bytes=8000, compress_min_bytes=256)
+        for i, summary in enumerate(summaries):
+            plain.put('m', str(i), summary)
+            packed.put('m', str(i), summary)
+        assert len(packed) == 20
+        assert len(plain) < len(packed)
+
+    def test_incompressible_values_are_stored_as_is(self):
+        cache = LRUTTLCache(max_items=4, ttl_seconds=60, compress_min_bytes=1)
+        cache.put('m', 'a', 'ab')
+        assert cache.get('m', 'a') == 'ab'
+        assert cache.stats()['compressed_items'] == 0
+
+    @pytest.mark.parametrize('max_items,ttl', [(0, 60), (4, 0)])
+    def test_disabled_cache_stores_nothing(self, max_items, ttl):
+        cache = LRUTTLCache(max_items=max_items, ttl_seconds=ttl)
+        cache.put('m', 'a', 'value')
+        assert cache.get('m', 'a') is None
+        assert len(cache) == 0
+
+
+class TestSQLiteCache:
+    """On-disk generation cache tier"""
+
+    def test_entries_survive_a_new_instance(self, tmp_path):
+        path = str(tmp_path / 'cache.db')
+        SQLiteCache(path, ttl_seconds=60).put('m', 'a', 'persisted')
+
+        assert SQLiteCache(path, ttl_seconds=60).get('m', 'a') == 'persisted'
+
+    def test_stats_report_shared_size(self, tmp_path):
+        cache = SQLiteCache(str(tmp_path / 'cache.db'), ttl_seconds=60)
+        cache.put('m', 'a', 'é')
+        cache.put('m', 'b', 'xyz')
+        stats = cache.stats()
+        assert stats['items'] == 2
+        assert stats['bytes'] == 5
+
+    def test_expired_entries_are_dropped(self, tmp_path, monkeypatch):
+        cache = SQLiteCache(str(tmp_path / 'cache.db'), ttl_seconds=5)
+        now = time.time()
+        monkeypatch.setattr(time, 'time', lambda: now)
+        cache.put('m', 'a', 'value')
+        monkeypatch.setattr(time, 'time', lambda: now + 6)
+
+        assert cache.get('m', 'a') is None
+        assert cache.stats()['expirations'] == 1
+
+    def test_prune_keeps_total_bytes_under_budget(self, tmp_path, monkeypatch):
+        cache = SQLiteCache(str(tmp_path / 'cache.db'), ttl_seconds=60, max_bytes=25, prune_every=1)
+        now = time.time()
+        for i, key in enumerate(['a', 'b', 'c']):
+            monkeypatch.setattr(time, 'time', lambda i=i: now + i)
+            cache.put('m', key, 'x' * 10)
+
+        # "a" was the least recently accessed row, so it goes first
+        assert cache.get('m', 'a') is None
+        assert cache.get('m', 'c') == 'x' * 10
+        assert cache.stats()['evictions'] == 1
+
+    def test_shared_between_threads(self, tmp_path):
+        cache = SQLiteCache(str(tmp_path / 'cache.db'), ttl_seconds=60)
+        threads = [
+            threading.Thread(target=cache.put, args=('m', str(i), 'v'))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(cache) == 8
+
+    def test_locked_database_is_a_miss_not_an_error(self, tmp_path):
+        path = str(tmp_path / 'cache.db')
+        cache = SQLiteCache(path, ttl_seconds=60, prune_every=1, timeout_seconds=0.05)
+        holder = sqlite3.connect(path, isolation_level=None)
+        holder.execute('BEGIN IMMEDIATE')
+        try:
+            cache.put('m', 'a', 'value')
+            cache.prune()
+        finally:
+            holder.execute('ROLLBACK')
+            holder.close()
+        assert cache.get('m', 'a') is None
+        assert cache.stats()['errors'] == 2
+
+        cache.put('m', 'a', 'value')
+        assert cache.get('m', 'a') == 'value'
+
+    def test_unreadable_database_is_a_miss(self, tmp_path):
+        path = str(tmp_path / 'cache.db')
+        cache = SQLiteCache(path, ttl_seconds=60)
+        with sqlite3.connect(path) as other:
+            other.execute('DROP TABLE generations')
+        assert cache.get('m', 'a') is None
+        stats = cache.stats()
+        assert stats['misses'] == 1 and stats['errors'] >= 1
+
+    def test_generation_survives_a_locked_cache(self, tmp_path, monkeypatch):
+        path = str(tmp_path / 'cache.db')
+        monkeypatch.setattr(gemini_service, '_configure_once', lambda: None)
+        monkeypatch.setattr(gemini_service, '_call_gemini', lambda model_name, prompt, timeout=None: 'paid output')
+        monkeypatch.setattr(gemini_service, '_generation_cache',
+                            SQLiteCache(path, ttl_seconds=60, timeout_seconds=0.05))
+        monkeypatch.setattr(gemini_service, '_router', None)
+        monkeypatch.setattr(gemini_service, '_cassette', None)
+        holder = sqlite3.connect(path, isolation_level=None)
+        holder.execute('BEGIN IMMEDIATE')
+        try:
+            assert gemini_service.generate_text_with_gemini('hello', model_name='m') == 'paid output'
+        finally:
+            holder.execute('ROLLBACK')
+            holder.close()
+        assert gemini_service._generation_cache.stats()['errors'] >= 1
+
+
+class TestTieredCache:
+    """Memory L1 in front of the disk L2"""
+
+    def test_l2_hit_is_promoted_to_l1(self, tmp_path):
+        path = str(tmp_path / 'cache.db')
+        SQLiteCache(path, ttl_seconds=60).put('m', 'a', 'from-disk')
+        tiered = TieredCache(LRUTTLCache(4, 60), SQLiteCache(path, ttl_seconds=60))
+
+        assert tiered.get('m', 'a') == 'from-disk'
+        assert tiered.l1.get('m', 'a') == 'from-disk'
+        stats = tiered.stats()
+        assert stats['l2_hits'] == 1
+
+
+class TestRedisCache:
+    """Redis-protocol tier against a local fake server"""
+
+    def test_put_then_get_round_trips(self, fake_redis):
+        host, port = fake_redis.server_address
+        cache = RedisCache(f'redis://{host}:{port}/2', ttl_seconds=60)
+        cache.put('m', 'abc', 'héllo')
+
+        assert cache.get('m', 'abc') == 'héllo'
+        assert cache.get('m', 'missing') is None
+        assert b'gemini:m:abc' in fake_redis.store
+        assert fake_redis.commands[0] == b'SELECT'
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'errors': 0}
+
+    def test_entries_expire_server_side(self, fake_redis):
+        host, port = fake_redis.server_address
+        cache = RedisCache(f'redis://{host}:{port}', ttl_seconds=0.05)
+        cache.put('m', 'a', 'short-lived')
+        time.sleep(0.1)
+        assert cache.get('m', 'a') is None
+
+    def test_unreachable_server_is_a_miss(self):
+        cache = RedisCache('redis://127.0.0.1:1', ttl_seconds=60, timeout_seconds=0.1)
+        cache.put('m', 'a', 'value')
+        assert cache.get('m', 'a') is None
+        assert cache.stats()['errors'] == 2
+
+
+class TestBackendSelection:
+    """GEMINI_CACHE_BACKEND picks the cache topology"""
+
+    def test_memory_is_the_default(self):
+        assert isinstance(gemini_service._build_generation_cache('memory'), LRUTTLCache)
+
+    def test_tiered_redis(self):
+        cache = gemini_service._build_generation_cache('memory+redis')
+        assert isinstance(cache, TieredCache)
+        assert isinstance(cache.l2, RedisCache)
+
+    def test_disk_requires_a_path(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(gemini_service, '_CACHE_DB_PATH', '')
+        with pytest.raises(RuntimeError):
+            gemini_service._build_generation_cache('disk')
+        monkeypatch.setattr(gemini_service, '_CACHE_DB_PATH', str(tmp_path / 'cache.db'))
+        assert isinstance(gemini_service._build_generation_cache('disk'), SQLiteCache)
+
+    def test_unknown_backend_is_rejected(self):
+        with pytest.raises(RuntimeError):
+            gemini_service._build_generation_cache('memcached')
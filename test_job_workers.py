@@ -0,0 +1,72 @@
+"""
+Unit tests for the polling worker pool behind async ingest
+"""
+import threading
+import time
+
+from job_workers import PollingWorkers
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestPollingWorkers:
+    """Draining, waking and stopping"""
+
+    def test_drains_queue_then_wakes_on_notify(self):
+        queue = [1, 2, 3]
+        lock = threading.Lock()
+
+        def run_once():
+            with lock:
+                return bool(queue) and queue.pop() is not None
+
+        workers = PollingWorkers(run_once, workers=2, poll_seconds=60)
+        workers.start()
+        try:
+            _wait_for(lambda: workers.stats()["processed"] == 3)
+            with lock:
+                queue.append(4)
+            workers.notify()
+            _wait_for(lambda: workers.stats()["processed"] == 4)
+        finally:
+            workers.stop()
+        assert not workers.running
+
+    def test_errors_are_counted_and_do_not_stop_the_worker(self):
+        calls = []
+
+        def run_once():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("database is locked")
+            return False
+
+        workers = PollingWorkers(run_once, workers=1, poll_seconds=0.01)
+        workers.start()
+        try:
+            _wait_for(lambda: len(calls) >= 3)
+        finally:
+            workers.stop()
+        stats = workers.stats()
+        assert stats["errors"] == 1
+        assert stats["last_error"] == "database is locked"
+
+    def test_zero_workers_never_start(self):
+        workers = PollingWorkers(lambda: False, workers=0)
+        workers.start()
+        assert not workers.running
+
+    def test_restart_after_stop(self):
+        workers = PollingWorkers(lambda: False, workers=1, poll_seconds=0.01)
+        workers.start()
+        workers.stop()
+        workers.start()
+        try:
+            assert workers.running
+        finally:
+            workers.stop()
@@ -0,0 +1,87 @@
+"""
+Unit tests for the latency histograms and Prometheus text rendering
+"""
+import math
+
+from metrics import LatencyHistogram, LatencyRecorder, PrometheusText
+
+
+class TestLatencyHistogram:
+    """Bucketing and snapshots"""
+
+    def test_buckets_are_cumulative(self):
+        histogram = LatencyHistogram(buckets=(0.1, 1.0))
+        for seconds in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(seconds)
+
+        snapshot = histogram.snapshot()
+        assert snapshot['buckets'] == [(0.1, 2), (1.0, 3), (math.inf, 4)]
+        assert snapshot['count'] == 4
+        assert snapshot['sum'] == 3.65
+
+    def test_counts_errors(self):
+        histogram = LatencyHistogram()
+        histogram.observe(0.2, error=True)
+        histogram.observe(0.2)
+        assert histogram.snapshot()['errors'] == 1
+
+
+class TestLatencyRecorder:
+    """One histogram per label"""
+
+    def test_keeps_labels_apart(self):
+        recorder = LatencyRecorder(buckets=(1.0,))
+        recorder.observe('a', 0.5)
+        recorder.observe('b', 2.0)
+        recorder.observe('b', 2.0)
+
+        snapshot = recorder.snapshot()
+        assert snapshot['a']['count'] == 1
+        assert snapshot['b']['buckets'] == [(1.0, 0), (math.inf, 2)]
+
+
+class TestPrometheusText:
+    """Text exposition format"""
+
+    def test_samples_share_one_header(self):
+        out = PrometheusText()
+        out.sample('hits_total', 'counter', 'Hits.', 3, tier='l1')
+        out.sample('hits_total', 'counter', 'Hits.', 1, tier='l2')
+        assert out.render() == (
+            '# HELP hits_total Hits.\n'
+            '# TYPE hits_total counter\n'
+            'hits_total{tier="l1"} 3\n'
+            'hits_total{tier="l2"} 1\n'
+        )
+
+    def test_interleaved_families_render_contiguously(self):
+        out = PrometheusText()
+        out.sample('hits_total', 'counter', 'Hits.', 3, tier='l1')
+        out.sample('items', 'gauge', 'Items.', 5, tier='l1')
+        out.sample('hits_total', 'counter', 'Hits.', 1, tier='l2')
+        assert out.render().splitlines() == [
+            '# HELP hits_total Hits.',
+            '# TYPE hits_total counter',
+            'hits_total{tier="l1"} 3',
+            'hits_total{tier="l2"} 1',
+            '# HELP items Items.',
+            '# TYPE items gauge',
+            'items{tier="l1"} 5',
+        ]
+
+    def test_histogram_series(self):
+        histogram = LatencyHistogram(buckets=(0.5,))
+        histogram.observe(0.25)
+        out = PrometheusText()
+        out.histogram('latency_seconds', 'Latency.', histogram.snapshot(), model='m')
+
+        lines = out.render().splitlines()
+        assert 'latency_seconds_bucket{model="m",le="0.5"} 1' in lines
+        assert 'latency_seconds_bucket{model="m",le="+Inf"} 1' in lines
+        assert 'latency_seconds_sum{model="m"} 0.25' in lines
+        assert 'latency_seconds_count{model="m"} 1' in lines
+
+    def test_label_values_are_escaped(self):
+        out = PrometheusText()
+        out.sample('x', 'gauge', 'X.', 1, model='a"b\\c')
+        assert 'x{model="a\\"b\\\\c"} 1' in out.render()
@@ -0,0 +1,259 @@
+"""
+Unit tests for the resilience helpers used around remote generation calls
+"""
+import threading
+import time
+
+import pytest
+
+from resilience import (
+    CircuitBreaker,
+    CircuitBreakerRegistry,
+    DeadlineExceeded,
+    FairRateLimiter,
+    ModelRouter,
+    RateLimitExceeded,
+    RetryPolicy,
+)
+
+
+class TestCircuitBreaker:
+    """Closed -> open -> half-open transitions"""
+
+    def test_trips_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3, recovery_seconds=60)
+        for _ in range(3):
+            assert breaker.allow()
+            breaker.record_failure()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+        snapshot = breaker.snapshot()
+        assert snapshot['trips'] == 1
+        assert snapshot['rejections'] == 1
+
+    def test_success_resets_failure_count(self):
+        breaker = CircuitBreaker(failure_threshold=2, recovery_seconds=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open_allows_a_single_probe(self, monkeypatch):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_seconds=10)
+        now = time.monotonic()
+        monkeypatch.setattr(time, 'monotonic', lambda: now)
+        breaker.record_failure()
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_failed_probe_reopens(self, monkeypatch):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_seconds=10)
+        now = time.monotonic()
+        monkeypatch.setattr(time, 'monotonic', lambda: now)
+        breaker.record_failure()
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+        assert breaker.allow()
+        breaker.record_failure()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.snapshot()['trips'] == 2
+
+
+class TestCircuitBreakerRegistry:
+    """One breaker per model name"""
+
+    def test_breakers_are_independent(self):
+        registry = CircuitBreakerRegistry(failure_threshold=1, recovery_seconds=60)
+        registry.get('model-a').record_failure()
+
+        assert registry.get('model-a') is registry.get('model-a')
+        states = registry.snapshot()
+        assert states['model-a']['state'] == CircuitBreaker.OPEN
+        assert registry.get('model-b').allow()
+
+
+class TestFairRateLimiter:
+    """Token buckets with per-user round-robin queueing"""
+
+    def test_disabled_limiter_never_waits(self):
+        limiter = FairRateLimiter(rpm=0)
+        assert limiter.acquire('a') == 0.0
+
+    def test_burst_is_granted_immediately(self):
+        limiter = FairRateLimiter(rpm=60, burst=3)
+        assert [limiter.acquire('a') for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert limiter.stats()['granted'] == 3
+
+    def test_times_out_when_no_capacity(self):
+        limiter = FairRateLimiter(rpm=60, burst=1, max_wait_seconds=0.05)
+        limiter.acquire('a')
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire('a')
+        stats = limiter.stats()
+        assert stats['rejected'] == 1
+        assert stats['queue_depth'] == 0
+
+    def test_token_budget_limits_large_prompts(self):
+        limiter = FairRateLimiter(rpm=600, tpm=100, max_wait_seconds=0.05)
+        limiter.acquire('a', tokens=100)
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire('a', tokens=50)
+
+    def test_users_are_served_round_robin(self):
+        # One request every 50 ms once the single burst token is spent
+        limiter = FairRateLimiter(rpm=1200, burst=1, max_wait_seconds=5)
+        limiter.acquire('warmup')
+        order = []
+        lock = threading.Lock()
+
+        def call(user, label):
+            limiter.acquire(user)
+            with lock:
+                order.append(label)
+
+        threads = []
+        for user, label in [('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1')]:
+            thread = threading.Thread(target=call, args=(user, label))
+            thread.start()
+            threads.append(thread)
+            # Make sure each caller is queued before the next one arrives
+            deadline = time.monotonic() + 1
+            while limiter.stats()['queue_depth'] + len(order) < len(threads) and time.monotonic() < deadline:
+                time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+
+        assert order.index('b1') < order.index('a3')
+        assert limiter.stats()['delayed'] == 4
+
+
+class TestRetryPolicy:
+    """Backoff, retryable classification and deadlines"""
+
+    def test_retries_retryable_errors_until_success(self, monkeypatch):
+        monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+        policy = RetryPolicy(max_attempts=3, base_delay_seconds=0.01)
+        attempts = []
+
+        def flaky(timeout):
+            attempts.append(timeout)
+            if len(attempts) < 3:
+                raise TimeoutError('slow')
+            return 'ok'
+
+        assert policy.run(flaky, lambda exc: isinstance(exc, TimeoutError)) == 'ok'
+        stats = policy.stats()
+        assert stats['attempts'] == 3
+        assert stats['retries'] == 2
+
+    def test_non_retryable_errors_fail_immediately(self):
+        policy = RetryPolicy(max_attempts=5)
+        attempts = []
+
+        def broken(timeout):
+            attempts.append(timeout)
+            raise ValueError('bad request')
+
+        with pytest.raises(ValueError):
+            policy.run(broken, lambda exc: isinstance(exc, TimeoutError))
+        assert len(attempts) == 1
+
+    def test_attempt_timeout_is_capped_by_deadline(self):
+        policy = RetryPolicy(attempt_timeout_seconds=30)
+        timeout = policy.attempt_timeout(time.monotonic() + 2)
+        assert 0 < timeout <= 2
+        assert policy.attempt_timeout(None) == 30
+
+    def test_expired_deadline_raises(self):
+        policy = RetryPolicy()
+        with pytest.raises(DeadlineExceeded):
+            policy.run(lambda timeout: 'never', lambda exc: True, deadline=time.monotonic() - 1)
+        assert policy.stats()['deadline_exceeded'] == 1
+
+    def test_no_retry_when_backoff_would_pass_deadline(self):
+        policy = RetryPolicy(max_attempts=5, base_delay_seconds=10, max_delay_seconds=10)
+        policy.backoff = lambda attempt: 5.0
+        attempts = []
+
+        def failing(timeout):
+            attempts.append(timeout)
+            raise TimeoutError('slow')
+
+        with pytest.raises(TimeoutError):
+            policy.run(failing, lambda exc: True, deadline=time.monotonic() + 1)
+        assert len(attempts) == 1
+
+    def test_backoff_is_bounded(self):
+        policy = RetryPolicy(base_delay_seconds=0.5, max_delay_seconds=2)
+        for attempt in range(1, 10):
+            assert 0 <= policy.backoff(attempt) <= min(2, 0.5 * 2 ** (attempt - 1))
+
+
+class TestModelRouter:
+    """EWMA-based model choice and hedge delays"""
+
+    def test_measures_every_model_first(self):
+        router = ModelRouter(['a', 'b'])
+        first = router.choose()
+        router.started(first)
+        second = router.choose()
+        assert {first, second} == {'a', 'b'}
+
+    def test_prefers_the_fastest_healthy_model(self):
+        router = ModelRouter(['slow', 'fast'])
+        for _ in range(5):
+            router.record('slow', 2.0, ok=True)
+            router.record('fast', 0.5, ok=True)
+        assert router.choose() == 'fast'
+        assert router.choose(exclude={'fast'}) == 'slow'
+        assert router.choose(exclude={'fast', 'slow'}) is None
+
+    def test_avoids_failing_models(self):
+        router = ModelRouter(['flaky', 'steady'], alpha=0.5)
+        router.record('flaky', 0.1, ok=True)
+        router.record('steady', 1.0, ok=True)
+        for _ in range(3):
+            router.record('flaky', 0.1, ok=False)
+        assert router.choose() == 'steady'
+        assert router.snapshot()['flaky']['errors'] == 3
+
+    def test_traffic_moves_off_a_model_that_only_fails(self):
+        router = ModelRouter(['broken', 'healthy'])
+        picks = []
+        for _ in range(50):
+            model = router.choose()
+            router.started(model)
+            router.record(model, 0.1, ok=model == 'healthy')
+            picks.append(model)
+        assert picks.count('broken') == 1
+        assert picks[-10:] == ['healthy'] * 10
+
+    def test_error_rate_decays_so_models_recover(self, monkeypatch):
+        router = ModelRouter(['flaky', 'steady'], alpha=1.0, error_half_life_seconds=10)
+        now = time.monotonic()
+        monkeypatch.setattr(time, 'monotonic', lambda: now)
+        router.record('flaky', 0.1, ok=True)
+        router.record('steady', 1.0, ok=True)
+        router.record('flaky', 0.1, ok=False)
+        assert router.choose() == 'steady'
+
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 20)
+        assert router.snapshot()['flaky']['error_rate_ewma'] == pytest.approx(0.25)
+        assert router.choose() == 'flaky'
+
+    def test_hedge_delay_is_recent_p95(self):
+        router = ModelRouter(['a'])
+        assert router.hedge_delay('a', min_samples=20) is None
+        for i in range(1, 101):
+            router.record('a', i / 100, ok=True)
+        assert router.hedge_delay('a', min_samples=20) == pytest.approx(0.96)
+
+    def test_requires_models(self):
+        with pytest.raises(RuntimeError):
+            ModelRouter([])
@@ -0,0 +1,100 @@
+"""
+Unit tests for the MinHash/LSH near-duplicate cache
+"""
+import random
+import time
+
+import pytest
+
+from similarity_cache import MinHashLSHCache, _choose_rows_per_band
+
+
+def _essay(words=400, seed=0):
+    rng = random.Random(seed)
+    vocabulary = [f'word{i}' for i in range(2000)]
+    return ' '.join(rng.choice(vocabulary) for _ in range(words))
+
+
+class TestMinHashLSHCache:
+    """Similarity lookups, bounds and counters"""
+
+    def test_near_duplicate_is_served(self):
+        cache = MinHashLSHCache(threshold=0.85)
+        original = _essay()
+        cache.put('summarize', cache.signature(original), 'summary')
+
+        words = original.split()
+        words[200] = 'tpyo'
+        resubmitted = ' '.join(words) + ' One extra sentence at the end.'
+        assert cache.get('summarize', cache.signature(resubmitted)) == 'summary'
+
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['near_duplicate_hits'] == 1
+        assert 0.85 <= stats['mean_hit_similarity'] < 1.0
+
+    def test_different_text_misses(self):
+        cache = MinHashLSHCache(threshold=0.85)
+        cache.put('summarize', cache.signature(_essay(seed=1)), 'summary')
+        assert cache.get('summarize', cache.signature(_essay(seed=2))) is None
+        assert cache.stats()['misses'] == 1
+
+    def test_similarity_tracks_jaccard(self):
+        cache = MinHashLSHCache(threshold=0.5)
+        words = _essay(words=1000).split()
+        # Dropping the last fifth leaves roughly 80% of the shingles shared.
+        similarity = cache.similarity(cache.signature(' '.join(words)), cache.signature(' '.join(words[:800])))
+        assert similarity == pytest.approx(0.8, abs=0.1)
+
+    def test_threshold_controls_hits(self):
+        original = _essay()
+        truncated = ' '.join(original.split()[:300])
+        strict = MinHashLSHCache(threshold=0.95)
+        loose = MinHashLSHCache(threshold=0.6)
+        for cache in (strict, loose):
+            cache.put('summarize', cache.signature(original), 'summary')
+
+        assert strict.get('summarize', strict.signature(truncated)) is None
+        assert loose.get('summarize', loose.signature(truncated)) == 'summary'
+
+    def test_namespaces_are_isolated(self):
+        cache = MinHashLSHCache(threshold=0.9)
+        signature = cache.signature(_essay())
+        cache.put('summarize', signature, 'summary')
+        assert cache.get('flashcards', signature) is None
+
+    def test_evicts_least_recently_used(self):
+        cache = MinHashLSHCache(threshold=0.9, max_items=2)
+        signatures = [cache.signature(_essay(seed=seed)) for seed in range(3)]
+        for index, signature in enumerate(signatures):
+            cache.put('s', signature, str(index))
+
+        assert cache.get('s', signatures[0]) is None
+        assert cache.get('s', signatures[2]) == '2'
+        assert cache.stats()['evictions'] == 1
+
+    def test_expired_entries_are_dropped(self, monkeypatch):
+        cache = MinHashLSHCache(threshold=0.9, ttl_seconds=5)
+        now = time.monotonic()
+        monkeypatch.setattr(time, 'monotonic', lambda: now)
+        signature = cache.signature(_essay())
+        cache.put('s', signature, 'summary')
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 6)
+
+        assert cache.get('s', signature) is None
+        assert cache.stats()['expirations'] == 1
+        assert len(cache) == 0
+
+    def test_short_texts_get_full_signatures(self):
+        cache = MinHashLSHCache(threshold=0.9)
+        signature = cache.signature('Mitochondria produce ATP')
+        assert len(signature) == cache.num_perm
+        assert cache.similarity(signature, cache.signature('mitochondria  produce ATP!')) == 1.0
+
+    @pytest.mark.parametrize('threshold', [0, 1.5])
+    def test_rejects_bad_threshold(self, threshold):
+        with pytest.raises(RuntimeError):
+            MinHashLSHCache(threshold)
+
+    def test_band_width_grows_with_threshold(self):
+        assert _choose_rows_per_band(128, 0.5) < _choose_rows_per_band(128, 0.9)
@@ -0,0 +1,137 @@
+"""
+Unit tests for text extraction and the page-by-page iterator
+"""
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import text_extractor
+from text_extractor import extract_text_from_file, iter_pages
+
+
+def _write_pdf(path, page_texts):
+    """Write a minimal PDF with one line of Helvetica text per page (empty string: blank page)."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        content = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET" if text else ""
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    body = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    body += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    body += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as handle:
+        handle.write(body)
+
+
+class TestIterPages:
+    """Incremental extraction"""
+
+    def test_pdf_pages_are_numbered_and_blank_pages_skipped(self, tmp_path):
+        path = str(tmp_path / "notes.pdf")
+        _write_pdf(path, ["First page", "", "Third page"])
+        pages = list(iter_pages(path))
+        assert [number for number, _ in pages] == [1, 3]
+        assert "First page" in pages[0][1] and "Third page" in pages[1][1]
+
+    def test_pages_join_to_the_full_extraction(self, tmp_path):
+        path = str(tmp_path / "notes.pdf")
+        _write_pdf(path, [f"Page {i} text" for i in range(5)])
+        assert "\n".join(text for _, text in iter_pages(path)) == extract_text_from_file(path)
+
+    def test_pdf_is_read_lazily(self, tmp_path):
+        path = str(tmp_path / "notes.pdf")
+        _write_pdf(path, ["One", "Two", "Three"])
+        pages = iter_pages(path)
+        assert next(pages)[0] == 1
+        pages.close()
+
+    @pytest.mark.parametrize("content", ["", "one line", "a\nb\n", "line\n" * 50_000, "x" * 300_000 + "\nend"])
+    def test_txt_blocks_round_trip(self, tmp_path, monkeypatch, content):
+        monkeypatch.setattr(text_extractor, "_TXT_PAGE_CHARS", 4096)
+        path = tmp_path / "notes.txt"
+        path.write_text(content, encoding="utf-8")
+        pages = list(iter_pages(str(path)))
+        assert "\n".join(text for _, text in pages) == content
+        assert [number for number, _ in pages] == list(range(1, len(pages) + 1))
+
+    def test_invalid_paths_fail_before_iteration(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            iter_pages(str(tmp_path / "missing.pdf"))
+        other = tmp_path / "image.png"
+        other.write_bytes(b"\x89PNG")
+        with pytest.raises(ValueError):
+            iter_pages(str(other))
+
+
+class TestParallelPdfExtraction:
+    """Process-pool extraction of large PDFs"""
+
+    def test_pool_output_matches_serial(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "book.pdf")
+        _write_pdf(path, [f"Page {i} text" if i % 7 else "" for i in range(1, 41)])
+        serial = list(iter_pages(path))
+
+        monkeypatch.setattr(text_extractor, "PDF_PARALLEL_MIN_PAGES", 10)
+        monkeypatch.setattr(text_extractor, "PDF_EXTRACT_WORKERS", 2)
+        assert list(iter_pages(path)) == serial
+        assert text_extractor._pool is not None
+
+    def test_resizing_the_pool_lets_running_extractions_finish(self, tmp_path, monkeypatch):
+        first, second = str(tmp_path / "first.pdf"), str(tmp_path / "second.pdf")
+        _write_pdf(first, [f"First {i}" for i in range(1, 41)])
+        _write_pdf(second, [f"Second {i}" for i in range(1, 21)])
+        expected_first, expected_second = list(iter_pages(first)), list(iter_pages(second))
+        monkeypatch.setattr(text_extractor, "PDF_PARALLEL_MIN_PAGES", 10)
+        monkeypatch.setattr(text_extractor, "_pool", None)
+        monkeypatch.setattr(text_extractor, "_pool_users", {})
+
+        monkeypatch.setattr(text_extractor, "PDF_EXTRACT_WORKERS", 2)
+        running = iter_pages(first)
+        pages = [next(running)]
+        monkeypatch.setattr(text_extractor, "PDF_EXTRACT_WORKERS", 3)
+        try:
+            assert list(iter_pages(second)) == expected_second
+            pages.extend(running)
+            assert pages == expected_first
+            assert text_extractor._pool_users == {}
+        finally:
+            text_extractor._pool[2].shutdown()
+
+    def test_small_pdfs_stay_serial(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "notes.pdf")
+        _write_pdf(path, ["One", "Two"])
+        monkeypatch.setattr(text_extractor, "PDF_EXTRACT_WORKERS", 4)
+        monkeypatch.setattr(text_extractor, "_process_pool", lambda workers: pytest.fail("pool used"))
+        assert [number for number, _ in iter_pages(path)] == [1, 2]
+
+    def test_broken_pool_falls_back_to_serial(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "book.pdf")
+        _write_pdf(path, [f"Page {i}" for i in range(1, 21)])
+
+        class BrokenPool:
+            def submit(self, fn, *args):
+                future = Future()
+                future.set_exception(BrokenProcessPool("worker died"))
+                return future
+
+            def shutdown(self, wait=True, cancel_futures=False):
+                pass
+
+        monkeypatch.setattr(text_extractor, "PDF_PARALLEL_MIN_PAGES", 10)
+        monkeypatch.setattr(text_extractor, "PDF_EXTRACT_WORKERS", 2)
+        monkeypatch.setattr(text_extractor, "_process_pool", lambda workers: BrokenPool())
+        assert [number for number, _ in iter_pages(path)] == list(range(1, 21))
@@ -0,0 +1,125 @@
+"""
+Unit tests for token estimation and input shaping
+"""
+import random
+
+import pytest
+
+from token_budget import (
+    TRUNCATION_MARKER,
+    estimate_tokens,
+    parse_token_limits,
+    shape_text,
+    split_text,
+    truncate_text,
+)
+
+
+def _document(paragraphs=300):
+    return '\n\n'.join(
+        f'Section {i}. Photosynthesis stores light energy in glucose. '
+        f'Chlorophyll absorbs red and blue light.\nThe Calvin cycle fixes carbon.'
+        for i in range(paragraphs)
+    )
+
+
+class TestEstimateTokens:
+    """Token counts without a tokenizer"""
+
+    def test_english_is_about_four_thirds_tokens_per_word(self):
+        text = 'The quick brown fox jumps over the lazy dog near the riverbank today.'
+        assert 13 <= estimate_tokens(text) <= 18
+
+    def test_digits_symbols_and_cjk_count_individually(self):
+        assert estimate_tokens('2024') == 4
+        assert estimate_tokens('a+b=c') == 5
+        assert estimate_tokens('光合作用') == 4
+
+    def test_empty_text_is_zero(self):
+        assert estimate_tokens('') == 0
+
+    def test_sampled_estimate_tracks_the_exact_count(self):
+        text = _document(4000)
+        assert len(text) > 200_000
+        exact = sum(estimate_tokens(paragraph) for paragraph in text.split('\n\n'))
+        assert abs(estimate_tokens(text) - exact) / exact < 0.02
+
+
+class TestShapeText:
+    """Choosing between as-is, split and truncate"""
+
+    def test_text_within_budget_is_untouched(self):
+        text = _document(3)
+        shaped = shape_text(text, budget_tokens=10_000, max_chunks=4)
+        assert shaped.strategy == 'as_is'
+        assert shaped.chunks == [text]
+
+    def test_zero_budget_disables_shaping(self):
+        assert shape_text(_document(), budget_tokens=0).strategy == 'as_is'
+
+    def test_split_covers_the_text_on_paragraph_boundaries(self):
+        text = _document()
+        budget = estimate_tokens(text) // 3 + 50
+        shaped = shape_text(text, budget_tokens=budget, max_chunks=4)
+        assert shaped.strategy == 'split'
+        assert 3 <= len(shaped.chunks) <= 4
+        assert all(estimate_tokens(chunk) <= budget for chunk in shaped.chunks)
+        assert all(chunk.startswith('Section') for chunk in shaped.chunks)
+        assert '\n\n'.join(shaped.chunks) == text
+
+    def test_truncation_keeps_head_and_tail(self):
+        text = _document()
+        shaped = shape_text(text, budget_tokens=400, max_chunks=1)
+        assert shaped.strategy == 'truncate'
+        assert shaped.sent_tokens <= 400 < shaped.estimated_tokens
+        head, tail = shaped.text.split(TRUNCATION_MARKER)
+        assert head.startswith('Section 0.')
+        assert tail.endswith('The Calvin cycle fixes carbon.')
+        assert 'Section 299.' in tail
+
+    def test_oversized_text_is_truncated_then_split(self):
+        shaped = shape_text(_document(), budget_tokens=300, max_chunks=3)
+        assert shaped.strategy == 'truncate_split'
+        assert len(shaped.chunks) <= 3
+        assert all(estimate_tokens(chunk) <= 300 for chunk in shaped.chunks)
+
+    @pytest.mark.parametrize('seed', range(200))
+    def test_never_returns_more_than_max_chunks(self, seed):
+        rng = random.Random(seed)
+        words = ['cell', 'energy', 'mitochondria', 'photosynthesis', 'a', 'of', 'the', '2024', 'x+y']
+        paragraphs = [
+            ' '.join(rng.choice(words) for _ in range(rng.randint(1, 120))) + rng.choice(['.', '!', '?', ''])
+            for _ in range(rng.randint(1, 80))
+        ]
+        text = rng.choice(['\n\n', '\n', ' ']).join(paragraphs)
+        budget, max_chunks = rng.randint(5, 400), rng.randint(1, 6)
+        shaped = shape_text(text, budget_tokens=budget, max_chunks=max_chunks)
+        assert 1 <= len(shaped.chunks) <= max_chunks
+        if shaped.strategy != 'truncate':
+            assert all(estimate_tokens(chunk) <= budget for chunk in shaped.chunks)
+
+    def test_unbroken_text_falls_back_to_word_boundaries(self):
+        text = ' '.join(f'word{i}' for i in range(2000))
+        chunks = split_text(text, budget=100)
+        assert all(estimate_tokens(chunk) <= 100 for chunk in chunks)
+        assert ' '.join(chunks) == text
+
+    def test_truncate_without_any_boundary_cuts_characters(self):
+        truncated, _ = truncate_text('x' * 10_000, budget=10)
+        assert len(truncated) == 40
+
+    def test_metadata_reports_the_decision(self):
+        meta = shape_text(_document(), budget_tokens=300, max_chunks=1).metadata()
+        assert set(meta) == {'estimated_tokens', 'sent_tokens', 'budget_tokens', 'strategy', 'chunks'}
+        assert meta['chunks'] == 1
+
+
+class TestParseTokenLimits:
+    """AI_MODEL_CONTEXT_TOKENS parsing"""
+
+    def test_parses_model_limits(self):
+        assert parse_token_limits('models/a=1000, models/b=2000,') == {'models/a': 1000, 'models/b': 2000}
+
+    def test_rejects_malformed_entries(self):
+        with pytest.raises(RuntimeError):
+            parse_token_limits('models/a')
@@ -1,13 +1,54 @@
 from __future__ import annotations
 
+import functools
+import hashlib
+import inspect
+import math
+import multiprocessing
 import os
-from typing import Optional
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Tuple
 
 try:
     from PyPDF2 import PdfReader  # type: ignore
 except Exception as import_error:  # pragma: no cover
     PdfReader = None  # type: ignore
 
+# Bump when extraction output changes for reasons the code fingerprint in
+# `extractor_version` cannot see (e.g. a behaviour change in a dependency other than PyPDF2).
+EXTRACTION_VERSION = 1
+
+# .txt files have no pages; `iter_pages` yields them in blocks of about this many characters.
+_TXT_PAGE_CHARS = 256 * 1024
+
+# PDFs with at least PDF_PARALLEL_MIN_PAGES pages are extracted by a pool of
+# PDF_EXTRACT_WORKERS processes (default: the CPUs this process may use), each
+# handling page ranges of its own copy of the file. PyPDF2 is pure Python, so
+# threads would serialise on the GIL. Fewer pages, or a single worker, extract serially.
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "64"))
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", "0"))
+_pool_lock = threading.Lock()
+_pool: Tuple[int, int, ProcessPoolExecutor] | None = None
+# Extractions still using each pool of this process; a replaced pool shuts down after its last one.
+_pool_users: Dict[ProcessPoolExecutor, int] = {}
+
+
+def _validated_extension(file_path: str) -> str:
+    if not isinstance(file_path, str) or not file_path:
+        raise ValueError("file_path must be a non-empty string")
+
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+    _, extension = os.path.splitext(file_path)
+    normalized_extension = extension.lower()
+    if normalized_extension not in (".txt", ".pdf"):
+        raise ValueError(f"Unsupported file extension: {extension}. Only .txt and .pdf are supported.")
+    return normalized_extension
+
 
 def extract_text_from_file(file_path: str) -> str:
     """
@@ -22,22 +63,27 @@ def extract_text_from_file(file_path: str) -> str:
         FileNotFoundError: if the path does not exist or is not a file
         ValueError: if the extension is unsupported or PDF parser is unavailable
     """
-    if not isinstance(file_path, str) or not file_path:
-        raise ValueError("file_path must be a non-empty string")
+    if _validated_extension(file_path) == ".txt":
+        return _extract_text_from_txt(file_path)
+    return _extract_text_from_pdf(file_path)
 
-    if not os.path.isfile(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
 
-    _, extension = os.path.splitext(file_path)
-    normalized_extension = extension.lower()
-
-    if normalized_extension == ".txt":
-        return _extract_text_from_txt(file_path)
+def iter_pages(file_path: str) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page_number, text) pairs, numbered from 1, extracting one page at a time.
 
-    if normalized_extension == ".pdf":
-        return _extract_text_from_pdf(file_path)
+    Joining the yielded texts with "\n" gives `extract_text_from_file(file_path)`.
+    PDF pages without text are skipped, as in the full extraction. A .txt file is
+    yielded in blocks of about 256 KB cut at line breaks (the break itself is the
+    joining "\n"), so a final empty block stands for a trailing newline.
 
-    raise ValueError(f"Unsupported file extension: {extension}. Only .txt and .pdf are supported.")
+    The path is validated before the first page is read; raises as
+    `extract_text_from_file`.
+    """
+    if _validated_extension(file_path) == ".txt":
+        return _iter_txt_pages(file_path)
+    _require_pdf_reader()
+    return _iter_pdf_pages(file_path)
 
 
 def _extract_text_from_txt(file_path: str) -> str:
@@ -46,20 +92,185 @@ def _extract_text_from_txt(file_path: str) -> str:
     return content
 
 
-def _extract_text_from_pdf(file_path: str) -> str:
+def _iter_txt_pages(file_path: str) -> Iterator[Tuple[int, str]]:
+    page_number = 0
+    carry = ""
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as input_file:
+        while True:
+            block = input_file.read(_TXT_PAGE_CHARS)
+            if not block:
+                break
+            block = carry + block
+            cut = block.rfind("\n")
+            if cut < 0:
+                carry = block
+                continue
+            page_number += 1
+            yield page_number, block[:cut]
+            carry = block[cut + 1:]
+    if carry or page_number:
+        yield page_number + 1, carry
+
+
+def _require_pdf_reader() -> None:
     if PdfReader is None:
         raise ValueError(
             "PyPDF2 is required to extract text from PDFs. Please install PyPDF2."
         )
 
-    text_chunks: list[str] = []
+
+def _pdf_workers() -> int:
+    if PDF_EXTRACT_WORKERS > 0:
+        return PDF_EXTRACT_WORKERS
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover - not available on macOS/Windows
+        return os.cpu_count() or 1
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    """The shared pool of `workers` processes, held for the caller until `_release_pool`."""
+    global _pool
+    with _pool_lock:
+        # A forked worker inherits no pool processes, so start a new pool there.
+        if _pool is None or _pool[0] != os.getpid() or _pool[1] != workers:
+            if _pool is not None and _pool[0] != os.getpid():
+                _pool_users.clear()
+            elif _pool is not None and not _pool_users.get(_pool[2]):
+                _pool[2].shutdown(wait=False)
+            # spawn, not fork: the app process runs threads, which fork does not copy safely.
+            context = multiprocessing.get_context("spawn")
+            _pool = (os.getpid(), workers, ProcessPoolExecutor(workers, mp_context=context))
+        pool = _pool[2]
+        _pool_users[pool] = _pool_users.get(pool, 0) + 1
+        return pool
+
+
+def _release_pool(pool: ProcessPoolExecutor) -> None:
+    with _pool_lock:
+        if pool not in _pool_users:
+            return
+        _pool_users[pool] -= 1
+        if _pool_users[pool] > 0:
+            return
+        del _pool_users[pool]
+        if _pool is not None and _pool[2] is pool:
+            return
+    # Replaced while in use: nothing else submits to it now.
+    pool.shutdown(wait=False)
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool[2] is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _page_texts(reader, start: int, stop: int) -> Iterator[Tuple[int, str]]:
+    """Pages start..stop-1 (1-based) of an open reader that have text."""
+    for page_number in range(start, stop):
+        page_text: Optional[str] = reader.pages[page_number - 1].extract_text()  # type: ignore[attr-defined]
+        if page_text:
+            yield page_number, page_text
+
+
+def _extract_page_range(file_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """Process-pool task: extract pages start..stop-1 from a private reader."""
+    with open(file_path, "rb") as pdf_file:
+        return list(_page_texts(PdfReader(pdf_file), start, stop))
+
+
+def _iter_pdf_pages(file_path: str) -> Iterator[Tuple[int, str]]:
     with open(file_path, "rb") as pdf_file:
         reader = PdfReader(pdf_file)
-        for page in reader.pages:
-            page_text: Optional[str] = page.extract_text()  # type: ignore[attr-defined]
-            if page_text:
-                text_chunks.append(page_text)
-    return "\n".join(text_chunks)
+        page_count = len(reader.pages)
+        workers = min(_pdf_workers(), page_count)
+        if workers < 2 or page_count < PDF_PARALLEL_MIN_PAGES:
+            yield from _page_texts(reader, 1, page_count + 1)
+            return
+    yield from _iter_pdf_pages_parallel(file_path, page_count, workers)
+
 
+def _iter_pdf_pages_parallel(file_path: str, page_count: int, workers: int) -> Iterator[Tuple[int, str]]:
+    """
+    Fan page ranges out to the process pool and yield their pages in order.
+
+    Ranges are small enough for several per worker (so one slow range does not idle
+    the rest) and at most two per worker are in flight, which bounds how much
+    extracted text waits in memory for the consumer. If the pool breaks, the
+    remaining pages are extracted serially.
+    """
+    range_size = max(4, math.ceil(page_count / (workers * 4)))
+    ranges = deque((start, min(start + range_size, page_count + 1)) for start in range(1, page_count + 1, range_size))
+    pool = _process_pool(workers)
+    in_flight: deque = deque()
+    next_page = 1
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < workers * 2:
+                start, stop = ranges.popleft()
+                in_flight.append((start, stop, pool.submit(_extract_page_range, file_path, start, stop)))
+            start, stop, future = in_flight[0]
+            pages = future.result()
+            in_flight.popleft()
+            yield from pages
+            next_page = stop
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        with open(file_path, "rb") as pdf_file:
+            yield from _page_texts(PdfReader(pdf_file), next_page, page_count + 1)
+    finally:
+        for _, _, future in in_flight:
+            future.cancel()
+        _release_pool(pool)
+
+
+def _extract_text_from_pdf(file_path: str) -> str:
+    _require_pdf_reader()
+    return "\n".join(page_text for _, page_text in _iter_pdf_pages(file_path))
+
+
+# The functions whose code decides each extension's output; see `extractor_version`.
+_EXTRACTION_CODE = {
+    ".txt": (iter_pages, _extract_text_from_txt, _iter_txt_pages),
+    ".pdf": (
+        iter_pages, _extract_text_from_pdf, _iter_pdf_pages, _iter_pdf_pages_parallel, _extract_page_range,
+        _page_texts,
+    ),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def extractor_version(extension: str) -> str:
+    """
+    Identifier of everything that decides the text extracted from an `extension` file:
+    EXTRACTION_VERSION, the source of the extraction functions and, for PDFs, the
+    installed PyPDF2 version. Caches keyed by it go stale automatically when any changes.
+    """
+    extension = extension.lower()
+    if extension not in _EXTRACTION_CODE:
+        raise ValueError(f"Unsupported file extension: {extension}. Only .txt and .pdf are supported.")
+    fingerprint = hashlib.sha256(f"{EXTRACTION_VERSION}{extension}".encode("utf-8"))
+    for function in _EXTRACTION_CODE[extension]:
+        try:
+            fingerprint.update(inspect.getsource(function).encode("utf-8"))
+        except (OSError, TypeError):  # pragma: no cover - source not shipped
+            fingerprint.update(function.__code__.co_code)
+    if extension == ".pdf":
+        fingerprint.update(_pdf_library_version().encode("utf-8"))
+    return fingerprint.hexdigest()[:16]
+
+
+def _pdf_library_version() -> str:
+    if PdfReader is None:
+        return "unavailable"
+    try:
+        from importlib.metadata import version
 
+        return version("PyPDF2")
+    except Exception:  # pragma: no cover - not installed as a distribution
+        import PyPDF2  # type: ignore
 
+        return getattr(PyPDF2, "__version__", "unknown")
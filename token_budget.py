@@ -0,0 +1,243 @@
+"""
+Token estimation and input shaping for prompts built around user-supplied text.
+
+`estimate_tokens` approximates a SentencePiece/BPE token count without a
+tokenizer: short words count as one token, long words as one per six
+characters, digits and punctuation as one each, and CJK characters as one each.
+Texts longer than `_EXACT_LIMIT` characters are estimated from evenly spaced
+samples, so even a 16 MB upload is sized in milliseconds.
+
+`shape_text` then decides how much of the text a model gets:
+
+    as_is           the text fits the budget and is sent unchanged
+    split           it fits in `max_chunks` budget-sized pieces; each piece gets its own call
+    truncate        it is too large; the head and tail are kept, whole paragraphs and
+                    sentences where possible, with a marker where the middle was cut
+    truncate_split  truncated to `max_chunks` budgets, then split
+
+Pieces are always cut on paragraph, then sentence or line, then word boundaries,
+and keep the original formatting of the text they were cut from.
+"""
+from __future__ import annotations
+
+import math
+import re
+from typing import Dict, Iterator, List, Tuple
+
+_EXACT_LIMIT = 200_000
+_SAMPLES = 32
+_SAMPLE_CHARS = 4096
+# Generous upper bound on characters per token, used to bound how far truncation scans.
+_MAX_CHARS_PER_TOKEN = 16
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_CJK_RE = re.compile(f"[{_CJK}]")
+_DIGIT_RE = re.compile(r"\d")
+_WORD_RE = re.compile(rf"[^\W\d_{_CJK}]+")
+_SYMBOL_RE = re.compile(r"[^\w\s]|_")
+# Separators between pieces, coarsest first: blank lines, sentence ends or line breaks, spaces.
+_SEPARATORS = (
+    re.compile(r"\n[ \t]*\n\s*"),
+    re.compile(r"(?<=[.!?])\s+|\s*\n\s*"),
+    re.compile(r"\s+"),
+)
+
+TRUNCATION_MARKER = "\n\n[...]\n\n"
+
+# Input context windows of the Gemini models this app is usually pointed at.
+DEFAULT_CONTEXT_TOKENS: Dict[str, int] = {
+    "models/gemini-2.0-flash": 1_048_576,
+    "models/gemini-2.0-flash-lite": 1_048_576,
+    "models/gemini-1.5-flash": 1_048_576,
+    "models/gemini-1.5-pro": 2_097_152,
+    "models/gemini-pro": 30_720,
+}
+
+Span = Tuple[int, int]
+
+
+def _count_tokens(text: str) -> int:
+    words = sum((len(word) + 5) // 6 for word in _WORD_RE.findall(text))
+    return words + len(_CJK_RE.findall(text)) + len(_DIGIT_RE.findall(text)) + len(_SYMBOL_RE.findall(text))
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate model token count of `text`; at least 1 for non-empty text."""
+    if not text:
+        return 0
+    if len(text) <= _EXACT_LIMIT:
+        return max(1, _count_tokens(text))
+    stride = len(text) // _SAMPLES
+    sampled_chars = 0
+    sampled_tokens = 0
+    for index in range(_SAMPLES):
+        sample = text[index * stride:index * stride + _SAMPLE_CHARS]
+        sampled_chars += len(sample)
+        sampled_tokens += _count_tokens(sample)
+    return max(1, round(sampled_tokens / sampled_chars * len(text)))
+
+
+def parse_token_limits(spec: str) -> Dict[str, int]:
+    """Parse "model=tokens,model=tokens" into a dict. Raises RuntimeError on a malformed entry."""
+    limits: Dict[str, int] = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, sep, value = entry.rpartition("=")
+        try:
+            if not sep or not name.strip():
+                raise ValueError(entry)
+            limits[name.strip()] = int(value)
+        except ValueError:
+            raise RuntimeError(f"Invalid token limit {entry.strip()!r}; expected model=tokens") from None
+    return limits
+
+
+class ShapedText:
+    """The outcome of `shape_text`: the pieces to send and what was done to get them."""
+
+    __slots__ = ("strategy", "chunks", "estimated_tokens", "sent_tokens", "budget_tokens")
+
+    def __init__(self, strategy: str, chunks: List[str], estimated_tokens: int, sent_tokens: int,
+                 budget_tokens: int) -> None:
+        self.strategy = strategy
+        self.chunks = chunks
+        self.estimated_tokens = estimated_tokens
+        self.sent_tokens = sent_tokens
+        self.budget_tokens = budget_tokens
+
+    @property
+    def text(self) -> str:
+        """The single piece to send; only meaningful when there is one chunk."""
+        return self.chunks[0]
+
+    def metadata(self) -> Dict[str, object]:
+        return {
+            "estimated_tokens": self.estimated_tokens,
+            "sent_tokens": self.sent_tokens,
+            "budget_tokens": self.budget_tokens,
+            "strategy": self.strategy,
+            "chunks": len(self.chunks),
+        }
+
+
+def _spans(text: str, start: int, end: int, budget: int, reverse: bool) -> Iterator[Tuple[Span, int]]:
+    """
+    Yield ((start, end), tokens) for consecutive pieces of text[start:end], each at most
+    `budget` tokens, cut at the coarsest boundary that makes them fit. Back to front if `reverse`.
+    """
+    def pieces(lo: int, hi: int, separator) -> Iterator[Span]:
+        for match in separator.finditer(text, lo, hi):
+            if match.start() > lo:
+                yield lo, match.start()
+            lo = match.end()
+        if hi > lo:
+            yield lo, hi
+
+    def walk(lo: int, hi: int, level: int) -> Iterator[Tuple[Span, int]]:
+        spans = pieces(lo, hi, _SEPARATORS[level])
+        for span in (reversed(list(spans)) if reverse else spans):
+            tokens = estimate_tokens(text[span[0]:span[1]])
+            if tokens <= budget or level == len(_SEPARATORS) - 1:
+                yield span, tokens
+            else:
+                yield from walk(span[0], span[1], level + 1)
+
+    yield from walk(start, end, 0)
+
+
+def _take(text: str, budget: int, reverse: bool = False) -> Tuple[Span | None, int]:
+    """The longest prefix (or suffix) span of `text` within `budget` tokens, and its tokens."""
+    first = last = None
+    used = 0
+    for span, tokens in _spans(text, 0, len(text), budget, reverse):
+        if used + tokens > budget:
+            break
+        used += tokens
+        if first is None:
+            first = span
+        last = span
+    if first is None:
+        return None, 0
+    return ((last[0], first[1]) if reverse else (first[0], last[1])), used
+
+
+def truncate_text(text: str, budget: int, tail_fraction: float = 0.2) -> Tuple[str, int]:
+    """
+    Cut `text` to about `budget` tokens, keeping the opening and the last `tail_fraction`
+    (introductions and conclusions carry most of a document's gist). Returns (text, tokens).
+    """
+    tail_budget = int(budget * tail_fraction)
+    head, head_tokens = _take(text[:budget * _MAX_CHARS_PER_TOKEN], budget - tail_budget)
+    if head is None:
+        # Not even one word fits; fall back to a hard character cut.
+        return text[:max(1, budget) * 4], budget
+    rest = max(head[1], len(text) - tail_budget * _MAX_CHARS_PER_TOKEN)
+    tail, tail_tokens = _take(text[rest:], tail_budget, reverse=True) if tail_budget else (None, 0)
+    parts = [text[head[0]:head[1]]]
+    if tail is not None:
+        parts.append(text[rest + tail[0]:rest + tail[1]])
+    return TRUNCATION_MARKER.join(parts), head_tokens + tail_tokens
+
+
+def split_text(text: str, budget: int, pieces: int | None = None) -> List[str]:
+    """
+    Split `text` into consecutive chunks of at most `budget` tokens, aiming for `pieces`
+    chunks of similar size so parallel calls finish together.
+    """
+    limit = budget
+    if pieces and pieces > 1:
+        limit = min(budget, math.ceil(estimate_tokens(text) / pieces * 1.15))
+    chunks: List[str] = []
+    chunk_start = chunk_end = None
+    used = 0
+    for (start, end), tokens in _spans(text, 0, len(text), limit, reverse=False):
+        if chunk_start is not None and used + tokens > limit:
+            chunks.append(text[chunk_start:chunk_end])
+            chunk_start, used = None, 0
+        if chunk_start is None:
+            chunk_start = start
+        chunk_end = end
+        used += tokens
+    if chunk_start is not None:
+        chunks.append(text[chunk_start:chunk_end])
+    return chunks or [text]
+
+
+def shape_text(text: str, budget_tokens: int, max_chunks: int = 1) -> ShapedText:
+    """
+    Decide how to send `text` to a model that should see at most `budget_tokens` of it per
+    call, using at most `max_chunks` calls. A budget of 0 or less disables shaping.
+    """
+    estimated = estimate_tokens(text)
+    if budget_tokens <= 0 or estimated <= budget_tokens:
+        return ShapedText("as_is", [text], estimated, estimated, budget_tokens)
+    max_chunks = max(1, int(max_chunks))
+    if max_chunks == 1:
+        truncated, sent = truncate_text(text, budget_tokens)
+        return ShapedText("truncate", [truncated], estimated, sent, budget_tokens)
+
+    strategy = "split"
+    source = text
+    if estimated > budget_tokens * max_chunks:
+        source, _ = truncate_text(text, int(budget_tokens * max_chunks * 0.9))
+        strategy = "truncate_split"
+    chunks = _pack(source, budget_tokens, max_chunks)
+    # Boundary-aligned chunks rarely fill their budget: keep less of the text until they
+    # come out at max_chunks, and drop any leftover chunk as a last resort.
+    fill = 0.8
+    while len(chunks) > max_chunks and fill > 0.45:
+        source, _ = truncate_text(text, int(budget_tokens * max_chunks * fill))
+        strategy = "truncate_split"
+        chunks = _pack(source, budget_tokens, max_chunks)
+        fill -= 0.1
+    chunks = chunks[:max_chunks]
+    return ShapedText(strategy, chunks, estimated, sum(estimate_tokens(c) for c in chunks), budget_tokens)
+
+
+def _pack(text: str, budget: int, max_chunks: int) -> List[str]:
+    """Evenly sized chunks of `text`, or the fewest chunks if even sizing needs more than `max_chunks`."""
+    chunks = split_text(text, budget, math.ceil(estimate_tokens(text) / budget))
+    if len(chunks) > max_chunks:
+        chunks = split_text(text, budget)
+    return chunks